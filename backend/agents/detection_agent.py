@@ -1,125 +1,76 @@
+import asyncio
 import openai
-import os
 import json
-from typing import List, Dict, Any
-from dotenv import load_dotenv
+import threading
+from typing import List, Dict, Any, Optional
+from agents.prompt_config import get_prompt_config, WINE_DETECTION_SCHEMA
+from agents.openai_client import create_chat_completion
+from services.async_bridge import run_sync
+from services.image_payload import ImagePayload
+from services.tracing import record_usage
+from services.string_distance import levenshtein_distance
+from services.wine_catalog import catalog_key
 
-# Load environment variables
-load_dotenv()
+# Fields checked for missing values when judging a detection
+DETECTION_FIELDS = ("wineries", "name", "year", "varietal", "region")
 
-# OpenAI configuration
-openai.api_key = os.getenv('OPENAI_API_KEY')
+# Tiered detection outcomes: how often each detail level produced the final result
+detection_tiers = {"scans": 0, "accepted_low": 0, "escalated": 0, "kept_low_after_escalation": 0,
+                   "escalation_reasons": {"no_wines": 0, "null_fields": 0, "unknown_varietals": 0}}
+_tiers_lock = threading.Lock()
 
-def load_prompts_config():
-    """Load prompts configuration from test_data/prompts.json"""
-    try:
-        config_path = os.path.join(os.path.dirname(__file__), '..', 'test_data', 'prompts.json')
-        with open(config_path, 'r') as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"Error loading prompts config: {e}")
-        return None
-
-def extract_wines(base64_image: str, mime_type: str) -> List[Dict[str, Any]]:
+async def extract_wines_async(image: ImagePayload, detail: Optional[str] = None) -> List[Dict[str, Any]]:
     """
     Extracts wine information from an image and returns structured wine data.
     
     Args:
-        base64_image (str): Base64 encoded image data
-        mime_type (str): MIME type of the image (e.g., 'image/jpeg')
+        image (ImagePayload): Encoded image shared across agents
+        detail (str, optional): Image detail level; defaults to the configured one
     
     Returns:
         List[Dict[str, Any]]: Array of wine objects with structured data
+    
+    Raises:
+        openai.OpenAIError: When the API keeps failing (so an outage isn't reported as "no wines")
     """
     # Load configuration (let config errors bubble up)
-    config = load_prompts_config()
-    if not config:
-        raise ValueError("Failed to load prompts configuration from test_data/prompts.json")
-    
-    # Load arrays and template from config
-    varietals = config.get("varietals", [])
-    if not varietals:
+    config = get_prompt_config()
+    if not config.varietals:
         raise ValueError("No varietals found in prompts configuration")
     
-    prompt_template = config["detection"]["prompt_template"]
-    detection_config = config["detection"]
-    
-    # Build the dynamic prompt
-    varietals_list = ", ".join(varietals)
-    final_prompt = prompt_template.format(
-        varietals_list=varietals_list
-    )
+    detection_config = config.detection
+    detail = detail or detection_config["detail"]
     
     # Debug logging
-    print(f"Detection agent: Using {len(varietals)} varietals")
-    
-    # Define JSON schema for wine detection
-    wine_schema = {
-        "type": "json_schema",
-        "json_schema": {
-            "name": "wine_detection",
-            "strict": True,
-            "schema": {
-                "type": "object",
-                "properties": {
-                    "wines": {
-                        "type": "array",
-                        "items": {
-                            "type": "object",
-                            "properties": {
-                                "wineries": {
-                                    "type": "array",
-                                    "items": {"type": "string"}
-                                },
-                                "name": {
-                                    "type": "string"
-                                },
-                                "year": {
-                                    "type": ["string", "null"]
-                                },
-                                "varietal": {
-                                    "type": "string"
-                                },
-                                "region": {
-                                    "type": ["string", "null"]
-                                }
-                            },
-                            "required": ["wineries", "name", "year", "varietal", "region"],
-                            "additionalProperties": False
-                        }
-                    }
-                },
-                "required": ["wines"],
-                "additionalProperties": False
-            }
-        }
-    }
+    print(f"Detection agent: Using {len(config.varietals)} varietals")
 
     try:
-        detection_response = openai.chat.completions.create(
+        detection_response = await create_chat_completion(
+            "detection",
             model=detection_config["model"],
             max_tokens=detection_config["max_tokens"],
             temperature=detection_config["temperature"],
-            response_format=wine_schema,
+            response_format=WINE_DETECTION_SCHEMA,
             messages=[
                 {
                     "role": "user",
                     "content": [
                         {
                             "type": "text",
-                            "text": final_prompt
+                            "text": config.detection_prompt
                         },
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:{mime_type};base64,{base64_image}",
-                                "detail": detection_config["detail"]
+                                "url": image.data_url,
+                                "detail": detail
                             }
                         }
                     ]
                 }
             ]
         )
+        record_usage(detection_response, "detection", config.version, detail)
         
         ai_response = detection_response.choices[0].message.content.strip()
         
@@ -155,7 +106,162 @@ def extract_wines(base64_image: str, mime_type: str) -> List[Dict[str, Any]]:
         
     except openai.OpenAIError as e:
         print(f"Detection agent OpenAI error: {str(e)}")
-        return []
+        raise
     except Exception as e:
         print(f"Detection agent unexpected error: {str(e)}")
-        return [] 
\ No newline at end of file
+        return []
+
+def _same_wine(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+    """Whether two detections from different tiles describe the same wine"""
+    if a.get("year") and b.get("year") and str(a["year"]) != str(b["year"]):
+        return False
+    key_a, key_b = catalog_key(a), catalog_key(b)
+    if not key_a or not key_b:
+        return False
+    # Allow a few characters of OCR noise or a name cut off at the tile edge
+    max_distance = max(2, min(len(key_a), len(key_b)) // 8)
+    if levenshtein_distance(key_a, key_b, max_distance) <= max_distance:
+        return True
+    # A name cut off at the seam is a prefix of the full one; require most of it so a
+    # producer-only detection doesn't swallow that producer's other wines
+    short, long = sorted((key_a, key_b), key=len)
+    return long.startswith(short) and len(short) >= max(12, 0.6 * len(long))
+
+def _merge_wine(kept: Dict[str, Any], duplicate: Dict[str, Any]) -> Dict[str, Any]:
+    """Combine two sightings of one wine, preferring the more complete values"""
+    merged = dict(kept)
+    for field, value in duplicate.items():
+        current = merged.get(field)
+        if not current or (isinstance(value, str) and isinstance(current, str) and len(value) > len(current)):
+            if value:
+                merged[field] = value
+    return merged
+
+def dedupe_tiled_wines(tile_results: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    Merges per-tile detections, removing wines seen twice on overlapping tile seams.
+    
+    Only wines from different tiles are merged; repeats within one tile (e.g.
+    the same wine by the glass and by the bottle) are kept as detected.
+    """
+    kept = []  # (tile index, wine)
+    for tile_index, wines in enumerate(tile_results):
+        for wine in wines:
+            for position, (kept_tile, kept_wine) in enumerate(kept):
+                if kept_tile != tile_index and _same_wine(kept_wine, wine):
+                    kept[position] = (kept_tile, _merge_wine(kept_wine, wine))
+                    break
+            else:
+                kept.append((tile_index, wine))
+    return [wine for _, wine in kept]
+
+async def extract_wines_tiled_async(tiles: List[ImagePayload]) -> List[Dict[str, Any]]:
+    """
+    Extracts wines from overlapping tiles of a large image concurrently.
+    
+    Each tile is sent at full detail, so dense multi-column menus are not
+    downsampled into illegibility, and each call produces a short completion.
+    
+    Args:
+        tiles (List[ImagePayload]): Tiles in reading order (from preprocess_tiles)
+    
+    Returns:
+        List[Dict[str, Any]]: Array of wine objects with seam duplicates removed
+    """
+    tasks = [asyncio.ensure_future(extract_wines_async(tile, "high")) for tile in tiles]
+    try:
+        tile_results = await asyncio.gather(*tasks)
+    finally:
+        # One failed tile fails the scan; stop the calls still running for the others
+        for task in tasks:
+            task.cancel()
+    wines = dedupe_tiled_wines(tile_results)
+    print(f"Detection agent: {len(tiles)} tiles, {sum(len(r) for r in tile_results)} detections, {len(wines)} unique wines")
+    return wines
+
+def escalation_reason(wines: List[Dict[str, Any]], varietals: List[str], escalation: Dict[str, Any]) -> Optional[str]:
+    """
+    Why a low-detail detection looks incomplete, or None when it can be trusted.
+    
+    Args:
+        wines (List[Dict[str, Any]]): Wines from the low-detail call
+        varietals (List[str]): Allowed varietals from the prompts config
+        escalation (Dict[str, Any]): "min_wines", "max_null_fraction", "max_unknown_varietal_fraction"
+    """
+    if len(wines) < escalation.get("min_wines", 1):
+        return "no_wines"
+    if not wines:
+        # min_wines is 0: an empty detection is accepted, and there are no fields to judge
+        return None
+    
+    values = [wine.get(field) for wine in wines for field in DETECTION_FIELDS]
+    if sum(1 for value in values if not value) / len(values) > escalation.get("max_null_fraction", 0.4):
+        return "null_fields"
+    
+    known = {varietal.casefold() for varietal in varietals}
+    unknown = sum(1 for wine in wines if str(wine.get("varietal") or "").casefold() not in known)
+    if unknown / len(wines) > escalation.get("max_unknown_varietal_fraction", 0.25):
+        return "unknown_varietals"
+    return None
+
+def _count_tier(name: str, reason: Optional[str] = None):
+    with _tiers_lock:
+        detection_tiers[name] += 1
+        if reason:
+            detection_tiers["escalation_reasons"][reason] += 1
+
+async def extract_wines_escalating_async(low_image: ImagePayload, high_image: ImagePayload) -> List[Dict[str, Any]]:
+    """
+    Tiered detection: a cheap low-detail call first, high detail only when needed.
+    
+    The low-detail result is kept unless it looks incomplete (too few wines, many
+    missing fields, or varietals outside the configured list), in which case
+    the image is detected again at high detail. Clear single labels stay on
+    the cheap tier; dense menus pay for high detail.
+    
+    Args:
+        low_image (ImagePayload): Image prepared for 'low' detail
+        high_image (ImagePayload): Image prepared for 'high' detail
+    
+    Returns:
+        List[Dict[str, Any]]: Array of wine objects with structured data
+    
+    Raises:
+        openai.OpenAIError: If the low-detail call fails, or escalation fails with nothing found at low detail
+    """
+    config = get_prompt_config()
+    _count_tier("scans")
+    
+    wines = await extract_wines_async(low_image, "low")
+    reason = escalation_reason(wines, config.varietals, config.detection.get("escalation", {}))
+    if reason is None:
+        _count_tier("accepted_low")
+        return wines
+    
+    print(f"Detection agent: Escalating to high detail ({reason})")
+    _count_tier("escalated", reason)
+    try:
+        high_wines = await extract_wines_async(high_image, "high")
+    except openai.OpenAIError as e:
+        if not wines:
+            raise
+        print(f"Detection agent: High-detail call failed, keeping low-detail result: {str(e)}")
+        high_wines = []
+    if not high_wines and wines:
+        # A failed or empty high-detail call shouldn't throw away what low detail found
+        _count_tier("kept_low_after_escalation")
+        return wines
+    return high_wines
+
+def detection_tier_stats() -> Dict[str, Any]:
+    """Return tiered detection counters and the share of scans settled at each tier"""
+    with _tiers_lock:
+        stats = dict(detection_tiers, escalation_reasons=dict(detection_tiers["escalation_reasons"]))
+    scans = stats["scans"]
+    stats["low_hit_rate"] = round(stats["accepted_low"] / scans, 4) if scans else 0.0
+    stats["escalation_rate"] = round(stats["escalated"] / scans, 4) if scans else 0.0
+    return stats
+
+def extract_wines(image: ImagePayload) -> List[Dict[str, Any]]:
+    """Synchronous wrapper around extract_wines_async"""
+    return run_sync(extract_wines_async(image))
@@ -0,0 +1,335 @@
+import asyncio
+import os
+import random
+import threading
+import time
+import weakref
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import httpx
+import openai
+from dotenv import load_dotenv
+
+from agents.prompt_config import get_prompt_config
+from services.metrics import openai_client_events
+from services.tracing import count_upstream_call, record_hedged_call, record_usage
+
+# Load environment variables
+load_dotenv()
+
+# Connection pool sizing for the shared async client
+OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', 200))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('OPENAI_MAX_KEEPALIVE_CONNECTIONS', 50))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv('OPENAI_KEEPALIVE_EXPIRY', 30))
+
+# Per-attempt timeouts in seconds for each agent's calls
+OPENAI_TIMEOUTS = {
+    "validation": float(os.getenv('OPENAI_TIMEOUT_VALIDATION', 15)),
+    "detection": float(os.getenv('OPENAI_TIMEOUT_DETECTION', 60)),
+    "sommelier": float(os.getenv('OPENAI_TIMEOUT_SOMMELIER', 60)),
+}
+
+# Retries of transient failures (timeouts, connection errors, 429, 5xx) with full-jitter backoff
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', 2))
+OPENAI_RETRY_BASE_DELAY = float(os.getenv('OPENAI_RETRY_BASE_DELAY', 0.5))
+OPENAI_RETRY_MAX_DELAY = float(os.getenv('OPENAI_RETRY_MAX_DELAY', 8))
+
+# Circuit breaker per stage: open after this many transient failures in a row, for cooldown seconds
+OPENAI_BREAKER_FAILURES = int(os.getenv('OPENAI_BREAKER_FAILURES', 5))
+OPENAI_BREAKER_COOLDOWN = float(os.getenv('OPENAI_BREAKER_COOLDOWN', 30))
+
+# Hedging: send a duplicate request when an attempt runs past the stage's p95 latency
+OPENAI_HEDGE_ENABLED = os.getenv('OPENAI_HEDGE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+OPENAI_HEDGE_QUANTILE = float(os.getenv('OPENAI_HEDGE_QUANTILE', 0.95))
+OPENAI_HEDGE_MIN_SAMPLES = int(os.getenv('OPENAI_HEDGE_MIN_SAMPLES', 20))
+LATENCY_WINDOW = 200
+
+# httpx connection pools are bound to the event loop they were created on,
+# so one client is kept per running loop (normally there is exactly one).
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, openai.AsyncOpenAI]" = weakref.WeakKeyDictionary()
+
+
+async def _on_request(request: httpx.Request):
+    """httpx event hook: count every API request (including retries and hedges) against the current scan"""
+    count_upstream_call()
+
+
+def get_async_client() -> openai.AsyncOpenAI:
+    """
+    Returns the shared AsyncOpenAI client for the running event loop.
+
+    The client keeps a keep-alive connection pool so concurrent scans reuse
+    TLS connections to the API instead of opening one per call. SDK retries
+    are off; create_chat_completion() retries with its own policy.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = openai.AsyncOpenAI(
+            api_key=os.getenv('OPENAI_API_KEY'),
+            max_retries=0,
+            http_client=openai.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY
+                ),
+                event_hooks={"request": [_on_request]}
+            )
+        )
+        _async_clients[loop] = client
+    return client
+
+
+class CircuitOpenError(openai.OpenAIError):
+    """Raised without calling the API while a stage's circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Stops calling the API after repeated transient failures.
+
+    After failure_threshold transient failures in a row the circuit opens and
+    calls fail fast with CircuitOpenError for cooldown seconds. Then one trial
+    call is let through (half-open): success closes the circuit, failure opens
+    it for another cooldown.
+    """
+
+    def __init__(self, failure_threshold: int = OPENAI_BREAKER_FAILURES, cooldown: float = OPENAI_BREAKER_COOLDOWN):
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.opens = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """Whether a call may go out now (claims the trial call when half-open)"""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.cooldown or self.trial_in_flight:
+                self.rejected += 1
+                return False
+            self.trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_in_flight or (self.opened_at is None and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                self.opens += 1
+            self.trial_in_flight = False
+
+    def abandon(self):
+        """A call ended without an outcome (cancelled); free the trial slot"""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def state(self) -> str:
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            return "open" if time.monotonic() - self.opened_at < self.cooldown else "half_open"
+
+
+class LatencyWindow:
+    """Durations of a stage's recent successful calls, for the hedging delay"""
+
+    def __init__(self, size: int = LATENCY_WINDOW):
+        self._samples: deque = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q: float, min_samples: int = OPENAI_HEDGE_MIN_SAMPLES) -> Optional[float]:
+        """The q-quantile of recent durations, or None with too few samples"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples or len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+_breakers: Dict[str, CircuitBreaker] = {stage: CircuitBreaker() for stage in OPENAI_TIMEOUTS}
+_latencies: Dict[str, LatencyWindow] = {stage: LatencyWindow() for stage in OPENAI_TIMEOUTS}
+_stats_lock = threading.Lock()
+_stats: Dict[str, Dict[str, int]] = {
+    stage: {"calls": 0, "attempts": 0, "retries": 0, "timeouts": 0, "errors": 0, "hedges": 0, "hedge_wins": 0}
+    for stage in OPENAI_TIMEOUTS
+}
+
+
+def _count(stage: str, event: str):
+    with _stats_lock:
+        _stats[stage][event] += 1
+    if event not in ("calls", "attempts"):
+        openai_client_events.inc(stage=stage, event=event)
+
+
+def is_transient(error: Exception) -> bool:
+    """Whether a failed call is worth retrying (and counts against the circuit breaker)"""
+    if isinstance(error, openai.APIConnectionError):  # includes APITimeoutError
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def retry_delay(attempt: int, error: Exception) -> float:
+    """Full-jitter exponential backoff, stretched to the server's Retry-After when it sends one"""
+    delay = random.uniform(0, min(OPENAI_RETRY_MAX_DELAY, OPENAI_RETRY_BASE_DELAY * 2 ** attempt))
+    if isinstance(error, openai.APIStatusError):
+        try:
+            delay = max(delay, float(error.response.headers.get("retry-after", 0)))
+        except ValueError:
+            pass
+    return min(delay, OPENAI_RETRY_MAX_DELAY)
+
+
+async def _attempt(stage: str, kwargs: Dict[str, Any]):
+    """One API call, guarded by the stage's circuit breaker and timeout"""
+    breaker = _breakers[stage]
+    if not breaker.allow():
+        raise CircuitOpenError(f"OpenAI {stage} calls suspended after repeated failures (circuit open)")
+
+    _count(stage, "attempts")
+    started = time.perf_counter()
+    try:
+        response = await get_async_client().chat.completions.create(timeout=OPENAI_TIMEOUTS[stage], **kwargs)
+    except openai.OpenAIError as e:
+        if isinstance(e, openai.APITimeoutError):
+            _count(stage, "timeouts")
+        if is_transient(e):
+            breaker.record_failure()
+        else:
+            breaker.record_success()  # The API answered; the request itself was bad
+        raise
+    except BaseException:
+        breaker.abandon()
+        raise
+    breaker.record_success()
+    _latencies[stage].add(time.perf_counter() - started)
+    return response
+
+
+def request_detail(messages: Any) -> Optional[str]:
+    """Image detail level of a chat request (None for text-only requests)"""
+    for message in messages or ():
+        content = message.get("content") if isinstance(message, dict) else None
+        for part in content if isinstance(content, list) else ():
+            if isinstance(part, dict) and part.get("type") == "image_url":
+                return part.get("image_url", {}).get("detail", "auto")
+    return None
+
+
+def _charge_loser(stage: str, task: asyncio.Future, detail: Optional[str]):
+    """Account for the hedged request that lost: its usage if it finished, an estimate if it is cancelled"""
+    version = get_prompt_config().version
+    if not task.done():
+        task.cancel()
+        record_hedged_call(stage, version, detail)
+    elif not task.cancelled() and task.exception() is None:
+        record_usage(task.result(), stage, version, detail)
+
+
+async def _hedged(stage: str, call: Callable[[], Awaitable[Any]], detail: Optional[str] = None):
+    """
+    Run call(), starting a duplicate when the first one outlasts the stage's p95.
+
+    The first successful response wins and the other request is cancelled; if
+    both fail, the first request's error is raised. The losing request was
+    still sent, so its tokens are charged to the ledger (the caller records
+    the winner's usage as usual).
+    """
+    delay = _latencies[stage].quantile(OPENAI_HEDGE_QUANTILE) if OPENAI_HEDGE_ENABLED else None
+    if delay is None:
+        return await call()
+
+    primary = asyncio.ensure_future(call())
+    tasks = [primary]
+    winner = None
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            _count(stage, "hedges")
+            tasks.append(asyncio.ensure_future(call()))
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    winner = task
+                    if task is not primary:
+                        _count(stage, "hedge_wins")
+                    return task.result()
+        raise primary.exception()
+    finally:
+        for task in tasks:
+            if winner is not None and task is not winner:
+                _charge_loser(stage, task, detail)
+            elif not task.done():
+                task.cancel()
+
+
+async def create_chat_completion(stage: str, **kwargs):
+    """
+    Chat completion through the shared client with the stage's resilience policy.
+
+    Each attempt has the stage's timeout (OPENAI_TIMEOUT_*) and, with hedging
+    on, may get a duplicate request past the stage's p95 latency. Transient
+    failures are retried with jittered backoff; a stage whose calls keep
+    failing trips its circuit breaker and fails fast until the cooldown ends.
+
+    Args:
+        stage (str): "validation", "detection" or "sommelier"
+        **kwargs: Arguments for chat.completions.create
+
+    Raises:
+        openai.OpenAIError: The last error once retries are used up (CircuitOpenError when the circuit is open)
+    """
+    _count(stage, "calls")
+    detail = request_detail(kwargs.get("messages"))
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        try:
+            return await _hedged(stage, lambda: _attempt(stage, kwargs), detail)
+        except CircuitOpenError:
+            _count(stage, "errors")
+            raise
+        except openai.OpenAIError as e:
+            if attempt == OPENAI_MAX_RETRIES or not is_transient(e):
+                _count(stage, "errors")
+                raise
+            delay = retry_delay(attempt, e)
+            _count(stage, "retries")
+            print(f"OpenAI client: {stage} attempt {attempt + 1} failed ({type(e).__name__}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+
+def openai_client_stats() -> Dict[str, Any]:
+    """Per-stage call, retry, timeout and hedge counters, circuit state and recent p95 latency"""
+    with _stats_lock:
+        counters = {stage: dict(values) for stage, values in _stats.items()}
+    stats = {}
+    for stage, values in counters.items():
+        breaker = _breakers[stage]
+        p95 = _latencies[stage].quantile(0.95, min_samples=1)
+        stats[stage] = {
+            **values,
+            "timeout_seconds": OPENAI_TIMEOUTS[stage],
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "circuit": {"state": breaker.state(), "opens": breaker.opens, "rejected": breaker.rejected},
+        }
+    return {"max_retries": OPENAI_MAX_RETRIES, "hedging": OPENAI_HEDGE_ENABLED, "stages": stats}
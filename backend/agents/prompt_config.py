@@ -0,0 +1,224 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+# Default location of the prompts configuration
+PROMPTS_CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', 'test_data', 'prompts.json')
+
+# JSON schema for wine detection (structured outputs)
+WINE_DETECTION_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "wine_detection",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "wines": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "wineries": {
+                                "type": "array",
+                                "items": {"type": "string"}
+                            },
+                            "name": {
+                                "type": "string"
+                            },
+                            "year": {
+                                "type": ["string", "null"]
+                            },
+                            "varietal": {
+                                "type": "string"
+                            },
+                            "region": {
+                                "type": ["string", "null"]
+                            }
+                        },
+                        "required": ["wineries", "name", "year", "varietal", "region"],
+                        "additionalProperties": False
+                    }
+                }
+            },
+            "required": ["wines"],
+            "additionalProperties": False
+        }
+    }
+}
+
+# JSON schema for sommelier recommendations (structured outputs)
+SOMMELIER_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "sommelier_recommendations",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "wines": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "wineries": {
+                                "type": "array",
+                                "items": {"type": "string"}
+                            },
+                            "name": {
+                                "type": "string"
+                            },
+                            "year": {
+                                "type": ["string", "null"]
+                            },
+                            "varietal": {
+                                "type": "string"
+                            },
+                            "region": {
+                                "type": ["string", "null"]
+                            },
+                            "recommendation": {
+                                "type": "object",
+                                "properties": {
+                                    "rating": {
+                                        "type": "integer"
+                                    },
+                                    "match_score": {
+                                        "type": "integer"
+                                    },
+                                    "tasting_notes": {
+                                        "type": "string"
+                                    },
+                                    "food_pairing": {
+                                        "type": "string"
+                                    },
+                                    "why_recommended": {
+                                        "type": "string"
+                                    },
+                                    "price_estimate": {
+                                        "type": ["string", "null"]
+                                    }
+                                },
+                                "required": ["rating", "match_score", "tasting_notes", "food_pairing", "why_recommended", "price_estimate"],
+                                "additionalProperties": False
+                            }
+                        },
+                        "required": ["wineries", "name", "year", "varietal", "region", "recommendation"],
+                        "additionalProperties": False
+                    }
+                }
+            },
+            "required": ["wines"],
+            "additionalProperties": False
+        }
+    }
+}
+
+
+class PromptConfig:
+    """
+    Immutable snapshot of prompts.json with everything agents need pre-rendered.
+
+    Attributes:
+        raw (Dict[str, Any]): Parsed prompts.json
+        version (str): Short SHA-256 of the file contents, usable as a cache key
+        varietals (list): Allowed varietal names
+        validation (Dict[str, Any]): Validation agent settings
+        detection (Dict[str, Any]): Detection agent settings
+        sommelier (Dict[str, Any]): Sommelier agent settings
+        detection_prompt (str): Detection prompt with the varietals list injected
+        sommelier_version (str): Short SHA-256 of the sommelier settings only, so
+            recommendation caches survive edits to the other agents' prompts
+    """
+
+    __slots__ = ("raw", "version", "varietals", "validation", "detection", "sommelier", "detection_prompt",
+                 "sommelier_version")
+
+    def __init__(self, raw: Dict[str, Any], version: str):
+        self.raw = raw
+        self.version = version
+        self.varietals = raw.get("varietals", [])
+        self.validation = raw["validation"]
+        self.detection = raw["detection"]
+        self.sommelier = raw.get("sommelier", {})
+        self.detection_prompt = self.detection["prompt_template"].format(
+            varietals_list=", ".join(self.varietals)
+        )
+        self.sommelier_version = hashlib.sha256(
+            json.dumps(self.sommelier, sort_keys=True).encode("utf-8")
+        ).hexdigest()[:16]
+
+
+class PromptConfigRegistry:
+    """
+    Process-wide registry that parses prompts.json once and hot-reloads it.
+
+    The file's mtime is checked at most once per check_interval seconds; the
+    file is only re-read when the mtime or size changes. If a reload fails
+    (for example while the file is mid-edit), the last good config is kept.
+
+    Args:
+        path (str): Location of prompts.json
+        check_interval (float): Minimum seconds between mtime checks
+    """
+
+    def __init__(self, path: str = PROMPTS_CONFIG_PATH, check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._config: Optional[PromptConfig] = None
+        self._file_signature = None
+        self._last_check = 0.0
+        self.reloads = 0
+
+    def get(self) -> PromptConfig:
+        """
+        Return the current config, reloading it if the file has changed.
+
+        Raises:
+            ValueError: If the config has never been loaded successfully
+        """
+        now = time.monotonic()
+        config = self._config
+        if config is not None and now - self._last_check < self.check_interval:
+            return config
+
+        with self._lock:
+            if self._config is None or now - self._last_check >= self.check_interval:
+                self._last_check = now
+                self._reload_if_changed()
+            if self._config is None:
+                raise ValueError("Failed to load prompts configuration from test_data/prompts.json")
+            return self._config
+
+    def _reload_if_changed(self):
+        """Re-parse the file when its mtime/size signature changes (caller holds the lock)"""
+        try:
+            stat = os.stat(self.path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if signature == self._file_signature and self._config is not None:
+                return
+
+            with open(self.path, 'rb') as f:
+                contents = f.read()
+            config = PromptConfig(json.loads(contents), hashlib.sha256(contents).hexdigest()[:16])
+
+            if self._config is not None:
+                print(f"Prompt config: Reloaded prompts.json (version {config.version})")
+            self._config = config
+            self._file_signature = signature
+            self.reloads += 1
+        except Exception as e:
+            print(f"Error loading prompts config: {e}")
+
+
+# Shared registry used by all agents
+prompt_registry = PromptConfigRegistry()
+
+
+def get_prompt_config() -> PromptConfig:
+    """Return the current prompts config from the shared registry"""
+    return prompt_registry.get()
@@ -1,55 +1,133 @@
+import asyncio
 import openai
-import os
 import json
-from typing import List, Dict, Any
-from dotenv import load_dotenv
+import os
+import threading
+import time
+from typing import List, Dict, Any, Callable, Optional
+from agents.prompt_config import get_prompt_config, SOMMELIER_SCHEMA, PromptConfig
+from agents.openai_client import create_chat_completion
+from services.async_bridge import run_sync
+from services.image_payload import ImagePayload
+from services.tracing import record_usage
+from services.result_cache import ResultCache, hash_bytes
+from services.wine_catalog import catalog_key
 
-# Load environment variables
-load_dotenv()
+# Fields added to detected wines by the pipeline that are not part of the sommelier schema
+PIPELINE_FIELDS = ("wine_id", "canonical")
 
-# OpenAI configuration
-openai.api_key = os.getenv('OPENAI_API_KEY')
+# Large wine lists are split into shards that are recommended concurrently (0 disables sharding)
+SOMMELIER_SHARD_SIZE = int(os.getenv('SOMMELIER_SHARD_SIZE', 10))
+SOMMELIER_MAX_CONCURRENT_SHARDS = max(1, int(os.getenv('SOMMELIER_MAX_CONCURRENT_SHARDS', 8)))
 
-def load_prompts_config():
-    """Load prompts configuration from test_data/prompts.json"""
-    try:
-        config_path = os.path.join(os.path.dirname(__file__), '..', 'test_data', 'prompts.json')
-        with open(config_path, 'r') as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"Error loading prompts config: {e}")
-        return None
+# Sommelier modes (prompts.json "sommelier.mode"):
+#   vision - pretty-printed wine list plus the photo (default)
+#   text   - compact wine list only, no image upload
+SOMMELIER_MODES = ("vision", "text")
 
-def get_wine_recommendations(wines: List[Dict[str, Any]], base64_image: str = None, mime_type: str = None) -> List[Dict[str, Any]]:
+# Token usage and latency per mode, for comparing cost against recommendation quality
+sommelier_usage = {mode: {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "seconds": 0.0} for mode in SOMMELIER_MODES}
+_usage_lock = threading.Lock()
+
+# Recommendations cached per detected wine identity + vintage + sommelier settings
+RECOMMENDATION_CACHE_ENABLED = os.getenv('RECOMMENDATION_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+recommendation_cache = ResultCache(
+    max_entries=int(os.getenv('RECOMMENDATION_CACHE_MAX_ENTRIES', 4096)),
+    ttl_seconds=float(os.getenv('RECOMMENDATION_CACHE_TTL_SECONDS', 7 * 86400)),
+    persist_path=os.getenv('RECOMMENDATION_CACHE_PATH') or None,
+    name="Recommendation cache"
+)
+
+def recommendation_key(wine: Dict[str, Any], config: PromptConfig) -> Optional[str]:
     """
-    Provides sommelier recommendations for detected wines.
-    
-    Args:
-        wines (List[Dict[str, Any]]): Array of detected wine objects from detection agent
-        base64_image (str, optional): Base64 encoded image data for additional context
-        mime_type (str, optional): MIME type of the image
+    Cache key for one wine's recommendation: the detection's own normalized
+    identity, vintage and sommelier settings (None when the wine has no name to key on).
     
-    Returns:
-        List[Dict[str, Any]]: Array of wine objects with added sommelier recommendations
+    The catalog wine_id is deliberately not used: a fuzzy catalog match can be
+    wrong, and the key must not hand one wine another wine's recommendation.
     """
-    # Load configuration
-    config = load_prompts_config()
-    if not config:
-        raise ValueError("Failed to load prompts configuration from test_data/prompts.json")
+    identity = catalog_key(wine)
+    if not identity:
+        return None
+    return hash_bytes(json.dumps([identity, str(wine.get("year")), config.sommelier_version]).encode("utf-8"))
+
+def uncached_wines(wines: List[Dict[str, Any]], config: PromptConfig) -> List[int]:
+    """Positions of the wines the sommelier would send to the model (no cached recommendation yet)"""
+    if not RECOMMENDATION_CACHE_ENABLED:
+        return list(range(len(wines)))
+    keys = [recommendation_key(wine, config) for wine in wines]
+    return [i for i, key in enumerate(keys) if not key or not recommendation_cache.contains(key)]
+
+def sommelier_mode(sommelier_config: Dict[str, Any]) -> str:
+    """Configured sommelier mode, defaulting to vision for unknown values"""
+    mode = sommelier_config.get("mode", "vision")
+    return mode if mode in SOMMELIER_MODES else "vision"
+
+def format_wine_list(wines: List[Dict[str, Any]], mode: str) -> str:
+    """Serialize wines for the prompt: indented JSON, or minimal JSON without null/empty fields in text mode"""
+    if mode == "text":
+        compact = [{k: v for k, v in wine.items() if v not in (None, "", [])} for wine in wines]
+        return json.dumps(compact, separators=(",", ":"), ensure_ascii=False)
+    return json.dumps(wines, indent=2)
+
+def _record_mode_usage(mode: str, response, seconds: float):
+    usage = getattr(response, "usage", None)
+    with _usage_lock:
+        stats = sommelier_usage[mode]
+        stats["calls"] += 1
+        stats["seconds"] += seconds
+        if usage is not None:
+            stats["prompt_tokens"] += usage.prompt_tokens or 0
+            stats["completion_tokens"] += usage.completion_tokens or 0
+
+def sommelier_usage_stats() -> Dict[str, Any]:
+    """Per-mode call counts with average tokens and latency per call"""
+    with _usage_lock:
+        return {
+            mode: {
+                **stats,
+                "seconds": round(stats["seconds"], 3),
+                "avg_prompt_tokens": round(stats["prompt_tokens"] / stats["calls"], 1) if stats["calls"] else 0.0,
+                "avg_completion_tokens": round(stats["completion_tokens"] / stats["calls"], 1) if stats["calls"] else 0.0,
+                "avg_seconds": round(stats["seconds"] / stats["calls"], 3) if stats["calls"] else 0.0,
+            }
+            for mode, stats in sommelier_usage.items()
+        }
+
+def _prompt_wine(wine: Dict[str, Any]) -> Dict[str, Any]:
+    """Wine as sent to the model (without pipeline-only fields)"""
+    return {k: v for k, v in wine.items() if k not in PIPELINE_FIELDS}
+
+def _align_recommendations(wines: List[Dict[str, Any]], recommended_wines: List[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+    """
+    Pair the model's wines with the requested ones and return one recommendation (or None) per requested wine.
     
-    if not wines:
-        return []
+    The model is asked to keep the original order, so wines are paired by position
+    when the counts agree and by normalized identity otherwise.
+    """
+    if len(recommended_wines) == len(wines):
+        return [r.get("recommendation") if isinstance(r, dict) else None for r in recommended_wines]
     
-    # Get sommelier configuration
-    sommelier_config = config.get("sommelier", {})
-    if not sommelier_config:
-        raise ValueError("No sommelier configuration found in prompts.json")
+    by_key = {}
+    for recommended in recommended_wines:
+        if isinstance(recommended, dict) and recommended.get("recommendation"):
+            by_key.setdefault((catalog_key(recommended), str(recommended.get("year"))), recommended["recommendation"])
+    return [by_key.get((catalog_key(wine), str(wine.get("year")))) for wine in wines]
+
+async def _request_recommendations(wines: List[Dict[str, Any]], image: Optional[ImagePayload],
+                                   sommelier_config: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+    """
+    Asks the model for recommendations on a list of wines.
     
+    Returns:
+        Optional[List[Dict[str, Any]]]: The model's wines array, or None if the call failed
+    """
     prompt_template = sommelier_config["prompt_template"]
     sommelier_profile = sommelier_config["profile"]
+    mode = sommelier_mode(sommelier_config)
     
     # Build wine list string for the prompt
-    wine_list = json.dumps(wines, indent=2)
+    wine_list = format_wine_list(wines, mode)
     
     # Build the dynamic prompt
     final_prompt = prompt_template.format(
@@ -57,76 +135,6 @@ def get_wine_recommendations(wines: List[Dict[str, Any]], base64_image: str = No
         sommelier_profile=sommelier_profile
     )
     
-    # Debug logging
-    print(f"Sommelier agent: Processing {len(wines)} wines")
-    
-    # Define JSON schema for sommelier recommendations
-    sommelier_schema = {
-        "type": "json_schema",
-        "json_schema": {
-            "name": "sommelier_recommendations",
-            "strict": True,
-            "schema": {
-                "type": "object",
-                "properties": {
-                    "wines": {
-                        "type": "array",
-                        "items": {
-                            "type": "object",
-                            "properties": {
-                                "wineries": {
-                                    "type": "array",
-                                    "items": {"type": "string"}
-                                },
-                                "name": {
-                                    "type": "string"
-                                },
-                                "year": {
-                                    "type": ["string", "null"]
-                                },
-                                "varietal": {
-                                    "type": "string"
-                                },
-                                "region": {
-                                    "type": ["string", "null"]
-                                },
-                                "recommendation": {
-                                    "type": "object",
-                                    "properties": {
-                                        "rating": {
-                                            "type": "integer"
-                                        },
-                                        "match_score": {
-                                            "type": "integer"
-                                        },
-                                        "tasting_notes": {
-                                            "type": "string"
-                                        },
-                                        "food_pairing": {
-                                            "type": "string"
-                                        },
-                                        "why_recommended": {
-                                            "type": "string"
-                                        },
-                                        "price_estimate": {
-                                            "type": ["string", "null"]
-                                        }
-                                    },
-                                    "required": ["rating", "match_score", "tasting_notes", "food_pairing", "why_recommended", "price_estimate"],
-                                    "additionalProperties": False
-                                }
-                            },
-                            "required": ["wineries", "name", "year", "varietal", "region", "recommendation"],
-                            "additionalProperties": False
-                        }
-                    }
-                },
-                "required": ["wines"],
-                "additionalProperties": False
-            }
-        }
-    }
-
     try:
         # Prepare messages for OpenAI
         messages = [
@@ -141,29 +149,35 @@ def get_wine_recommendations(wines: List[Dict[str, Any]], base64_image: str = No
             }
         ]
         
-        # Add image if provided for additional context
-        if base64_image and mime_type:
+        # Add image if provided for additional context (text mode reasons over the wine list only)
+        image_detail = None
+        if image is not None and mode == "vision":
+            image_detail = sommelier_config.get("detail", "low")
             messages[0]["content"].append({
                 "type": "image_url",
                 "image_url": {
-                    "url": f"data:{mime_type};base64,{base64_image}",
-                    "detail": sommelier_config.get("detail", "low")
+                    "url": image.data_url,
+                    "detail": image_detail
                 }
             })
         
-        sommelier_response = openai.chat.completions.create(
+        started = time.perf_counter()
+        sommelier_response = await create_chat_completion(
+            "sommelier",
             model=sommelier_config["model"],
             max_tokens=sommelier_config["max_tokens"],
             temperature=sommelier_config["temperature"],
-            response_format=sommelier_schema,
+            response_format=SOMMELIER_SCHEMA,
             messages=messages
         )
+        _record_mode_usage(mode, sommelier_response, time.perf_counter() - started)
+        record_usage(sommelier_response, "sommelier", get_prompt_config().version, image_detail)
         
         ai_response = sommelier_response.choices[0].message.content.strip()
         
         if not ai_response:
             print("Sommelier agent: No AI response received")
-            return wines  # Return original wines without recommendations
+            return None
         
         # Parse JSON response
         try:
@@ -175,17 +189,127 @@ def get_wine_recommendations(wines: List[Dict[str, Any]], base64_image: str = No
             # Validate that it's an array
             if not isinstance(recommended_wines, list):
                 print("Sommelier agent: Invalid response format (wines not array)")
-                return wines  # Return original wines without recommendations
+                return None
             
             return recommended_wines
             
         except json.JSONDecodeError as e:
             print(f"Sommelier agent: JSON parse error: {str(e)}")
-            return wines  # Return original wines without recommendations
+            return None
         
     except openai.OpenAIError as e:
         print(f"Sommelier agent OpenAI error: {str(e)}")
-        return wines  # Return original wines without recommendations
+        return None
     except Exception as e:
         print(f"Sommelier agent unexpected error: {str(e)}")
-        return wines  # Return original wines without recommendations 
\ No newline at end of file
+        return None
+
+def shard_indices(indices: List[int], shard_size: int) -> List[List[int]]:
+    """Split wine positions into consecutive shards of at most shard_size (one shard if shard_size <= 0)"""
+    if shard_size <= 0:
+        return [indices]
+    return [indices[start:start + shard_size] for start in range(0, len(indices), shard_size)]
+
+async def _recommend_shards(wines: List[Dict[str, Any]], pending: List[int], image: Optional[ImagePayload],
+                            sommelier_config: Dict[str, Any],
+                            on_shard: Callable[[List[int], Dict[int, Dict[str, Any]]], None]):
+    """
+    Requests recommendations for the pending wines, one model call per shard.
+    
+    Shards run concurrently (at most SOMMELIER_MAX_CONCURRENT_SHARDS at a time)
+    so latency stays close to that of a single shard as menus grow. Each shard
+    is handed to on_shard(shard positions, {wine position: recommendation}) as
+    soon as it finishes, so callers can stream and cache it without waiting for
+    the slowest shard. A failed shard only leaves its own wines without
+    recommendations.
+    """
+    semaphore = asyncio.Semaphore(SOMMELIER_MAX_CONCURRENT_SHARDS)
+    
+    async def run_shard(shard: List[int]):
+        shard_wines = [_prompt_wine(wines[i]) for i in shard]
+        async with semaphore:
+            recommended_wines = await _request_recommendations(shard_wines, image, sommelier_config)
+        if recommended_wines is None:
+            return shard, {}
+        aligned = _align_recommendations(shard_wines, recommended_wines)
+        return shard, {i: recommendation for i, recommendation in zip(shard, aligned) if recommendation}
+    
+    shards = shard_indices(pending, SOMMELIER_SHARD_SIZE)
+    if len(shards) > 1:
+        print(f"Sommelier agent: Splitting {len(pending)} wines into {len(shards)} shards")
+    
+    tasks = [asyncio.ensure_future(run_shard(shard)) for shard in shards]
+    try:
+        for next_shard in asyncio.as_completed(tasks):
+            on_shard(*await next_shard)
+    finally:
+        # Stop the remaining shards if the caller goes away or a shard raised
+        for task in tasks:
+            task.cancel()
+
+def _with_recommendation(wine: Dict[str, Any], recommendation: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Wine with its recommendation added (wines without one are returned as detected)"""
+    return {**wine, "recommendation": recommendation} if recommendation else wine
+
+async def get_wine_recommendations_async(wines: List[Dict[str, Any]], image: ImagePayload = None,
+                                         on_recommendations: Optional[Callable[[Dict[int, Dict[str, Any]]], None]] = None
+                                         ) -> List[Dict[str, Any]]:
+    """
+    Provides sommelier recommendations for detected wines.
+    
+    Recommendations are cached per wine, so only wines without a cached
+    recommendation are sent to the model, in concurrent shards of
+    SOMMELIER_SHARD_SIZE wines; results are merged back in the original order.
+    
+    Args:
+        wines (List[Dict[str, Any]]): Array of detected wine objects from detection agent
+        image (ImagePayload, optional): Encoded image shared across agents, for additional context
+        on_recommendations (Callable, optional): Called with {wine position: wine} for the cached
+            wines first, then for each shard as soon as it finishes (for streaming)
+    
+    Returns:
+        List[Dict[str, Any]]: Array of wine objects with added sommelier recommendations
+            (wines the model could not recommend are returned unchanged)
+    """
+    # Load configuration
+    config = get_prompt_config()
+    
+    if not wines:
+        return []
+    
+    # Get sommelier configuration
+    sommelier_config = config.sommelier
+    if not sommelier_config:
+        raise ValueError("No sommelier configuration found in prompts.json")
+    
+    # Serve what we can from the per-wine cache
+    keys = [recommendation_key(wine, config) for wine in wines]
+    if RECOMMENDATION_CACHE_ENABLED:
+        recommendations = [recommendation_cache.get(key) if key else None for key in keys]
+    else:
+        recommendations = [None] * len(wines)
+    pending = [i for i, recommendation in enumerate(recommendations) if recommendation is None]
+    
+    # Debug logging
+    print(f"Sommelier agent: Processing {len(pending)} wines ({len(wines) - len(pending)} cached)")
+    
+    cached = [i for i in range(len(wines)) if recommendations[i] is not None]
+    if on_recommendations and cached:
+        on_recommendations({i: _with_recommendation(wines[i], recommendations[i]) for i in cached})
+    
+    def finish_shard(shard: List[int], shard_recommendations: Dict[int, Dict[str, Any]]):
+        for i in shard:
+            recommendations[i] = shard_recommendations.get(i)
+            if recommendations[i] and RECOMMENDATION_CACHE_ENABLED and keys[i]:
+                recommendation_cache.set(keys[i], recommendations[i])
+        if on_recommendations:
+            on_recommendations({i: _with_recommendation(wines[i], recommendations[i]) for i in shard})
+    
+    if pending:
+        await _recommend_shards(wines, pending, image, sommelier_config, finish_shard)
+    
+    return [_with_recommendation(wine, recommendation) for wine, recommendation in zip(wines, recommendations)]
+
+def get_wine_recommendations(wines: List[Dict[str, Any]], image: ImagePayload = None) -> List[Dict[str, Any]]:
+    """Synchronous wrapper around get_wine_recommendations_async"""
+    return run_sync(get_wine_recommendations_async(wines, image))
@@ -1,44 +1,30 @@
 import openai
-import os
-import json
-from dotenv import load_dotenv
+from agents.prompt_config import get_prompt_config
+from agents.openai_client import create_chat_completion
+from services.async_bridge import run_sync
+from services.image_payload import ImagePayload
+from services.tracing import record_usage
 
-# Load environment variables
-load_dotenv()
-
-# OpenAI configuration
-openai.api_key = os.getenv('OPENAI_API_KEY')
-
-def load_prompts_config():
-    """Load prompts configuration from test_data/prompts.json"""
-    try:
-        config_path = os.path.join(os.path.dirname(__file__), '..', 'test_data', 'prompts.json')
-        with open(config_path, 'r') as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"Error loading prompts config: {e}")
-        return None
-
-def validate_wine_image(base64_image: str, mime_type: str) -> bool:
+async def validate_wine_image_async(image: ImagePayload) -> bool:
     """
     Validates if an image contains wine bottles, wine labels, or wine menu/wine list.
     
     Args:
-        base64_image (str): Base64 encoded image data
-        mime_type (str): MIME type of the image (e.g., 'image/jpeg')
+        image (ImagePayload): Encoded image shared across agents
     
     Returns:
         bool: True if image contains wine content, False otherwise
+    
+    Raises:
+        openai.OpenAIError: When the API keeps failing (so an outage isn't reported as "not wine")
     """
     # Load configuration (let config errors bubble up)
-    config = load_prompts_config()
-    if not config:
-        raise ValueError("Failed to load prompts configuration from test_data/prompts.json")
-    
-    validation_config = config["validation"]
+    config = get_prompt_config()
+    validation_config = config.validation
     
     try:
-        validation_response = openai.chat.completions.create(
+        validation_response = await create_chat_completion(
+            "validation",
             model=validation_config["model"],
             max_tokens=validation_config["max_tokens"],
             temperature=validation_config["temperature"],
@@ -53,7 +39,7 @@ def validate_wine_image(base64_image: str, mime_type: str) -> bool:
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:{mime_type};base64,{base64_image}",
+                                "url": image.data_url,
                                 "detail": validation_config["detail"]
                             }
                         }
@@ -61,6 +47,7 @@ def validate_wine_image(base64_image: str, mime_type: str) -> bool:
                 }
             ]
         )
+        record_usage(validation_response, "validation", config.version, validation_config["detail"])
         
         validation_result = validation_response.choices[0].message.content.strip().upper()
         
@@ -68,10 +55,14 @@ def validate_wine_image(base64_image: str, mime_type: str) -> bool:
         return bool(validation_result and validation_result.startswith('YES'))
         
     except openai.OpenAIError as e:
-        # Log OpenAI errors and return False for safety
+        # Retries are used up; let the caller report the failure instead of caching a NO
         print(f"Validation agent OpenAI error: {str(e)}")
-        return False
+        raise
     except Exception as e:
         # Log other unexpected errors and return False for safety
         print(f"Validation agent unexpected error: {str(e)}")
-        return False 
\ No newline at end of file
+        return False
+
+def validate_wine_image(image: ImagePayload) -> bool:
+    """Synchronous wrapper around validate_wine_image_async"""
+    return run_sync(validate_wine_image_async(image))
@@ -0,0 +1,368 @@
+"""
+Asyncio-native (ASGI) server for the wine scan API.
+
+Serves the same endpoints as main.py, but every request runs on one event
+loop and the agents share a pooled AsyncOpenAI client, so a single process can
+hold hundreds of in-flight scans while they wait on the OpenAI API.
+
+Usage: uvicorn asgi:app --host 0.0.0.0 --port 5001
+   or: python3 asgi.py
+   or: python3 serve.py  (production: several worker processes, see serve.py)
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing, asynccontextmanager
+
+import anyio.to_thread
+import openai
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse, Response
+from starlette.routing import Route
+
+from services.pipeline import (
+    RESULT_CACHE_ENABLED, result_cache, iter_wine_scan, run_wine_scan, pipeline_stats,
+    iter_batch_scan, run_batch_scan, batch_summary, format_stream_event, finish_trace, format_token_usage, log
+)
+from services.uploads import read_image_upload_async, read_image_uploads_async, UploadError
+from services.image_payload import ImagePayload, request_bytes
+from agents.openai_client import get_async_client
+from services.tracing import ScanTrace
+from services.metrics import render_metrics, METRICS_CONTENT_TYPE
+from services.token_usage import token_ledger
+from services.job_queue import get_job_queue
+from services.job_worker import JOB_WORKERS, run_job_workers, wait_for_job
+from services.admission import AdmissionMiddleware, admission
+
+# Load environment variables
+load_dotenv()
+
+# Threads per process for blocking work (0 = library defaults); set by serve.py --threads
+WEB_THREADS = int(os.getenv('WEB_THREADS', 0))
+
+
+async def health_check(request):
+    return JSONResponse({"status": "healthy", "service": "wine-app-backend"})
+
+
+async def metrics(request):
+    """Scan and per-stage latency histograms and counters in the Prometheus text format"""
+    return Response(render_metrics(), headers={"Content-Type": METRICS_CONTENT_TYPE})
+
+
+async def cache_stats(request):
+    return JSONResponse({
+        "enabled": RESULT_CACHE_ENABLED,
+        "result_cache": result_cache.stats(),
+        "pipeline": pipeline_stats(),
+        "request_bytes": request_bytes.stats(),
+        "admission": admission.stats()
+    })
+
+
+async def token_usage(request):
+    """OpenAI token usage per agent and prompts config version, per-day totals and budget state"""
+    return JSONResponse(token_ledger.stats())
+
+
+async def job_stats(request):
+    return JSONResponse(await asyncio.to_thread(lambda: get_job_queue().stats()))
+
+
+async def analyze_image_file(request):
+    """
+    Analyze an uploaded image file using OpenAI Vision API
+    Expects: multipart/form-data with 'image' field containing image file
+    Returns: {"success": boolean, "description": string, "error"?: string}
+    """
+    try:
+        try:
+            async with request.form() as form:
+                file_data, mime_type, _ = await read_image_upload_async(form)
+        except UploadError as e:
+            return JSONResponse({"success": False, "description": "", "error": str(e)}, status_code=400)
+
+        # Encode once, in memory, for OpenAI
+        image = ImagePayload(file_data, mime_type)
+
+        # Call OpenAI Vision API
+        response = await get_async_client().chat.completions.create(
+            model="gpt-4o-mini",
+            max_tokens=500,
+            temperature=0.7,
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": "Please describe what you see in this image in detail. Focus on any text, menus, food items, or other relevant content."
+                        },
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": image.data_url,
+                                "detail": "low"
+                            }
+                        }
+                    ]
+                }
+            ]
+        )
+
+        description = response.choices[0].message.content
+
+        if not description:
+            return JSONResponse({
+                "success": False,
+                "description": "",
+                "error": "No description returned from API"
+            }, status_code=500)
+
+        return JSONResponse({"success": True, "description": description.strip()})
+
+    except openai.OpenAIError as e:
+        return JSONResponse({
+            "success": False,
+            "description": "",
+            "error": f"OpenAI API error: {str(e)}"
+        }, status_code=500)
+
+    except Exception:
+        return JSONResponse({"success": False, "description": "", "error": "Internal server error"}, status_code=500)
+
+
+async def wine_recommendations_endpoint(request):
+    # Placeholder mirroring main.py until wine processing logic lands
+    try:
+        data = await request.json()
+    except ValueError:
+        return JSONResponse({"error": "Request body must be JSON"}, status_code=400)
+    return JSONResponse({
+        "message": "Wine recommendations endpoint",
+        "received_data": data
+    })
+
+
+async def analyze_wine_image(request):
+    """
+    Smart endpoint: Validates image contains wine, then extracts wine data
+    Expects: multipart/form-data with 'image' field containing image file
+    Returns: {"valid": boolean, "wines": array, "error"?: string, "message"?: string}
+    """
+    log("REQUEST: /api/analyze-wine-image (async)")
+
+    trace = ScanTrace()
+    try:
+        with trace.stage("upload"):
+            async with request.form() as form:
+                file_data, mime_type, _ = await read_image_upload_async(form)
+        trace.annotate("upload", bytes=len(file_data))
+    except UploadError as e:
+        return JSONResponse({"valid": False, "wines": [], "error": str(e)}, status_code=400)
+
+    try:
+        result, cached = await run_wine_scan(file_data, mime_type, trace)
+        with trace.stage("serialize"):
+            response = JSONResponse(result, headers={"X-Cache": "HIT" if cached else "MISS"})
+        trace.annotate("serialize", bytes=len(response.body))
+        response.headers["Server-Timing"] = trace.server_timing()
+        response.headers["X-Token-Usage"] = format_token_usage(trace)
+        finish_trace(trace, "analyze", cached)
+        return response
+
+    except openai.OpenAIError as e:
+        finish_trace(trace, "analyze", outcome="error")
+        log(f"RESPONSE: ERROR - OpenAI API: {str(e)}")
+        return JSONResponse({
+            "valid": False,
+            "wines": [],
+            "error": f"OpenAI API error: {str(e)}"
+        }, status_code=500)
+
+    except Exception as e:
+        finish_trace(trace, "analyze", outcome="error")
+        log(f"RESPONSE: ERROR - Internal: {str(e)}")
+        return JSONResponse({
+            "valid": False,
+            "wines": [],
+            "error": "Internal server error"
+        }, status_code=500)
+
+
+async def analyze_wine_image_stream(request):
+    """
+    Streaming variant of /api/analyze-wine-image that emits events as each stage finishes
+    Returns: NDJSON lines (default) or Server-Sent Events (Accept: text/event-stream or ?format=sse)
+    """
+    log("REQUEST: /api/analyze-wine-image/stream (async)")
+
+    sse = request.query_params.get('format') == 'sse' or 'text/event-stream' in request.headers.get('accept', '')
+    media_type = 'text/event-stream' if sse else 'application/x-ndjson'
+
+    trace = ScanTrace()
+    try:
+        with trace.stage("upload"):
+            async with request.form() as form:
+                file_data, mime_type, _ = await read_image_upload_async(form)
+        trace.annotate("upload", bytes=len(file_data))
+    except UploadError as e:
+        return Response(format_stream_event("error", {"error": str(e)}, sse), status_code=400, media_type=media_type)
+
+    async def generate():
+        # Recorded however the stream ends: summary sent, scan failed, or client gone
+        cached, outcome = False, "cancelled"
+        try:
+            async with aclosing(iter_wine_scan(file_data, mime_type, trace)) as events:
+                async for event, data in events:
+                    with trace.stage("serialize"):
+                        line = format_stream_event(event, data, sse)
+                    trace.annotate("serialize", bytes=len(line))
+                    yield line
+                    if event == "summary":
+                        cached, outcome = data["cached"], "ok"
+        except openai.OpenAIError as e:
+            outcome = "error"
+            log(f"RESPONSE: ERROR - OpenAI API: {str(e)}")
+            yield format_stream_event("error", {"error": f"OpenAI API error: {str(e)}"}, sse)
+        except Exception as e:
+            outcome = "error"
+            log(f"RESPONSE: ERROR - Internal: {str(e)}")
+            yield format_stream_event("error", {"error": "Internal server error"}, sse)
+        finally:
+            finish_trace(trace, "stream", cached, outcome)
+
+    # Disable proxy buffering so events reach the client as soon as they are produced
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return StreamingResponse(generate(), media_type=media_type, headers=headers)
+
+
+async def analyze_wine_images(request):
+    """
+    Batch endpoint: Runs many images through the scan pipeline with bounded concurrency
+    Expects: multipart/form-data with one or more 'images' fields
+    Returns: {"results": [...], "count", "succeeded", "failed"} with results in upload order
+    """
+    log("REQUEST: /api/analyze-wine-images (async)")
+
+    try:
+        async with request.form() as form:
+            items = await read_image_uploads_async(form)
+    except UploadError as e:
+        return JSONResponse({"results": [], "error": str(e)}, status_code=400)
+
+    entries = await run_batch_scan(items)
+    summary = batch_summary(entries)
+    log(f"RESPONSE: BATCH - {summary['succeeded']}/{summary['count']} images succeeded")
+    return JSONResponse({"results": entries, **summary})
+
+
+async def analyze_wine_images_stream(request):
+    """
+    Streaming variant of /api/analyze-wine-images
+    Events: result (one per image, as each finishes) -> done (counts), or error
+    """
+    log("REQUEST: /api/analyze-wine-images/stream (async)")
+
+    sse = request.query_params.get('format') == 'sse' or 'text/event-stream' in request.headers.get('accept', '')
+    media_type = 'text/event-stream' if sse else 'application/x-ndjson'
+
+    try:
+        async with request.form() as form:
+            items = await read_image_uploads_async(form)
+    except UploadError as e:
+        return Response(format_stream_event("error", {"error": str(e)}, sse), status_code=400, media_type=media_type)
+
+    async def generate():
+        entries = []
+        async with aclosing(iter_batch_scan(items)) as results:
+            async for entry in results:
+                entries.append(entry)
+                yield format_stream_event("result", entry, sse)
+        yield format_stream_event("done", batch_summary(entries), sse)
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return StreamingResponse(generate(), media_type=media_type, headers=headers)
+
+
+async def create_job(request):
+    """
+    Queue an image for scanning and return immediately
+    Returns: 202 {"job_id", "status": "queued", "status_url"}; poll status_url for the result
+    """
+    log("REQUEST: /api/jobs (async)")
+
+    try:
+        async with request.form() as form:
+            file_data, mime_type, _ = await read_image_upload_async(form)
+            filename = form['image'].filename
+    except UploadError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    job_id = await asyncio.to_thread(get_job_queue().enqueue, file_data, mime_type, filename)
+    log(f"RESPONSE: QUEUED - job {job_id}")
+    return JSONResponse({"job_id": job_id, "status": "queued", "status_url": f"/api/jobs/{job_id}"},
+                        status_code=202)
+
+
+async def get_job(request):
+    """
+    Status of a queued scan; ?wait=N long-polls up to N seconds (max 60) for it to finish
+    Returns: {"job_id", "status": "queued"|"running"|"done"|"failed", "result"?, "error"?, ...}
+    """
+    try:
+        wait = float(request.query_params.get('wait', 0))
+    except ValueError:
+        return JSONResponse({"error": "wait must be a number of seconds"}, status_code=400)
+
+    job = await wait_for_job(get_job_queue(), request.path_params['job_id'], wait)
+    if job is None:
+        return JSONResponse({"error": "Job not found"}, status_code=404)
+    return JSONResponse(job)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    if WEB_THREADS > 0:
+        # Size the thread pools for blocking work (job queue SQLite, spooled uploads)
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=WEB_THREADS))
+        anyio.to_thread.current_default_thread_limiter().total_tokens = WEB_THREADS
+    # Optional in-process job workers (separate `python3 worker.py` processes scale independently)
+    workers = asyncio.create_task(run_job_workers(JOB_WORKERS)) if JOB_WORKERS > 0 else None
+    yield
+    if workers is not None:
+        workers.cancel()
+
+
+app = Starlette(
+    routes=[
+        Route('/health', health_check, methods=['GET']),
+        Route('/metrics', metrics, methods=['GET']),
+        Route('/api/cache-stats', cache_stats, methods=['GET']),
+        Route('/analyze-image-file', analyze_image_file, methods=['POST']),
+        Route('/api/analyze-wine-image', analyze_wine_image, methods=['POST']),
+        Route('/api/analyze-wine-image/stream', analyze_wine_image_stream, methods=['POST']),
+        Route('/api/analyze-wine-images', analyze_wine_images, methods=['POST']),
+        Route('/api/analyze-wine-images/stream', analyze_wine_images_stream, methods=['POST']),
+        Route('/api/usage', token_usage, methods=['GET']),
+        Route('/api/jobs', create_job, methods=['POST']),
+        Route('/api/jobs/stats', job_stats, methods=['GET']),
+        Route('/api/jobs/{job_id}', get_job, methods=['GET']),
+        Route('/api/wine-recommendations', wine_recommendations_endpoint, methods=['POST']),
+    ],
+    lifespan=lifespan,
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*']),
+        Middleware(AdmissionMiddleware)
+    ]
+)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    port = int(os.environ.get('PORT', 5001))
+    uvicorn.run(app, host='0.0.0.0', port=port)
@@ -10,28 +10,23 @@ import sys
 import os
 sys.path.append(os.path.dirname(__file__))
 
-from agents.detection_agent import load_prompts_config
+from agents.prompt_config import get_prompt_config
 
 def main():
     print("🍷 Wine Detection Prompt Generator")
     print("=" * 50)
     
-    # Load configuration
-    config = load_prompts_config()
-    if not config:
+    # Load configuration (detection prompt is pre-rendered by the registry)
+    try:
+        prompt_config = get_prompt_config()
+    except ValueError:
         print("❌ Error: Could not load prompts.json")
         print("💡 Make sure test_data/prompts.json exists and is valid JSON")
         return
     
-    # Load arrays and template
-    varietals = config.get("varietals", [])
-    prompt_template = config["detection"]["prompt_template"]
-    
-    # Build the dynamic prompt
-    varietals_list = ", ".join(varietals)
-    final_prompt = prompt_template.format(
-        varietals_list=varietals_list
-    )
+    config = prompt_config.raw
+    varietals = prompt_config.varietals
+    final_prompt = prompt_config.detection_prompt
     
     # Display info
     print(f"✅ Loaded {len(varietals)} varietals")
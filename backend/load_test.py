@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Load generator for /api/analyze-wine-image
+
+Sends concurrent uploads to the backend and reports throughput (RPS), error
+rate, and p50/p95/p99 latency end-to-end and per stage. Stage timings come from
+the Server-Timing header the backend returns.
+
+Pair with mock_openai_server.py to benchmark on a laptop with no network.
+
+--unique only defeats the whole-image result cache. Wines seen before are
+still answered from the per-wine recommendation cache, so sommelier load is
+understated unless the backend runs with RECOMMENDATION_CACHE_ENABLED=false.
+
+Usage: python3 load_test.py --concurrency 50 --requests 500 --unique
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+
+import httpx
+
+from services.metrics import percentile
+
+# Configuration
+API_BASE_URL = "http://localhost:5001"
+IMAGES_DIR = Path(__file__).parent / "test_data" / "images"
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
+
+
+def parse_server_timing(header):
+    """Parse 'stage;dur=12.3, other;dur=4' into {stage: seconds}"""
+    stages = {}
+    for entry in (header or "").split(","):
+        name, _, params = entry.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if name and key == "dur":
+                try:
+                    stages[name] = float(value) / 1000
+                except ValueError:
+                    pass
+    return stages
+
+
+def load_images(paths):
+    """Load upload bodies from files/directories"""
+    images = []
+    for path in paths:
+        path = Path(path)
+        files = sorted(p for p in path.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS) if path.is_dir() else [path]
+        for file in files:
+            images.append((file.name, file.read_bytes()))
+    return images
+
+
+class LoadStats:
+    """Collects per-request outcomes"""
+
+    def __init__(self):
+        self.latencies = []
+        self.stage_latencies = defaultdict(list)
+        self.statuses = Counter()
+        self.cache = Counter()
+        self.errors = 0
+
+    def record(self, status, elapsed, headers, error=False):
+        self.statuses[status] += 1
+        if error:
+            self.errors += 1
+            return
+        self.latencies.append(elapsed)
+        if headers.get("x-cache"):
+            self.cache[headers["x-cache"]] += 1
+        for stage, seconds in parse_server_timing(headers.get("server-timing")).items():
+            self.stage_latencies[stage].append(seconds)
+
+
+async def send_request(client, url, image, unique, stats):
+    filename, data = image
+    if unique:
+        # Trailing bytes after the image keep it decodable but defeat the result cache
+        data = data + os.urandom(16)
+
+    started = time.perf_counter()
+    try:
+        response = await client.post(url, files={'image': (filename, data)})
+        elapsed = time.perf_counter() - started
+        stats.record(response.status_code, elapsed, response.headers, error=response.status_code >= 400)
+    except httpx.HTTPError as e:
+        stats.record(type(e).__name__, time.perf_counter() - started, {}, error=True)
+
+
+async def run_load(args):
+    images = load_images(args.images)
+    if not images:
+        print(f"❌ No images found in {', '.join(args.images)}")
+        return None
+
+    url = f"{args.api_url}/api/analyze-wine-image"
+    stats = LoadStats()
+    queue = asyncio.Queue()
+    for i in range(args.requests):
+        queue.put_nowait(images[i % len(images)])
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        async def worker():
+            while True:
+                try:
+                    image = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await send_request(client, url, image, args.unique, stats)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        duration = time.perf_counter() - started
+
+    return stats, duration
+
+
+def build_report(stats, duration, args):
+    total = sum(stats.statuses.values())
+
+    def summarize(values):
+        return {
+            "count": len(values),
+            "p50": round(percentile(values, 50), 4),
+            "p95": round(percentile(values, 95), 4),
+            "p99": round(percentile(values, 99), 4),
+            "max": round(max(values), 4) if values else 0.0,
+        }
+
+    return {
+        "requests": total,
+        "concurrency": args.concurrency,
+        "duration_seconds": round(duration, 3),
+        "rps": round(total / duration, 2) if duration else 0.0,
+        "error_rate": round(stats.errors / total, 4) if total else 0.0,
+        "statuses": {str(k): v for k, v in stats.statuses.items()},
+        "cache": dict(stats.cache),
+        "latency": summarize(stats.latencies),
+        "stages": {stage: summarize(values) for stage, values in sorted(stats.stage_latencies.items())},
+    }
+
+
+def print_report(report):
+    print("\n" + "=" * 50)
+    print("📊 LOAD TEST SUMMARY")
+    print("=" * 50)
+    print(f"Requests: {report['requests']} (concurrency {report['concurrency']}) in {report['duration_seconds']:.2f}s")
+    print(f"Throughput: {report['rps']:.2f} req/s")
+    print(f"Error rate: {report['error_rate']:.2%}  statuses: {report['statuses']}")
+    if report["cache"]:
+        print(f"Cache: {report['cache']}")
+    print()
+    print(f"{'stage':<14}{'count':>7}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    rows = [("end-to-end", report["latency"])] + list(report["stages"].items())
+    for name, s in rows:
+        print(f"{name:<14}{s['count']:>7}{s['p50']:>9.3f}s{s['p95']:>9.3f}s{s['p99']:>9.3f}s{s['max']:>9.3f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /api/analyze-wine-image")
+    parser.add_argument("--api-url", default=API_BASE_URL)
+    parser.add_argument("--images", nargs="+", default=[str(IMAGES_DIR)], help="Image files or directories")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--unique", action="store_true",
+                        help="Make every upload unique to bypass the result cache (not the per-wine "
+                             "recommendation cache; see the module docstring)")
+    parser.add_argument("--json", metavar="PATH", help="Also write the report as JSON")
+    args = parser.parse_args()
+
+    print("🍷 Wine Analysis Load Test")
+    print("=" * 50)
+    print(f"🎯 {args.api_url} — {args.requests} requests, concurrency {args.concurrency}")
+
+    outcome = asyncio.run(run_load(args))
+    if outcome is None:
+        return
+
+    report = build_report(*outcome, args)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Report written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
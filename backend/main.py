@@ -1,17 +1,23 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
 import os
-import base64
-import tempfile
-import time
-from datetime import datetime, UTC
 from dotenv import load_dotenv
 import openai
 
-# Import our agents
-from agents.validation_agent import validate_wine_image
-from agents.detection_agent import extract_wines
-from agents.sommelier_agent import get_wine_recommendations
+# Import the scan pipeline (validation, detection and sommelier agents)
+from services.pipeline import (
+    RESULT_CACHE_ENABLED, result_cache, iter_wine_scan, run_wine_scan, pipeline_stats,
+    iter_batch_scan, run_batch_scan, batch_summary, format_stream_event, finish_trace, format_token_usage, log
+)
+from services.uploads import read_image_upload, read_image_uploads, UploadError
+from services.async_bridge import run_sync, iter_sync
+from services.image_payload import ImagePayload, request_bytes
+from services.tracing import ScanTrace
+from services.metrics import render_metrics, METRICS_CONTENT_TYPE
+from services.token_usage import token_ledger
+from services.job_queue import get_job_queue
+from services.job_worker import start_background_workers, wait_for_job
+from services.admission import admission, client_key, is_admitted_route
 
 # Load environment variables
 load_dotenv()
@@ -22,10 +28,52 @@ CORS(app)
 # OpenAI configuration
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
+@app.before_request
+def admit_scan():
+    """Turn scan requests away fast (429/503 + Retry-After) when over the rate or in-flight limits"""
+    if not is_admitted_route(request.method, request.path):
+        return None
+    client = client_key(request.headers.get('X-Forwarded-For'), request.remote_addr)
+    rejection = admission.admit(client, request.content_length)
+    if rejection is not None:
+        return jsonify({"error": rejection.error}), rejection.status, rejection.headers()
+    g.admitted_bytes = request.content_length
+    return None
+
+@app.teardown_request
+def release_scan(exc):
+    # Runs after streamed responses finish, so streams hold their slot until done
+    if 'admitted_bytes' in g:
+        admission.release(g.pop('admitted_bytes'))
+
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({"status": "healthy", "service": "wine-app-backend"})
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Scan and per-stage latency histograms and counters in the Prometheus text format"""
+    return Response(render_metrics(), mimetype=METRICS_CONTENT_TYPE)
+
+@app.route('/api/cache-stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        "enabled": RESULT_CACHE_ENABLED,
+        "result_cache": result_cache.stats(),
+        "pipeline": pipeline_stats(),
+        "request_bytes": request_bytes.stats(),
+        "admission": admission.stats()
+    })
+
+@app.route('/api/usage', methods=['GET'])
+def token_usage():
+    """OpenAI token usage per agent and prompts config version, per-day totals and budget state"""
+    return jsonify(token_ledger.stats())
+
+@app.route('/api/jobs/stats', methods=['GET'])
+def job_stats():
+    return jsonify(get_job_queue().stats())
+
 @app.route('/analyze-image-file', methods=['POST'])
 def analyze_image_file():
     """
@@ -33,80 +81,18 @@ def analyze_image_file():
     Expects: multipart/form-data with 'image' field containing image file
     Returns: {"success": boolean, "description": string, "error"?: string}
     """
-    temp_file_path = None
     try:
-        # Check if image file is in request
-        if 'image' not in request.files:
-            return jsonify({
-                "success": False,
-                "description": "",
-                "error": "No image file provided"
-            }), 400
-        
-        file = request.files['image']
-        
-        if file.filename == '':
-            return jsonify({
-                "success": False,
-                "description": "",
-                "error": "No image file selected"
-            }), 400
-        
-        # Check file size (limit to 10MB)
-        file.seek(0, os.SEEK_END)
-        file_size = file.tell()
-        file.seek(0)
-        
-        max_size = 10 * 1024 * 1024  # 10MB in bytes
-        if file_size > max_size:
-            return jsonify({
-                "success": False,
-                "description": "",
-                "error": f"File too large. Maximum size is {max_size // (1024*1024)}MB"
-            }), 400
-        
-        # Validate file type
-        allowed_extensions = {'jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp'}
-        file_extension = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else ''
-        
-        if file_extension not in allowed_extensions:
-            return jsonify({
-                "success": False,
-                "description": "",
-                "error": f"Invalid file type. Allowed: {', '.join(allowed_extensions)}"
-            }), 400
-        
-        # Map file extensions to MIME types for OpenAI
-        mime_types = {
-            'jpg': 'image/jpeg',
-            'jpeg': 'image/jpeg', 
-            'png': 'image/png',
-            'gif': 'image/gif',
-            'bmp': 'image/bmp',
-            'webp': 'image/webp'
-        }
-        mime_type = mime_types.get(file_extension, 'image/jpeg')
-        
-        # Read file data
-        file_data = file.read()
-        
-        if len(file_data) == 0:
+        try:
+            file_data, mime_type, _ = read_image_upload(request.files)
+        except UploadError as e:
             return jsonify({
                 "success": False,
                 "description": "",
-                "error": "Uploaded file contains no data"
+                "error": str(e)
             }), 400
         
-        # Create temporary file for cleanup purposes
-        timestamp = int(time.time() * 1000)
-        temp_file_path = os.path.join(tempfile.gettempdir(), f"uploaded_image_{timestamp}.{file_extension}")
-        
-        # Save to temp file
-        with open(temp_file_path, 'wb') as temp_file:
-            temp_file.write(file_data)
-        
-        # Convert to base64 for OpenAI
-        base64_image = base64.b64encode(file_data).decode('utf-8')
+        # Encode once, in memory, for OpenAI
+        image = ImagePayload(file_data, mime_type)
         
         # Call OpenAI Vision API
         response = openai.chat.completions.create(
@@ -124,7 +110,7 @@ def analyze_image_file():
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:{mime_type};base64,{base64_image}",
+                                "url": image.data_url,
                                 "detail": "low"
                             }
                         }
@@ -160,14 +146,6 @@ def analyze_image_file():
             "description": "",
             "error": "Internal server error"
         }), 500
-    
-    finally:
-        # Clean up temporary file
-        if temp_file_path and os.path.exists(temp_file_path):
-            try:
-                os.remove(temp_file_path)
-            except Exception:
-                pass  # Ignore cleanup errors
 
 @app.route('/api/analyze-wine-image', methods=['POST'])
 def analyze_wine_image():
@@ -176,131 +154,35 @@ def analyze_wine_image():
     Expects: multipart/form-data with 'image' field containing image file
     Returns: {"valid": boolean, "wines": array, "error"?: string, "message"?: string}
     """
-    timestamp = datetime.now(UTC).strftime('%Y-%m-%d %H:%M:%S.%f')[:-4]
-    print(f"[{timestamp}] REQUEST: /api/analyze-wine-image)")
+    log("REQUEST: /api/analyze-wine-image)")
     
-    temp_file_path = None
+    trace = ScanTrace()
     try:
-        # Check if image file is in request
-        if 'image' not in request.files:
-            return jsonify({
-                "valid": False,
-                "wines": [],
-                "error": "No image file provided"
-            }), 400
-        
-        file = request.files['image']
-        
-        if file.filename == '':
-            return jsonify({
-                "valid": False,
-                "wines": [],
-                "error": "No image file selected"
-            }), 400
-        
-        # Check file size (limit to 10MB)
-        file.seek(0, os.SEEK_END)
-        file_size = file.tell()
-        file.seek(0)
-        
-        max_size = 10 * 1024 * 1024  # 10MB in bytes
-        if file_size > max_size:
-            return jsonify({
-                "valid": False,
-                "wines": [],
-                "error": f"File too large. Maximum size is {max_size // (1024*1024)}MB"
-            }), 400
-        
-        # Validate file type
-        allowed_extensions = {'jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp'}
-        file_extension = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else ''
-        
-        if file_extension not in allowed_extensions:
-            return jsonify({
-                "valid": False,
-                "wines": [],
-                "error": f"Invalid file type. Allowed: {', '.join(allowed_extensions)}"
-            }), 400
-        
-        # Map file extensions to MIME types for OpenAI
-        mime_types = {
-            'jpg': 'image/jpeg',
-            'jpeg': 'image/jpeg', 
-            'png': 'image/png',
-            'gif': 'image/gif',
-            'bmp': 'image/bmp',
-            'webp': 'image/webp'
-        }
-        mime_type = mime_types.get(file_extension, 'image/jpeg')
-        
-        # Read file data
-        file_data = file.read()
-        
-        if len(file_data) == 0:
+        try:
+            with trace.stage("upload"):
+                file_data, mime_type, _ = read_image_upload(request.files)
+            trace.annotate("upload", bytes=len(file_data))
+        except UploadError as e:
             return jsonify({
                 "valid": False,
                 "wines": [],
-                "error": "Uploaded file contains no data"
+                "error": str(e)
             }), 400
         
-        # Create temporary file for cleanup purposes
-        timestamp = int(time.time() * 1000)
-        temp_file_path = os.path.join(tempfile.gettempdir(), f"wine_analysis_{timestamp}.{file_extension}")
-        
-        # Save to temp file
-        with open(temp_file_path, 'wb') as temp_file:
-            temp_file.write(file_data)
-        
-        # Convert to base64 for OpenAI
-        base64_image = base64.b64encode(file_data).decode('utf-8')
-        
-        # STEP 1: Quick validation (cheap)
-        is_valid = validate_wine_image(base64_image, mime_type)
-        
-        if not is_valid:
-            timestamp = datetime.now(UTC).strftime('%Y-%m-%d %H:%M:%S.%f')[:-4]
-            print(f"[{timestamp}] RESPONSE: FAIL - Invalid image (not wine content)")
-            return jsonify({
-                "valid": False,
-                "wines": [],
-                "message": "Image must contain wine bottles or a wine menu"
-            })
-        
-        # STEP 2: Wine detection (more expensive, but only if validation passed)
-        wines = extract_wines(base64_image, mime_type)
-        
-        if not wines:
-            timestamp = datetime.now(UTC).strftime('%Y-%m-%d %H:%M:%S.%f')[:-4]
-            print(f"[{timestamp}] RESPONSE: FAIL - No wines detected")
-            return jsonify({
-                "valid": True,
-                "wines": [],
-                "error": "No wines could be detected in the image"
-            })
-        
-        # STEP 3: Sommelier recommendations (runs in parallel with detection results)
-        try:
-            recommended_wines = get_wine_recommendations(wines, base64_image, mime_type)
-            timestamp = datetime.now(UTC).strftime('%Y-%m-%d %H:%M:%S.%f')[:-4]
-            print(f"[{timestamp}] RESPONSE: SUCCESS - Found {len(wines)} wines with sommelier recommendations")
-            return jsonify({
-                "valid": True,
-                "wines": recommended_wines,
-                "raw_detection": wines  # Include original detection results for debugging
-            })
-        except Exception as e:
-            # If sommelier fails, still return the detected wines
-            timestamp = datetime.now(UTC).strftime('%Y-%m-%d %H:%M:%S.%f')[:-4]
-            print(f"[{timestamp}] RESPONSE: PARTIAL SUCCESS - Found {len(wines)} wines, sommelier failed: {str(e)}")
-            return jsonify({
-                "valid": True,
-                "wines": wines,
-                "sommelier_error": f"Sommelier recommendations failed: {str(e)}"
-            })
+        # Validate -> detect -> sommelier (served from the result cache for repeat images)
+        result, cached = run_sync(run_wine_scan(file_data, mime_type, trace))
+        with trace.stage("serialize"):
+            response = jsonify(result)
+        trace.annotate("serialize", bytes=response.content_length or 0)
+        response.headers['X-Cache'] = 'HIT' if cached else 'MISS'
+        response.headers['Server-Timing'] = trace.server_timing()
+        response.headers['X-Token-Usage'] = format_token_usage(trace)
+        finish_trace(trace, "analyze", cached)
+        return response
         
     except openai.OpenAIError as e:
-        timestamp = datetime.now(UTC).strftime('%Y-%m-%d %H:%M:%S.%f')[:-4]
-        print(f"[{timestamp}] RESPONSE: ERROR - OpenAI API: {str(e)}")
+        finish_trace(trace, "analyze", outcome="error")
+        log(f"RESPONSE: ERROR - OpenAI API: {str(e)}")
         return jsonify({
             "valid": False,
             "wines": [],
@@ -308,21 +190,147 @@ def analyze_wine_image():
         }), 500
         
     except Exception as e:
-        timestamp = datetime.now(UTC).strftime('%Y-%m-%d %H:%M:%S.%f')[:-4]
-        print(f"[{timestamp}] RESPONSE: ERROR - Internal: {str(e)}")
+        finish_trace(trace, "analyze", outcome="error")
+        log(f"RESPONSE: ERROR - Internal: {str(e)}")
         return jsonify({
             "valid": False,
             "wines": [],
             "error": "Internal server error"
         }), 500
+
+
+@app.route('/api/analyze-wine-image/stream', methods=['POST'])
+def analyze_wine_image_stream():
+    """
+    Streaming variant of /api/analyze-wine-image that emits events as each stage finishes
+    Expects: multipart/form-data with 'image' field containing image file
+    Returns: NDJSON lines (default) or Server-Sent Events (Accept: text/event-stream or ?format=sse)
+    Events: validation -> wine (per wine) -> recommendation (per wine) -> summary, or error
+    """
+    log("REQUEST: /api/analyze-wine-image/stream")
+    
+    sse = request.args.get('format') == 'sse' or 'text/event-stream' in request.headers.get('Accept', '')
+    mimetype = 'text/event-stream' if sse else 'application/x-ndjson'
+    
+    trace = ScanTrace()
+    try:
+        with trace.stage("upload"):
+            file_data, mime_type, _ = read_image_upload(request.files)
+        trace.annotate("upload", bytes=len(file_data))
+    except UploadError as e:
+        return Response(format_stream_event("error", {"error": str(e)}, sse), status=400, mimetype=mimetype)
+    
+    def generate():
+        # Recorded however the stream ends: summary sent, scan failed, or client gone
+        cached, outcome = False, "cancelled"
+        try:
+            for event, data in iter_sync(iter_wine_scan(file_data, mime_type, trace)):
+                with trace.stage("serialize"):
+                    line = format_stream_event(event, data, sse)
+                trace.annotate("serialize", bytes=len(line))
+                yield line
+                if event == "summary":
+                    cached, outcome = data["cached"], "ok"
+        except openai.OpenAIError as e:
+            outcome = "error"
+            log(f"RESPONSE: ERROR - OpenAI API: {str(e)}")
+            yield format_stream_event("error", {"error": f"OpenAI API error: {str(e)}"}, sse)
+        except Exception as e:
+            outcome = "error"
+            log(f"RESPONSE: ERROR - Internal: {str(e)}")
+            yield format_stream_event("error", {"error": "Internal server error"}, sse)
+        finally:
+            finish_trace(trace, "stream", cached, outcome)
+    
+    # Disable proxy buffering so events reach the client as soon as they are produced
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+
+
+@app.route('/api/analyze-wine-images', methods=['POST'])
+def analyze_wine_images():
+    """
+    Batch endpoint: Runs many images through the scan pipeline with bounded concurrency
+    Expects: multipart/form-data with one or more 'images' fields
+    Returns: {"results": [{"index", "filename", "status": "ok"|"error", "cached"?, "result"?, "error"?}],
+              "count", "succeeded", "failed"} with results in upload order
+    """
+    log("REQUEST: /api/analyze-wine-images")
+    
+    try:
+        items = read_image_uploads(request.files)
+    except UploadError as e:
+        return jsonify({"results": [], "error": str(e)}), 400
+    
+    # Each image succeeds or fails on its own
+    entries = run_sync(run_batch_scan(items))
+    summary = batch_summary(entries)
+    log(f"RESPONSE: BATCH - {summary['succeeded']}/{summary['count']} images succeeded")
+    return jsonify({"results": entries, **summary})
+
+
+@app.route('/api/analyze-wine-images/stream', methods=['POST'])
+def analyze_wine_images_stream():
+    """
+    Streaming variant of /api/analyze-wine-images
+    Returns: NDJSON lines (default) or Server-Sent Events (Accept: text/event-stream or ?format=sse)
+    Events: result (one per image, as each finishes) -> done (counts), or error
+    """
+    log("REQUEST: /api/analyze-wine-images/stream")
+    
+    sse = request.args.get('format') == 'sse' or 'text/event-stream' in request.headers.get('Accept', '')
+    mimetype = 'text/event-stream' if sse else 'application/x-ndjson'
+    
+    try:
+        items = read_image_uploads(request.files)
+    except UploadError as e:
+        return Response(format_stream_event("error", {"error": str(e)}, sse), status=400, mimetype=mimetype)
+    
+    def generate():
+        entries = []
+        for entry in iter_sync(iter_batch_scan(items)):
+            entries.append(entry)
+            yield format_stream_event("result", entry, sse)
+        yield format_stream_event("done", batch_summary(entries), sse)
+    
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """
+    Queue an image for scanning and return immediately
+    Expects: multipart/form-data with 'image' field containing image file
+    Returns: 202 {"job_id", "status": "queued", "status_url"}; poll status_url for the result
+    """
+    log("REQUEST: /api/jobs")
+    
+    try:
+        file_data, mime_type, _ = read_image_upload(request.files)
+    except UploadError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    job_id = get_job_queue().enqueue(file_data, mime_type, request.files['image'].filename)
+    log(f"RESPONSE: QUEUED - job {job_id}")
+    return jsonify({"job_id": job_id, "status": "queued", "status_url": f"/api/jobs/{job_id}"}), 202
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Status of a queued scan; ?wait=N long-polls up to N seconds (max 60) for it to finish
+    Returns: {"job_id", "status": "queued"|"running"|"done"|"failed", "result"?, "error"?, ...}
+    """
+    try:
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        return jsonify({"error": "wait must be a number of seconds"}), 400
     
-    finally:
-        # Clean up temporary file
-        if temp_file_path and os.path.exists(temp_file_path):
-            try:
-                os.remove(temp_file_path)
-            except Exception:
-                pass  # Ignore cleanup errors
+    job = run_sync(wait_for_job(get_job_queue(), job_id, wait))
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
 
 
 @app.route('/api/wine-recommendations', methods=['POST'])
@@ -339,5 +347,7 @@ def wine_recommendations_endpoint():
     })
 
 if __name__ == '__main__':
+    # Optional in-process job workers (separate `python3 worker.py` processes scale independently)
+    start_background_workers()
     port = int(os.environ.get('PORT', 5001))
     app.run(host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Offline OpenAI stand-in for benchmarking the wine backend without network access.
+
+Serves an OpenAI-compatible POST /v1/chat/completions that replays recorded
+validation, detection and sommelier responses from test_data/mock_responses.json,
+with configurable per-stage latency distributions and error rates.
+
+Usage:
+    python3 mock_openai_server.py --port 8100 \\
+        --latency detection=4.0,0.4 --error-rate 0.02
+
+Then point the backend at it:
+    OPENAI_BASE_URL=http://localhost:8100/v1 OPENAI_API_KEY=mock python3 main.py
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import random
+import time
+import uuid
+from pathlib import Path
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+MOCK_RESPONSES_FILE = Path(__file__).parent / "test_data" / "mock_responses.json"
+
+# Default latency per stage: (median seconds, lognormal sigma)
+DEFAULT_LATENCY = {
+    "validation": (0.6, 0.25),
+    "detection": (4.0, 0.35),
+    "sommelier": (6.0, 0.35),
+}
+
+
+def parse_latency(values):
+    """Parse --latency stage=median[,sigma] options on top of the defaults"""
+    latency = dict(DEFAULT_LATENCY)
+    for value in values or []:
+        stage, _, spec = value.partition("=")
+        if stage not in latency:
+            raise argparse.ArgumentTypeError(f"Unknown stage '{stage}' (expected one of {', '.join(latency)})")
+        parts = [float(p) for p in spec.split(",")]
+        latency[stage] = (parts[0], parts[1] if len(parts) > 1 else latency[stage][1])
+    return latency
+
+
+def detect_stage(body):
+    """Tell which agent sent a request from its structured-output schema name"""
+    response_format = body.get("response_format") or {}
+    schema_name = (response_format.get("json_schema") or {}).get("name")
+    if schema_name == "wine_detection":
+        return "detection"
+    if schema_name == "sommelier_recommendations":
+        return "sommelier"
+    return "validation"
+
+
+def request_text_and_images(body):
+    """Collect the prompt text and image detail levels from a chat request"""
+    text, details = [], []
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            text.append(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                text.append(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                details.append((part.get("image_url") or {}).get("detail", "auto"))
+    return "\n".join(text), details
+
+
+def extract_prompt_wines(prompt):
+    """Pull the JSON wine list out of a sommelier prompt (the first top-level JSON array)"""
+    start = prompt.find("[")
+    while start != -1:
+        try:
+            wines, _ = json.JSONDecoder().raw_decode(prompt[start:])
+            if isinstance(wines, list) and all(isinstance(w, dict) for w in wines):
+                return wines
+        except json.JSONDecodeError:
+            pass
+        start = prompt.find("[", start + 1)
+    return []
+
+
+class MockOpenAI:
+    """Replays recorded responses with simulated latency and failures"""
+
+    def __init__(self, responses, latency, error_rate, error_statuses, seed=None):
+        self.responses = responses
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses
+        self.random = random.Random(seed)
+        self.recommendations = itertools.cycle(responses["sommelier"])
+        self.counts = {stage: 0 for stage in latency}
+        self.errors = 0
+
+    def sample_latency(self, stage):
+        median, sigma = self.latency[stage]
+        return self.random.lognormvariate(math.log(max(median, 1e-6)), sigma) if median > 0 else 0.0
+
+    def build_content(self, stage, prompt):
+        if stage == "validation":
+            return self.random.choice(self.responses["validation"])
+        if stage == "detection":
+            return json.dumps(self.random.choice(self.responses["detection"]))
+
+        wines = extract_prompt_wines(prompt) or self.random.choice(self.responses["detection"])["wines"]
+        recommended = []
+        for wine in wines:
+            recommended.append({
+                "wineries": wine.get("wineries", []),
+                "name": wine.get("name", ""),
+                "year": wine.get("year"),
+                "varietal": wine.get("varietal", ""),
+                "region": wine.get("region"),
+                "recommendation": next(self.recommendations),
+            })
+        return json.dumps({"wines": recommended})
+
+    async def chat_completions(self, request):
+        body = await request.json()
+        stage = detect_stage(body)
+        prompt, details = request_text_and_images(body)
+        self.counts[stage] += 1
+
+        await asyncio.sleep(self.sample_latency(stage))
+
+        if self.random.random() < self.error_rate:
+            self.errors += 1
+            status = self.random.choice(self.error_statuses)
+            return JSONResponse({"error": {
+                "message": f"Mock upstream error ({status})",
+                "type": "server_error" if status >= 500 else "rate_limit_error",
+                "code": None
+            }}, status_code=status)
+
+        content = self.build_content(stage, prompt)
+        # Rough token estimate: ~4 characters per token, OpenAI image token costs
+        image_tokens = sum(85 if detail == "low" else 765 for detail in details)
+        prompt_tokens = len(prompt) // 4 + image_tokens
+        completion_tokens = max(1, len(content) // 4)
+
+        return JSONResponse({
+            "id": f"chatcmpl-mock-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        })
+
+    async def stats(self, request):
+        return JSONResponse({"requests": self.counts, "errors": self.errors})
+
+
+def build_app(mock):
+    return Starlette(routes=[
+        Route('/v1/chat/completions', mock.chat_completions, methods=['POST']),
+        Route('/chat/completions', mock.chat_completions, methods=['POST']),
+        Route('/stats', mock.stats, methods=['GET']),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline OpenAI stand-in for load testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--responses", default=str(MOCK_RESPONSES_FILE), help="Recorded responses JSON file")
+    parser.add_argument("--latency", action="append", metavar="STAGE=MEDIAN[,SIGMA]",
+                        help="Lognormal latency per stage in seconds (repeatable)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail (0-1)")
+    parser.add_argument("--error-status", default="500,429", help="Comma-separated HTTP statuses used for failures")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducible runs")
+    args = parser.parse_args()
+
+    with open(args.responses, 'r') as f:
+        responses = json.load(f)
+
+    mock = MockOpenAI(
+        responses=responses,
+        latency=parse_latency(args.latency),
+        error_rate=args.error_rate,
+        error_statuses=[int(s) for s in args.error_status.split(",")],
+        seed=args.seed
+    )
+
+    print("🍷 Mock OpenAI server")
+    print("=" * 50)
+    for stage, (median, sigma) in mock.latency.items():
+        print(f"⏱️  {stage}: median {median:.2f}s, sigma {sigma:.2f}")
+    print(f"💥 Error rate: {args.error_rate:.1%} (statuses {args.error_status})")
+    print(f"💡 Backend: OPENAI_BASE_URL=http://{args.host}:{args.port}/v1 OPENAI_API_KEY=mock")
+
+    import uvicorn
+    uvicorn.run(build_app(mock), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
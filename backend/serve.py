@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Production server for the wine scan API
+
+Runs the ASGI app (asgi.py) under uvicorn with several worker processes, each
+with its own event loop, sized thread pool and admission control (in-flight
+scan and byte limits, per-client rate limits; see services/admission.py).
+`python3 main.py` stays the single-process development server.
+
+Every worker keeps its own caches, token ledger and admission limits, so the
+limits apply per process: MAX_INFLIGHT_SCANS=32 with 4 workers admits up to
+128 scans. The worker count is fixed; scaling with load (more replicas) is left
+to the platform.
+
+Usage: python3 serve.py --workers 4 --threads 32
+"""
+
+import argparse
+import os
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the wine scan API in production")
+    parser.add_argument("--host", default=os.getenv('HOST', '0.0.0.0'), help="Interface to bind")
+    parser.add_argument("--port", type=int, default=int(os.getenv('PORT', 5001)), help="Port to bind")
+    parser.add_argument("--workers", type=int, default=int(os.getenv('WEB_CONCURRENCY', 1)),
+                        help="Worker processes")
+    parser.add_argument("--threads", type=int, default=int(os.getenv('WEB_THREADS', 32)),
+                        help="Threads per worker for blocking work (job queue, spooled uploads)")
+    parser.add_argument("--keep-alive", type=int, default=int(os.getenv('WEB_KEEP_ALIVE', 5)),
+                        help="Seconds to hold idle keep-alive connections")
+    args = parser.parse_args()
+
+    # Worker processes re-import asgi.py and read their thread pool size (and,
+    # for the image preprocessing pool, the worker count) from the environment
+    os.environ['WEB_THREADS'] = str(max(1, args.threads))
+    os.environ['WEB_CONCURRENCY'] = str(max(1, args.workers))
+
+    import uvicorn
+    uvicorn.run(
+        "asgi:app",
+        host=args.host,
+        port=args.port,
+        workers=max(1, args.workers),
+        timeout_keep_alive=args.keep_alive,
+        timeout_graceful_shutdown=30
+    )
+
+
+if __name__ == "__main__":
+    main()
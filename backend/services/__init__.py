@@ -0,0 +1 @@
+# Services package for caching and pipeline infrastructure 
\ No newline at end of file
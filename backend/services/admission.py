@@ -0,0 +1,191 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from services.metrics import rejected_requests
+from services.uploads import MAX_UPLOAD_BYTES
+
+# Admission control for scan requests (per server process; 0 = unlimited)
+MAX_INFLIGHT_SCANS = int(os.getenv('MAX_INFLIGHT_SCANS', 64))
+MAX_INFLIGHT_BYTES = int(os.getenv('MAX_INFLIGHT_BYTES', 256 * 1024 * 1024))
+ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', 2))
+
+# Per-client token bucket protecting the OpenAI quota (0 requests/minute = off)
+RATE_LIMIT_PER_MINUTE = float(os.getenv('RATE_LIMIT_PER_MINUTE', 0))
+RATE_LIMIT_BURST = int(os.getenv('RATE_LIMIT_BURST', 10))
+RATE_LIMIT_MAX_CLIENTS = 10000
+
+# Routes that start scans (and spend OpenAI tokens); only their POSTs are admitted
+ADMISSION_PATHS = ('/api/analyze-wine-image', '/api/analyze-wine-images', '/api/jobs', '/analyze-image-file')
+
+
+def is_admitted_route(method: str, path: str) -> bool:
+    """Whether a request goes through admission control"""
+    return method == 'POST' and path.rstrip('/').startswith(ADMISSION_PATHS)
+
+
+def client_key(forwarded_for: Optional[str], remote_addr: Optional[str]) -> str:
+    """
+    Identify the client for rate limiting.
+
+    Behind a proxy (Railway) the client address is the last X-Forwarded-For
+    entry, the one the proxy appended; earlier entries are client-supplied.
+    """
+    if forwarded_for:
+        return forwarded_for.split(',')[-1].strip()
+    return remote_addr or 'unknown'
+
+
+class Rejection:
+    """Why a request was turned away, with the HTTP status and Retry-After seconds to send"""
+
+    __slots__ = ("status", "error", "retry_after")
+
+    def __init__(self, status: int, error: str, retry_after: int):
+        self.status = status
+        self.error = error
+        self.retry_after = retry_after
+
+    def headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(self.retry_after)}
+
+
+class AdmissionController:
+    """
+    Bounds in-flight scans and their upload bytes, and rate-limits each client.
+
+    Requests over the limits are rejected right away (503 when the server is
+    saturated, 429 when a client is over its rate) instead of queueing, so
+    latency for admitted scans stays flat under overload. A request larger
+    than the whole byte budget is still admitted when nothing else is in
+    flight.
+
+    Args:
+        max_inflight (int): Scans handled at once (0 = unlimited)
+        max_inflight_bytes (int): Upload bytes held by in-flight scans (0 = unlimited)
+        rate_per_minute (float): Sustained requests per client per minute (0 = no rate limit)
+        burst (int): Requests a client may make at once
+    """
+
+    def __init__(self, max_inflight: int = MAX_INFLIGHT_SCANS, max_inflight_bytes: int = MAX_INFLIGHT_BYTES,
+                 rate_per_minute: float = RATE_LIMIT_PER_MINUTE, burst: int = RATE_LIMIT_BURST):
+        self.max_inflight = max_inflight
+        self.max_inflight_bytes = max_inflight_bytes
+        self.rate = rate_per_minute / 60.0
+        self.burst = max(1, burst)
+        self._lock = threading.Lock()
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()  # client -> (tokens, updated)
+        self.inflight = 0
+        self.inflight_bytes = 0
+        self.peak_inflight = 0
+        self.admitted = 0
+        self.rejected_busy = 0
+        self.rejected_rate = 0
+
+    def _take_token(self, client: str, now: float) -> Optional[float]:
+        """Spend one token from the client's bucket; returns seconds until one is available if empty"""
+        tokens, updated = self._buckets.pop(client, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+        if tokens >= 1.0:
+            self._buckets[client] = (tokens - 1.0, now)
+            wait = None
+        else:
+            self._buckets[client] = (tokens, now)
+            wait = (1.0 - tokens) / self.rate
+        # Forget the least recently seen clients (their buckets would be full again anyway)
+        while len(self._buckets) > RATE_LIMIT_MAX_CLIENTS:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def admit(self, client: str, nbytes: Optional[int]) -> Optional[Rejection]:
+        """
+        Try to admit a scan request; release() must follow when it finishes.
+
+        Args:
+            client (str): Client key from client_key()
+            nbytes (int, optional): Request body size (Content-Length); assumed one max upload when unknown
+
+        Returns:
+            Optional[Rejection]: None when admitted
+        """
+        nbytes = MAX_UPLOAD_BYTES if nbytes is None else nbytes
+        with self._lock:
+            if self.max_inflight > 0 and self.inflight >= self.max_inflight:
+                self.rejected_busy += 1
+                rejected_requests.inc(reason="inflight")
+                return Rejection(503, "Server is busy, try again shortly", ADMISSION_RETRY_AFTER)
+            if (self.max_inflight_bytes > 0 and self.inflight_bytes > 0
+                    and self.inflight_bytes + nbytes > self.max_inflight_bytes):
+                self.rejected_busy += 1
+                rejected_requests.inc(reason="inflight_bytes")
+                return Rejection(503, "Server is busy, try again shortly", ADMISSION_RETRY_AFTER)
+
+            if self.rate > 0:
+                wait = self._take_token(client, time.monotonic())
+                if wait is not None:
+                    self.rejected_rate += 1
+                    rejected_requests.inc(reason="rate_limited")
+                    return Rejection(429, "Too many requests, slow down", max(1, math.ceil(wait)))
+
+            self.inflight += 1
+            self.inflight_bytes += nbytes
+            self.peak_inflight = max(self.peak_inflight, self.inflight)
+            self.admitted += 1
+            return None
+
+    def release(self, nbytes: Optional[int]):
+        """Mark an admitted request as finished (same nbytes as passed to admit)"""
+        nbytes = MAX_UPLOAD_BYTES if nbytes is None else nbytes
+        with self._lock:
+            self.inflight -= 1
+            self.inflight_bytes -= nbytes
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "inflight": self.inflight,
+                "inflight_bytes": self.inflight_bytes,
+                "peak_inflight": self.peak_inflight,
+                "max_inflight": self.max_inflight or None,
+                "max_inflight_bytes": self.max_inflight_bytes or None,
+                "rate_limit_per_minute": self.rate * 60 or None,
+                "admitted": self.admitted,
+                "rejected_busy": self.rejected_busy,
+                "rejected_rate": self.rejected_rate,
+                "clients": len(self._buckets),
+            }
+
+
+admission = AdmissionController()
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying the shared AdmissionController to scan routes"""
+
+    def __init__(self, app, controller: AdmissionController = admission):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not is_admitted_route(scope["method"], scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in scope["headers"]}
+        client = client_key(headers.get("x-forwarded-for"), (scope.get("client") or (None,))[0])
+        length = headers.get("content-length")
+        nbytes = int(length) if length and length.isdigit() else None
+
+        rejection = self.controller.admit(client, nbytes)
+        if rejection is not None:
+            from starlette.responses import JSONResponse
+            response = JSONResponse({"error": rejection.error}, status_code=rejection.status, headers=rejection.headers())
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(nbytes)
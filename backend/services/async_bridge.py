@@ -0,0 +1,50 @@
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Awaitable, Iterator, Optional
+
+# A single background event loop shared by all synchronous callers (the Flask
+# request threads). Coroutines from every thread are multiplexed onto it, so
+# OpenAI calls share one async connection pool instead of blocking a socket each.
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def get_background_loop() -> asyncio.AbstractEventLoop:
+    """Return the shared background event loop, starting its thread on first use"""
+    global _loop
+    if _loop is not None:
+        return _loop
+
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="async-bridge", daemon=True)
+            thread.start()
+            _loop = loop
+    return _loop
+
+
+def run_sync(coro: Awaitable[Any]) -> Any:
+    """
+    Runs a coroutine on the background loop and blocks until it finishes.
+
+    Must not be called from a coroutine running on the background loop itself.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_background_loop()).result()
+
+
+def iter_sync(agen: AsyncIterator[Any]) -> Iterator[Any]:
+    """
+    Iterates an async generator from synchronous code, one item at a time.
+
+    The async generator is closed on the background loop if the caller stops
+    iterating early (e.g. a streaming client disconnects).
+    """
+    try:
+        while True:
+            try:
+                yield run_sync(agen.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        run_sync(agen.aclose())
@@ -0,0 +1,91 @@
+import base64
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Union
+
+
+class ImagePayload:
+    """
+    Immutable, encode-once image payload shared by every agent in a scan.
+
+    Holds only the ready-to-send data URL (``data:<mime>;base64,<...>``); the
+    base64 text is never kept as a separate string, so one upload costs one
+    encoded copy per distinct variant instead of one per agent.
+
+    Args:
+        data (bytes | memoryview): Encoded image bytes (JPEG/PNG/...)
+        mime_type (str): MIME type of the image data
+    """
+
+    __slots__ = ("mime_type", "data_url", "nbytes")
+
+    def __init__(self, data: Union[bytes, memoryview], mime_type: str):
+        prefix = f"data:{mime_type};base64,".encode('ascii')
+        object.__setattr__(self, "mime_type", mime_type)
+        object.__setattr__(self, "data_url", (prefix + base64.b64encode(data)).decode('ascii'))
+        object.__setattr__(self, "nbytes", len(self.data_url))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ImagePayload is immutable")
+
+    def __repr__(self):
+        return f"ImagePayload({self.mime_type}, {self.nbytes} bytes)"
+
+
+class ByteAccountant:
+    """
+    Tracks bytes held by in-flight requests (uploads plus encoded payloads).
+
+    Used to compare peak memory across ingestion strategies under concurrent load.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.peak_bytes = 0
+        self.total_bytes = 0
+        self.requests = 0
+
+    def _add(self, nbytes: int):
+        with self._lock:
+            self.current_bytes += nbytes
+            self.total_bytes += max(0, nbytes)
+            self.peak_bytes = max(self.peak_bytes, self.current_bytes)
+
+    @contextmanager
+    def track(self, nbytes: int = 0) -> Iterator["_RequestBytes"]:
+        """Account for a request's buffers until the block exits"""
+        with self._lock:
+            self.requests += 1
+        request_bytes = _RequestBytes(self)
+        request_bytes.add(nbytes)
+        try:
+            yield request_bytes
+        finally:
+            self._add(-request_bytes.nbytes)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "current_bytes": self.current_bytes,
+                "peak_bytes": self.peak_bytes,
+                "total_bytes": self.total_bytes,
+                "requests": self.requests,
+                "avg_bytes_per_request": self.total_bytes // self.requests if self.requests else 0,
+            }
+
+
+class _RequestBytes:
+    """Per-request byte counter handed out by ByteAccountant.track"""
+
+    def __init__(self, accountant: ByteAccountant):
+        self._accountant = accountant
+        self.nbytes = 0
+
+    def add(self, nbytes: int):
+        self.nbytes += nbytes
+        self._accountant._add(nbytes)
+
+
+# Process-wide accounting of request buffers
+request_bytes = ByteAccountant()
@@ -0,0 +1,241 @@
+import asyncio
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from services.image_payload import ImagePayload
+from services.near_duplicates import compute_phash
+
+# Preprocessing settings
+IMAGE_PREPROCESSING = os.getenv('IMAGE_PREPROCESSING', 'true').lower() in ('1', 'true', 'yes')
+IMAGE_OUTPUT_FORMAT = os.getenv('IMAGE_OUTPUT_FORMAT', 'jpeg').lower()  # 'jpeg' or 'webp'
+IMAGE_OUTPUT_QUALITY = int(os.getenv('IMAGE_OUTPUT_QUALITY', 85))
+# Pool size is per server process: serve.py runs WEB_CONCURRENCY of them, so by
+# default they split the host's CPUs rather than each taking all of them
+IMAGE_PREPROCESS_WORKERS = int(os.getenv(
+    'IMAGE_PREPROCESS_WORKERS',
+    max(1, (os.cpu_count() or 2) // max(1, int(os.getenv('WEB_CONCURRENCY', 1))))
+))
+
+# Largest image each OpenAI detail level can actually use. 'low' is a single
+# 512px tile; 'high' is fit within 2048x2048 and then scaled so the shortest
+# side is 768px. Anything larger is downscaled by the API anyway.
+DETAIL_LIMITS = {
+    "low": {"max_side": 512, "max_short_side": None},
+    "high": {"max_side": 2048, "max_short_side": 768},
+}
+
+# Formats the OpenAI vision API accepts as-is
+OPENAI_SUPPORTED_MIME_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'image/webp'}
+
+_OUTPUT_FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp'),
+}
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def target_size(width: int, height: int, detail: str) -> Tuple[int, int]:
+    """Return the (width, height) an image should be downscaled to for a detail level"""
+    limits = DETAIL_LIMITS.get(detail, DETAIL_LIMITS["high"])
+    scale = min(1.0, limits["max_side"] / max(width, height))
+    if limits["max_short_side"]:
+        scale = min(scale, limits["max_short_side"] / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _to_rgb(image: Image.Image) -> Image.Image:
+    """Flatten transparency onto white and convert to RGB for JPEG/WebP encoding"""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        rgba = image.convert('RGBA')
+        background = Image.new('RGB', rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def prepare_image_variants(file_data: bytes, mime_type: str, details: Tuple[str, ...],
+                           output_format: str = IMAGE_OUTPUT_FORMAT,
+                           quality: int = IMAGE_OUTPUT_QUALITY) -> Dict[str, Optional[Tuple[bytes, str]]]:
+    """
+    Decodes an image once and produces compact encoded bytes per detail level.
+
+    Fixes EXIF orientation, downscales to what each detail level can use and
+    re-encodes as JPEG/WebP. The original bytes are kept for a detail level when
+    they are already smaller and need no rotation or resizing.
+
+    Runs in a worker process (CPU-bound).
+
+    Args:
+        file_data (bytes): Raw uploaded image bytes
+        mime_type (str): MIME type of the upload
+        details (Tuple[str, ...]): Detail levels to produce (e.g. ('low', 'high'))
+
+    Returns:
+        Dict[str, Optional[Tuple[bytes, str]]]: detail -> (image_bytes, mime_type),
+        or None where the original upload should be used
+    """
+    pil_format, output_mime = _OUTPUT_FORMATS.get(output_format, _OUTPUT_FORMATS['jpeg'])
+
+    with Image.open(io.BytesIO(file_data)) as original:
+        rotated = original.getexif().get(0x0112, 1) not in (0, 1)  # EXIF Orientation tag
+        rgb = _to_rgb(ImageOps.exif_transpose(original))
+
+    variants = {}
+    for detail in details:
+        size = target_size(rgb.width, rgb.height, detail)
+        resized = rgb.resize(size, Image.LANCZOS) if size != rgb.size else rgb
+
+        buffer = io.BytesIO()
+        resized.save(buffer, format=pil_format, quality=quality, optimize=True)
+        encoded = buffer.getvalue()
+
+        # Re-encoding an already small, upright, supported image can make it bigger
+        unchanged = size == rgb.size and not rotated
+        if unchanged and mime_type in OPENAI_SUPPORTED_MIME_TYPES and len(file_data) <= len(encoded):
+            variants[detail] = None
+        else:
+            variants[detail] = (encoded, output_mime)
+
+    return variants
+
+
+def tile_boxes(width: int, height: int, columns: int, rows: int, overlap: float) -> List[Tuple[int, int, int, int]]:
+    """
+    Crop boxes (left, top, right, bottom) for an overlapping columns x rows grid.
+
+    Boxes are ordered column by column (top to bottom, then left to right),
+    the reading order of a multi-column wine list.
+    """
+    def spans(length: int, count: int) -> List[Tuple[int, int]]:
+        size = length / (count - (count - 1) * overlap)
+        step = size * (1 - overlap)
+        return [(round(i * step), min(length, round(i * step + size))) for i in range(count)]
+
+    return [
+        (left, top, right, bottom)
+        for left, right in spans(width, max(1, columns))
+        for top, bottom in spans(height, max(1, rows))
+    ]
+
+
+def prepare_image_tiles(file_data: bytes, tiling: Dict[str, Any],
+                        output_format: str = IMAGE_OUTPUT_FORMAT,
+                        quality: int = IMAGE_OUTPUT_QUALITY) -> List[Tuple[bytes, str]]:
+    """
+    Cuts a large image into overlapping tiles for high-detail detection.
+
+    Each tile is downscaled to what the 'high' detail level can use, so a dense
+    menu keeps roughly columns x rows times the resolution of a single call.
+    Images whose short side is below tiling["min_short_side"] gain nothing from
+    tiling and produce no tiles.
+
+    Runs in a worker process (CPU-bound).
+
+    Args:
+        file_data (bytes): Raw uploaded image bytes
+        tiling (Dict[str, Any]): "columns", "rows", "overlap" (fraction) and "min_short_side" (px)
+
+    Returns:
+        List[Tuple[bytes, str]]: (image_bytes, mime_type) per tile, in reading order
+    """
+    pil_format, output_mime = _OUTPUT_FORMATS.get(output_format, _OUTPUT_FORMATS['jpeg'])
+
+    with Image.open(io.BytesIO(file_data)) as original:
+        rgb = _to_rgb(ImageOps.exif_transpose(original))
+
+    if min(rgb.size) < tiling.get("min_short_side", 1536):
+        return []
+
+    tiles = []
+    boxes = tile_boxes(rgb.width, rgb.height, tiling.get("columns", 2), tiling.get("rows", 2), tiling.get("overlap", 0.1))
+    for box in boxes:
+        tile = rgb.crop(box)
+        size = target_size(tile.width, tile.height, "high")
+        if size != tile.size:
+            tile = tile.resize(size, Image.LANCZOS)
+        buffer = io.BytesIO()
+        tile.save(buffer, format=pil_format, quality=quality, optimize=True)
+        tiles.append((buffer.getvalue(), output_mime))
+    return tiles
+
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    """Lazily start the preprocessing process pool ('spawn' is safe with running threads)"""
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=IMAGE_PREPROCESS_WORKERS,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _process_pool
+
+
+async def preprocess_image(file_data: bytes, mime_type: str, details: Iterable[str]) -> Dict[str, ImagePayload]:
+    """
+    Produces one shared ImagePayload per detail level without blocking the event loop.
+
+    Detail levels that need the original upload share a single payload object.
+    Falls back to the original upload for every detail level when preprocessing
+    is disabled or the image cannot be decoded.
+
+    Returns:
+        Dict[str, ImagePayload]: detail -> payload
+    """
+    details = tuple(sorted(set(details)))
+    variants = dict.fromkeys(details)
+    if IMAGE_PREPROCESSING:
+        try:
+            loop = asyncio.get_running_loop()
+            variants = await loop.run_in_executor(
+                _get_process_pool(), prepare_image_variants, file_data, mime_type, details
+            )
+        except Exception as e:
+            print(f"Image preprocessing: Falling back to original upload: {e}")
+
+    payloads = {}
+    original = None
+    for detail, variant in variants.items():
+        if variant is None:
+            original = original or ImagePayload(file_data, mime_type)
+            payloads[detail] = original
+        else:
+            payloads[detail] = ImagePayload(*variant)
+    return payloads
+
+
+async def preprocess_tiles(file_data: bytes, tiling: Optional[Dict[str, Any]]) -> List[ImagePayload]:
+    """
+    Produces detection tiles without blocking the event loop.
+
+    Returns an empty list (meaning: detect on the whole image) when tiling is
+    disabled, the image is too small to benefit, or it cannot be decoded.
+    """
+    if not tiling or not tiling.get("enabled"):
+        return []
+    try:
+        loop = asyncio.get_running_loop()
+        tiles = await loop.run_in_executor(_get_process_pool(), prepare_image_tiles, file_data, tiling)
+    except Exception as e:
+        print(f"Image preprocessing: Tiling failed, detecting on the whole image: {e}")
+        return []
+    return [ImagePayload(*tile) for tile in tiles]
+
+
+async def perceptual_hash(file_data: bytes) -> Optional[int]:
+    """
+    Computes the image's perceptual hash without blocking the event loop.
+
+    Returns None when the image cannot be decoded.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_process_pool(), compute_phash, file_data)
+    except Exception as e:
+        print(f"Image preprocessing: Perceptual hash failed: {e}")
+        return None
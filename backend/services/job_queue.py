@@ -0,0 +1,197 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+# Queue settings
+JOB_QUEUE_PATH = os.getenv('JOB_QUEUE_PATH', 'jobs.db')
+JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', 300))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+JOB_RETENTION_SECONDS = float(os.getenv('JOB_RETENTION_SECONDS', 86400))
+
+JOB_STATUSES = ('queued', 'running', 'done', 'failed')
+
+
+class JobQueue:
+    """
+    Durable scan job queue backed by a local SQLite file.
+
+    Web processes enqueue uploads and poll for results; any number of worker
+    processes sharing the same file claim jobs. A claimed job carries a lease
+    that its worker renews while the scan runs: if the worker dies (crash,
+    deploy, restart) the job becomes claimable again once the lease expires,
+    up to max_attempts times, so queued and in-flight work survives restarts.
+    Only the worker currently holding a job can complete or fail it.
+
+    Args:
+        path (str): SQLite file holding the queue
+        lease_seconds (float): How long a claimed job stays owned without a renewal
+        max_attempts (int): Claims before a job is marked failed
+    """
+
+    def __init__(self, path: str = JOB_QUEUE_PATH, lease_seconds: float = JOB_LEASE_SECONDS,
+                 max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max(1, max_attempts)
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Autocommit mode; transactions are opened explicitly where needed
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, filename TEXT, mime_type TEXT NOT NULL, "
+            "image BLOB, result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, worker TEXT, "
+            "lease_expires REAL, created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)")
+
+    def enqueue(self, file_data: bytes, mime_type: str, filename: Optional[str] = None) -> str:
+        """Store an upload as a queued job and return its ID"""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, status, filename, mime_type, image, created_at) VALUES (?, 'queued', ?, ?, ?, ?)",
+                (job_id, filename, mime_type, file_data, time.time())
+            )
+        return job_id
+
+    def claim(self, worker: str) -> Optional[Dict[str, Any]]:
+        """
+        Atomically take the oldest claimable job (queued, or running with an expired lease).
+
+        Returns:
+            Optional[Dict[str, Any]]: {"id", "file_data", "mime_type", "filename", "attempts"} or None
+        """
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock up front so two workers can't claim the same job
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                # Jobs whose lease ran out too many times are given up on
+                self._db.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, finished_at = ?, image = NULL "
+                    "WHERE status = 'running' AND lease_expires < ? AND attempts >= ?",
+                    (f"Gave up after {self.max_attempts} attempts", now, now, self.max_attempts)
+                )
+                row = self._db.execute(
+                    "SELECT id, image, mime_type, filename, attempts FROM jobs "
+                    "WHERE status = 'queued' OR (status = 'running' AND lease_expires < ?) "
+                    "ORDER BY created_at LIMIT 1",
+                    (now,)
+                ).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, "
+                        "lease_expires = ?, started_at = ? WHERE id = ?",
+                        (worker, now + self.lease_seconds, now, row[0])
+                    )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+        if row is None:
+            return None
+        job_id, image, mime_type, filename, attempts = row
+        return {"id": job_id, "file_data": image, "mime_type": mime_type, "filename": filename, "attempts": attempts + 1}
+
+    def renew(self, job_id: str, worker: str) -> bool:
+        """Extend the lease of a job the worker still owns; False if the lease was lost"""
+        with self._lock:
+            return self._db.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND status = 'running' AND worker = ?",
+                (time.time() + self.lease_seconds, job_id, worker)
+            ).rowcount > 0
+
+    def complete(self, job_id: str, worker: str, result: Dict[str, Any]) -> bool:
+        """Store a job's result and drop its image; False if the worker no longer owns the job"""
+        with self._lock:
+            return self._db.execute(
+                "UPDATE jobs SET status = 'done', result = ?, finished_at = ?, image = NULL, lease_expires = NULL "
+                "WHERE id = ? AND status = 'running' AND worker = ?",
+                (json.dumps(result), time.time(), job_id, worker)
+            ).rowcount > 0
+
+    def fail(self, job_id: str, worker: str, error: str, retry: bool = False) -> bool:
+        """
+        Mark a job failed, or put it back in the queue when retry is set and attempts remain.
+
+        Returns False (and changes nothing) if the worker no longer owns the job,
+        i.e. its lease expired and another worker claimed it.
+        """
+        with self._lock:
+            if retry:
+                updated = self._db.execute(
+                    "UPDATE jobs SET status = 'queued', error = ?, lease_expires = NULL "
+                    "WHERE id = ? AND status = 'running' AND worker = ? AND attempts < ?",
+                    (error, job_id, worker, self.max_attempts)
+                ).rowcount
+                if updated:
+                    return True
+            return self._db.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ?, image = NULL, lease_expires = NULL "
+                "WHERE id = ? AND status = 'running' AND worker = ?",
+                (error, time.time(), job_id, worker)
+            ).rowcount > 0
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a job's status (and result or error once finished), or None if unknown"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, status, filename, result, error, attempts, created_at, started_at, finished_at "
+                "FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+
+        job_id, status, filename, result, error, attempts, created_at, started_at, finished_at = row
+        job = {
+            "job_id": job_id,
+            "status": status,
+            "filename": filename,
+            "attempts": attempts,
+            "created_at": created_at,
+            "started_at": started_at,
+            "finished_at": finished_at,
+        }
+        if status == 'done':
+            job["result"] = json.loads(result)
+        elif status == 'failed':
+            job["error"] = error
+        return job
+
+    def purge(self, older_than: float = JOB_RETENTION_SECONDS) -> int:
+        """Delete finished jobs older than older_than seconds; returns the count removed"""
+        with self._lock:
+            return self._db.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                (time.time() - older_than,)
+            ).rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        """Return job counts per status"""
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = dict.fromkeys(JOB_STATUSES, 0)
+        counts.update(dict(rows))
+        return {"path": self.path, **counts}
+
+
+_queue: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Return the process-wide job queue, opening JOB_QUEUE_PATH on first use"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
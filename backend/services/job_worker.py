@@ -0,0 +1,128 @@
+import asyncio
+import os
+import socket
+import time
+from typing import Optional
+
+import openai
+
+from services.async_bridge import get_background_loop
+from services.job_queue import JobQueue, get_job_queue
+from services.pipeline import run_wine_scan, finish_trace, log
+from services.tracing import ScanTrace
+
+# Seconds an idle worker waits before checking the queue again
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 0.5))
+# Workers run inside the web process (0 = only separate `python3 worker.py` processes)
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+# Longest a results request may long-poll (?wait=N)
+JOB_MAX_WAIT_SECONDS = 60.0
+# How often finished jobs older than JOB_RETENTION_SECONDS are deleted
+JOB_PURGE_INTERVAL = 3600.0
+
+
+async def _renew_lease(queue: JobQueue, job_id: str, worker: str):
+    """Keep renewing a running job's lease so a long scan isn't claimed a second time"""
+    while True:
+        await asyncio.sleep(queue.lease_seconds / 3)
+        try:
+            if not await asyncio.to_thread(queue.renew, job_id, worker):
+                log(f"JOB: {job_id} lease lost by {worker}")
+                return
+        except Exception as e:
+            print(f"Job worker {worker}: Could not renew lease of {job_id}: {e}")
+
+
+async def process_job(queue: JobQueue, job, worker: str) -> bool:
+    """Scan one claimed job and store its result; returns whether it succeeded"""
+    job_id = job["id"]
+    log(f"JOB: {job_id} started (attempt {job['attempts']})")
+    heartbeat = asyncio.create_task(_renew_lease(queue, job_id, worker))
+    trace = ScanTrace()
+    try:
+        result, cached = await run_wine_scan(job["file_data"], job["mime_type"], trace)
+    except openai.OpenAIError as e:
+        # Usually transient (rate limits, timeouts): requeue while attempts remain
+        finish_trace(trace, "job", outcome="error")
+        log(f"JOB: {job_id} ERROR - OpenAI API: {str(e)}")
+        if not await asyncio.to_thread(queue.fail, job_id, worker, f"OpenAI API error: {str(e)}", True):
+            log(f"JOB: {job_id} failure dropped, lease lost by {worker}")
+        return False
+    except Exception as e:
+        finish_trace(trace, "job", outcome="error")
+        log(f"JOB: {job_id} ERROR - Internal: {str(e)}")
+        if not await asyncio.to_thread(queue.fail, job_id, worker, "Internal server error"):
+            log(f"JOB: {job_id} failure dropped, lease lost by {worker}")
+        return False
+    finally:
+        heartbeat.cancel()
+
+    finish_trace(trace, "job", cached)
+    if not await asyncio.to_thread(queue.complete, job_id, worker, result):
+        # The lease expired and another worker re-claimed the job; its outcome wins
+        log(f"JOB: {job_id} result dropped, lease lost by {worker}")
+        return False
+    log(f"JOB: {job_id} done{' (cached)' if cached else ''}")
+    return True
+
+
+async def job_worker(queue: JobQueue, name: str, stop: Optional[asyncio.Event] = None):
+    """Claim and process jobs one at a time until stop is set"""
+    while stop is None or not stop.is_set():
+        try:
+            job = await asyncio.to_thread(queue.claim, name)
+        except Exception as e:
+            print(f"Job worker {name}: Could not claim a job: {e}")
+            job = None
+
+        if job is None:
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+            continue
+        await process_job(queue, job, name)
+
+
+async def _purge_periodically(queue: JobQueue, stop: Optional[asyncio.Event] = None):
+    while stop is None or not stop.is_set():
+        try:
+            removed = await asyncio.to_thread(queue.purge)
+            if removed:
+                print(f"Job queue: Purged {removed} finished jobs")
+        except Exception as e:
+            print(f"Job queue: Purge failed: {e}")
+        await asyncio.sleep(JOB_PURGE_INTERVAL)
+
+
+async def run_job_workers(concurrency: int, queue: Optional[JobQueue] = None,
+                          stop: Optional[asyncio.Event] = None):
+    """
+    Runs `concurrency` workers against the job queue on the current event loop.
+
+    Each worker handles one scan at a time; the scans share the pooled OpenAI
+    client, so concurrency can be far above the CPU count.
+    """
+    queue = queue or get_job_queue()
+    prefix = f"{socket.gethostname()}:{os.getpid()}"
+    print(f"Job workers: {concurrency} consuming {queue.path} as {prefix}")
+    tasks = [asyncio.create_task(job_worker(queue, f"{prefix}:{index}", stop)) for index in range(concurrency)]
+    tasks.append(asyncio.create_task(_purge_periodically(queue, stop)))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def start_background_workers(concurrency: int = JOB_WORKERS):
+    """Run job workers inside this process (on the shared background loop of the Flask server)"""
+    if concurrency > 0:
+        asyncio.run_coroutine_threadsafe(run_job_workers(concurrency), get_background_loop())
+
+
+async def wait_for_job(queue: JobQueue, job_id: str, timeout: float):
+    """Poll a job until it finishes or timeout seconds pass; returns the job, or None if unknown"""
+    deadline = time.monotonic() + min(max(0.0, timeout), JOB_MAX_WAIT_SECONDS)
+    while True:
+        job = await asyncio.to_thread(queue.get, job_id)
+        if job is None or job["status"] in ('done', 'failed') or time.monotonic() >= deadline:
+            return job
+        await asyncio.sleep(min(JOB_POLL_INTERVAL, max(0.0, deadline - time.monotonic())))
@@ -0,0 +1,140 @@
+import bisect
+import math
+import threading
+from typing import Dict, List, Sequence, Tuple
+
+from services.tracing import ScanTrace
+
+# Latency buckets in seconds, spanning cache hits (ms) to dense tiled menus (tens of seconds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of numbers (for the load and accuracy test reports)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Counter:
+    """Monotonic counter with labels, rendered in the Prometheus text format"""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_format_labels(labels)} {_format_value(value)}" for labels, value in values]
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, rendered in the Prometheus text format"""
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        # labels -> (per-bucket counts incl. +Inf, sum)
+        self._series: Dict[Tuple[Tuple[str, str], ...], Tuple[List[int], float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total = self._series.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._series[key] = (counts, total + value)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted((labels, list(counts), total) for labels, (counts, total) in self._series.items())
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+scan_duration = Histogram("wine_scan_duration_seconds", "End-to-end scan latency")
+stage_duration = Histogram("wine_scan_stage_duration_seconds", "Latency of each scan stage")
+stage_bytes = Counter("wine_scan_stage_bytes_total", "Bytes handled per stage (upload, encoded payloads, response body)")
+stage_wines = Counter("wine_scan_stage_wines_total", "Wines produced per stage")
+stage_calls = Counter("wine_scan_openai_calls_total", "OpenAI calls per stage")
+stage_tokens = Counter("wine_scan_openai_tokens_total", "OpenAI tokens per stage and kind (prompt, completion, image and cancelled-hedge estimates)")
+rejected_requests = Counter("wine_scan_rejected_requests_total", "Scan requests turned away by admission control, by reason")
+openai_client_events = Counter("wine_scan_openai_client_events_total", "OpenAI client retries, timeouts, hedges and errors per stage")
+
+METRICS = (scan_duration, stage_duration, stage_bytes, stage_wines, stage_calls, stage_tokens, rejected_requests,
+           openai_client_events)
+
+
+def observe_scan(trace: ScanTrace, endpoint: str, cached: bool = False, outcome: str = "ok"):
+    """Fold a finished scan's spans into the histograms and counters"""
+    scan_duration.observe(trace.elapsed(), endpoint=endpoint, cached=str(cached).lower(),
+                          coalesced=str(trace.coalesced).lower(), outcome=outcome)
+    observe_stages(trace)
+
+
+def observe_stages(trace: ScanTrace):
+    """
+    Fold a trace's own stage spans and counts into the stage metrics.
+
+    Spans of an attached shared scan are left out; the shared scan observes
+    them itself, once, however many requests it answered.
+    """
+    for stage, seconds in trace.stages.items():
+        stage_duration.observe(seconds, stage=stage)
+    for stage, counts in trace.counts.items():
+        if counts.get("bytes"):
+            stage_bytes.inc(counts["bytes"], stage=stage)
+        if counts.get("wines"):
+            stage_wines.inc(counts["wines"], stage=stage)
+        if counts.get("calls"):
+            stage_calls.inc(counts["calls"], stage=stage)
+        for kind in ("prompt", "completion", "image", "hedged"):
+            if counts.get(f"{kind}_tokens"):
+                stage_tokens.inc(counts[f"{kind}_tokens"], stage=stage, kind=kind)
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+# Content-Type of the Prometheus text format
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
@@ -0,0 +1,159 @@
+import io
+import threading
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# DCT-based perceptual hash: 32x32 grayscale, low 8x8 frequencies -> 64 bits
+PHASH_SIZE = 32
+PHASH_LOW_FREQUENCIES = 8
+
+
+def _dct_matrix(size: int) -> np.ndarray:
+    """Orthonormal DCT-II basis, so a 2D DCT is two matrix products"""
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.sqrt(2.0 / size) * np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+_DCT = _dct_matrix(PHASH_SIZE)
+
+
+def compute_phash(file_data: bytes) -> int:
+    """
+    64-bit perceptual hash of an image.
+
+    Photos of the same menu from a slightly different angle, distance or
+    exposure land a few bits apart, while unrelated images differ in about half
+    of the bits. Runs in a worker process (CPU-bound).
+    """
+    with Image.open(io.BytesIO(file_data)) as original:
+        gray = ImageOps.exif_transpose(original).convert("L").resize((PHASH_SIZE, PHASH_SIZE), Image.LANCZOS)
+    pixels = np.asarray(gray, dtype=np.float64)
+    low = (_DCT @ pixels @ _DCT.T)[:PHASH_LOW_FREQUENCIES, :PHASH_LOW_FREQUENCIES].ravel()
+    # Compare against the median of the AC terms; the DC term only tracks brightness
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over Hamming distance.
+
+    Each node's children are keyed by their distance to it, so a radius search
+    only descends into children whose key is within the radius of the query's
+    distance to the node (triangle inequality) instead of scanning every hash.
+    """
+
+    def __init__(self):
+        self._root: Optional[list] = None  # [hash, value, {distance: child}]
+        self.size = 0
+
+    def add(self, hash_value: int, value: Any):
+        self.size += 1
+        node = [hash_value, value, {}]
+        if self._root is None:
+            self._root = node
+            return
+        current = self._root
+        while True:
+            distance = hamming_distance(hash_value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, hash_value: int, max_distance: int) -> List[Tuple[int, Any]]:
+        """All (distance, value) pairs within max_distance, closest first"""
+        if self._root is None:
+            return []
+        found = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(hash_value, node[0])
+            if distance <= max_distance:
+                found.append((distance, node[1]))
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        found.sort(key=lambda match: match[0])
+        return found
+
+
+class NearDuplicateIndex:
+    """
+    Maps perceptual hashes of scanned images to the result cache keys of their scans.
+
+    A new upload within max_distance bits of an earlier one (e.g. another diner's
+    photo of the same menu) can reuse that scan's result instead of calling the
+    vision models again. Holds the most recent max_entries images; the BK-tree
+    is rebuilt from them when older entries are dropped, since BK-trees don't
+    support removal.
+
+    Args:
+        max_distance (int): Largest Hamming distance (of 64 bits) counted as the same image
+        max_entries (int): Images kept in the index
+        name (str): Label used in stats
+    """
+
+    def __init__(self, max_distance: int = 6, max_entries: int = 10000, name: str = "Near-duplicate index"):
+        self.max_distance = max_distance
+        self.max_entries = max(1, max_entries)
+        self.name = name
+        self._lock = threading.Lock()
+        self._entries: deque = deque()
+        self._tree = BKTree()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def add(self, hash_value: int, value: Any):
+        """Index an image's hash with the value to return for near duplicates (e.g. a cache key)"""
+        with self._lock:
+            self._entries.append((hash_value, value))
+            self._tree.add(hash_value, value)
+            if len(self._entries) > self.max_entries:
+                # Drop the oldest quarter at once so rebuilds are rare
+                for _ in range(max(1, self.max_entries // 4)):
+                    self._entries.popleft()
+                self._tree = BKTree()
+                for entry_hash, entry_value in self._entries:
+                    self._tree.add(entry_hash, entry_value)
+
+    def lookup(self, hash_value: int) -> List[Tuple[int, Any]]:
+        """Indexed (distance, value) pairs within max_distance, closest first (counts a hit or miss)"""
+        with self._lock:
+            matches = self._tree.search(hash_value, self.max_distance)
+            if matches:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return matches
+
+    def count_stale(self):
+        """Record a match whose result could not be used (e.g. evicted from the result cache)"""
+        with self._lock:
+            self.stale += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "size": len(self._entries),
+                "max_distance": self.max_distance,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
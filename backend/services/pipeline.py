@@ -0,0 +1,634 @@
+import asyncio
+import json
+import os
+import threading
+import weakref
+from contextlib import aclosing, nullcontext
+from datetime import datetime, timezone
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple
+
+import openai
+
+from agents.validation_agent import validate_wine_image_async
+from agents.openai_client import openai_client_stats
+from agents.detection_agent import (
+    extract_wines_async, extract_wines_tiled_async, extract_wines_escalating_async, detection_tier_stats
+)
+from agents.sommelier_agent import (
+    get_wine_recommendations_async, recommendation_cache, RECOMMENDATION_CACHE_ENABLED,
+    sommelier_mode, sommelier_usage_stats, shard_indices, uncached_wines, SOMMELIER_SHARD_SIZE
+)
+from agents.prompt_config import get_prompt_config
+from services.result_cache import ResultCache, hash_bytes
+from services.image_preprocessing import preprocess_image, preprocess_tiles, perceptual_hash
+from services.image_payload import ImagePayload, request_bytes
+from services.tracing import ScanTrace, CallCounter, current_call_counter, timed
+from services.metrics import observe_scan, observe_stages
+from services.token_usage import token_ledger, plan_detection, sommelier_fits
+from services.wine_catalog import WineCatalog
+from services.near_duplicates import NearDuplicateIndex
+
+# When to start detection concurrently with validation:
+#   never    - validate first, detect only if validation passed (default)
+#   always   - run validation and detection together on every scan
+#   uncached - skip validation for images with a cached YES verdict and
+#              speculate only when the verdict has to be fetched
+SPECULATION_MODES = ('never', 'always', 'uncached')
+SPECULATIVE_DETECTION = os.getenv('SPECULATIVE_DETECTION', 'never').lower()
+if SPECULATIVE_DETECTION not in SPECULATION_MODES:
+    print(f"Pipeline: Unknown SPECULATIVE_DETECTION '{SPECULATIVE_DETECTION}', using 'never'")
+    SPECULATIVE_DETECTION = 'never'
+
+# Result cache for repeat scans of the same image (keyed by image hash + prompts config version)
+RESULT_CACHE_ENABLED = os.getenv('RESULT_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+result_cache = ResultCache(
+    max_entries=int(os.getenv('RESULT_CACHE_MAX_ENTRIES', 256)),
+    ttl_seconds=float(os.getenv('RESULT_CACHE_TTL_SECONDS', 86400)),
+    persist_path=os.getenv('RESULT_CACHE_PATH') or None,
+    name="Result cache"
+)
+
+# Validation verdicts keyed by image hash + prompts config version. Only YES
+# verdicts are stored because the validation agent reports API errors as NO.
+verdict_cache = ResultCache(
+    max_entries=int(os.getenv('VALIDATION_CACHE_MAX_ENTRIES', 1024)),
+    ttl_seconds=float(os.getenv('VALIDATION_CACHE_TTL_SECONDS', 86400)),
+    name="Validation cache"
+)
+
+# Local catalog that maps detections to stable wine IDs and canonical fields
+WINE_CATALOG_ENABLED = os.getenv('WINE_CATALOG_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+wine_catalog = WineCatalog(
+    path=os.getenv('WINE_CATALOG_PATH') or None,
+    match_threshold=float(os.getenv('WINE_CATALOG_MATCH_THRESHOLD', 0.85)),
+    alias_threshold=float(os.getenv('WINE_CATALOG_ALIAS_THRESHOLD', 0.95)),
+    learn=os.getenv('WINE_CATALOG_LEARN', 'true').lower() in ('1', 'true', 'yes'),
+    max_learned=int(os.getenv('WINE_CATALOG_MAX_LEARNED', 5000))
+)
+if WINE_CATALOG_ENABLED and os.getenv('WINE_CATALOG_SEED'):
+    try:
+        wine_catalog.load_json(os.getenv('WINE_CATALOG_SEED'))
+    except Exception as e:
+        print(f"Wine catalog: Could not load seed file: {e}")
+
+# Perceptual-hash index that lets near-identical photos (same menu, slightly
+# different angle) reuse an earlier scan's cached result
+NEAR_DUPLICATE_ENABLED = os.getenv('NEAR_DUPLICATE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+near_duplicate_index = NearDuplicateIndex(
+    max_distance=int(os.getenv('NEAR_DUPLICATE_MAX_DISTANCE', 6)),
+    max_entries=int(os.getenv('NEAR_DUPLICATE_MAX_ENTRIES', 10000))
+)
+
+# Scans of one batch request that run at the same time
+BATCH_MAX_CONCURRENCY = max(1, int(os.getenv('BATCH_MAX_CONCURRENCY', 4)))
+
+# Attach concurrent identical scans (same image + prompts config) to one in-flight pipeline
+SCAN_COALESCING = os.getenv('SCAN_COALESCING', 'true').lower() in ('1', 'true', 'yes')
+
+# Counters for how speculation played out
+speculation_stats = {
+    "speculated": 0,
+    "discarded": 0,
+    "verdict_cache_hits": 0,
+}
+_stats_lock = threading.Lock()
+
+# Counters for request coalescing
+coalescing_stats = {
+    "leaders": 0,
+    "coalesced": 0,
+    "upstream_calls": 0,
+    "upstream_calls_saved": 0,
+}
+
+
+def _count(name: str):
+    with _stats_lock:
+        speculation_stats[name] += 1
+
+
+def _count_coalescing(name: str, amount: int = 1):
+    with _stats_lock:
+        coalescing_stats[name] += amount
+
+
+def log(message: str):
+    """Print a log line with the UTC timestamp format used across the backend"""
+    timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')[:-4]
+    print(f"[{timestamp}] {message}")
+
+
+def finish_trace(trace: ScanTrace, endpoint: str, cached: bool = False, outcome: str = "ok"):
+    """
+    Record a finished scan's spans in /metrics and log them as one JSON line.
+
+    outcome is "ok", "error" (the scan raised) or "cancelled" (the client went
+    away mid-stream), so failed scans still show up in the stage metrics.
+    """
+    observe_scan(trace, endpoint, cached, outcome)
+    log("TRACE: " + json.dumps({
+        "endpoint": endpoint,
+        "cached": cached,
+        "outcome": outcome,
+        "total_ms": round(trace.elapsed() * 1000, 1),
+        "tokens": trace.tokens(),
+        "stages": trace.spans()
+    }))
+
+
+def detection_escalation(config) -> bool:
+    """Whether tiered detection (low detail first, high only when needed) is enabled"""
+    return bool(config.detection.get("escalation", {}).get("enabled"))
+
+
+def format_token_usage(trace: ScanTrace) -> str:
+    """A scan's token usage as an X-Token-Usage header value"""
+    return ", ".join(f"{key.removesuffix('_tokens')}={value}" for key, value in trace.tokens().items())
+
+
+def scan_cache_key(file_data: bytes) -> str:
+    """Content-addressed key for a scan: image hash + prompts config version"""
+    return f"{hash_bytes(file_data)}:{get_prompt_config().version}"
+
+
+async def iter_validate_and_detect(images: Dict[str, ImagePayload], cache_key: str,
+                                   trace: Optional[ScanTrace] = None,
+                                   tiles: Optional[List[ImagePayload]] = None,
+                                   detection_detail: Optional[str] = None) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Runs validation and wine detection according to SPECULATIVE_DETECTION.
+
+    Yields ("validation", bool) as soon as the verdict is known, followed by
+    ("detection", wines) when the image is valid.
+
+    Args:
+        images (Dict[str, ImagePayload]): detail -> shared payload from preprocess_image
+        cache_key (str): Image hash + prompts config version, used for verdict caching
+        trace (ScanTrace, optional): Receives per-stage timings
+        tiles (List[ImagePayload], optional): Detection tiles; detection runs per tile when given
+        detection_detail (str, optional): Overrides the configured detection detail level
+    """
+    config = get_prompt_config()
+    escalating = detection_escalation(config)
+    detection_detail = detection_detail or config.detection["detail"]
+    validation_image = images[config.validation["detail"]]
+    detection_image = images[detection_detail]
+
+    def detect():
+        if tiles:
+            detection = extract_wines_tiled_async(tiles)
+        elif escalating and detection_detail == "high":
+            detection = extract_wines_escalating_async(images["low"], detection_image)
+        else:
+            detection = extract_wines_async(detection_image, detection_detail)
+        return timed(trace, "detection", detection)
+
+    if SPECULATIVE_DETECTION == 'never':
+        is_valid = await timed(trace, "validation", validate_wine_image_async(validation_image))
+        yield "validation", is_valid
+        if is_valid:
+            yield "detection", await detect()
+        return
+
+    if SPECULATIVE_DETECTION == 'uncached' and verdict_cache.get(cache_key):
+        _count("verdict_cache_hits")
+        yield "validation", True
+        yield "detection", await detect()
+        return
+
+    # Start detection before we know whether the image is a wine image
+    _count("speculated")
+    detection_task = asyncio.create_task(detect())
+    try:
+        is_valid = await timed(trace, "validation", validate_wine_image_async(validation_image))
+        if not is_valid:
+            _count("discarded")
+            print("Pipeline: Validation failed, cancelling speculative detection")
+            yield "validation", False
+            return
+
+        if SPECULATIVE_DETECTION == 'uncached':
+            verdict_cache.set(cache_key, True)
+
+        yield "validation", True
+        yield "detection", await detection_task
+    finally:
+        # Cancels the in-flight OpenAI request when the result is not needed
+        if not detection_task.done():
+            detection_task.cancel()
+        elif not detection_task.cancelled():
+            detection_task.exception()  # Mark a discarded failure as retrieved
+
+
+def _replay_cached_result(result: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+    """Build the same event sequence a live scan would produce for a cached result"""
+    events = [("validation", {"valid": True})]
+    events += [("wine", {"index": index, "wine": wine}) for index, wine in enumerate(result.get("raw_detection", []))]
+    events += [("recommendation", {"index": index, "wine": wine}) for index, wine in enumerate(result.get("wines", []))]
+    events.append(("summary", {"cached": True, "result": result}))
+    return events
+
+
+def _find_near_duplicate(image_hash: Optional[int]) -> Optional[Tuple[int, Dict[str, Any]]]:
+    """Cached result of the closest earlier scan of a near-identical image, as (distance, result)"""
+    if image_hash is None:
+        return None
+    version = get_prompt_config().version
+    matches = near_duplicate_index.lookup(image_hash)
+    for distance, cache_key in matches:
+        # Results of an older prompts config don't count
+        if not cache_key.endswith(f":{version}"):
+            continue
+        result = result_cache.get(cache_key)
+        if result is not None:
+            return distance, result
+    if matches:
+        near_duplicate_index.count_stale()
+    return None
+
+
+async def iter_wine_scan(file_data: bytes, mime_type: str,
+                         trace: Optional[ScanTrace] = None) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Runs the validate -> detect -> sommelier pipeline, yielding progress events.
+
+    Events (in order):
+        ("validation", {"valid": bool})
+        ("wine", {"index": int, "wine": dict})            once per detected wine
+        ("recommendation", {"index": int, "wine": dict})  once per wine, in shard completion order
+        ("summary", {"cached": bool, "result": dict})     the full response payload
+
+    OpenAI and unexpected errors propagate to the caller.
+
+    Args:
+        file_data (bytes): Raw image bytes
+        mime_type (str): MIME type of the image (e.g., 'image/jpeg')
+        trace (ScanTrace, optional): Receives per-stage timings (Server-Timing)
+    """
+    # Return a previous result for the exact same image and prompts config
+    cache_key = scan_cache_key(file_data)
+    if RESULT_CACHE_ENABLED:
+        cached_result = result_cache.get(cache_key)
+        if cached_result is not None:
+            log(f"RESPONSE: CACHE HIT - Returning {len(cached_result.get('wines', []))} cached wines")
+            for event in _replay_cached_result(cached_result):
+                yield event
+            return
+
+    if not SCAN_COALESCING:
+        async with aclosing(_iter_tracked_scan(file_data, mime_type, cache_key, trace)) as events:
+            async for event in events:
+                yield event
+        return
+
+    # Join an identical scan that is already running, or start one others can join
+    scans = _inflight_scans.setdefault(asyncio.get_running_loop(), {})
+    shared = scans.get(cache_key)
+    if shared is None:
+        shared = scans[cache_key] = _SharedScan()
+        shared.task = asyncio.create_task(_run_shared_scan(shared, scans, file_data, mime_type, cache_key))
+        _count_coalescing("leaders")
+        if trace is not None:
+            trace.attach(shared.trace)
+    else:
+        shared.followers += 1
+        _count_coalescing("coalesced")
+        log("REQUEST: Coalesced with an identical in-flight scan")
+        if trace is not None:
+            trace.attach(shared.trace, coalesced=True)
+
+    async with aclosing(shared.subscribe()) as events:
+        async for event in events:
+            yield event
+
+
+async def _iter_tracked_scan(file_data: bytes, mime_type: str, cache_key: str,
+                             trace: Optional[ScanTrace]) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """Runs a live scan, accounting for the upload and its encoded payloads while it is in flight"""
+    with request_bytes.track(len(file_data)) as tracked:
+        async with aclosing(_iter_live_scan(file_data, mime_type, cache_key, tracked, trace)) as events:
+            async for event in events:
+                yield event
+
+
+class _SharedScan:
+    """
+    One in-flight live scan whose events are delivered to every identical request.
+
+    The scan runs in its own task and appends events to a log; subscribers
+    replay the log and wait for more, so late joiners see the full sequence.
+    The task is cancelled if every subscriber goes away before it finishes.
+
+    The scan records into its own trace, which every subscriber's trace
+    attaches; it stays valid when the request that started the scan leaves.
+    """
+
+    def __init__(self):
+        self.events: List[Tuple[str, Dict[str, Any]]] = []
+        self.updated = asyncio.Event()
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.followers = 0
+        self.calls = CallCounter()
+        self.trace = ScanTrace()
+        self.task: Optional[asyncio.Task] = None
+
+    def publish(self, event: Optional[Tuple[str, Dict[str, Any]]] = None):
+        """Append an event (or just signal completion) and wake every subscriber"""
+        if event is not None:
+            self.events.append(event)
+        self.updated.set()
+        self.updated = asyncio.Event()
+
+    async def subscribe(self) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        self.subscribers += 1
+        index = 0
+        try:
+            while True:
+                while index < len(self.events):
+                    yield self.events[index]
+                    index += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self.updated.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done and self.task is not None:
+                self.task.cancel()
+
+
+# Shared scans per event loop, keyed like the result cache (image hash + prompts config version)
+_inflight_scans: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, _SharedScan]]" = weakref.WeakKeyDictionary()
+
+
+async def _run_shared_scan(shared: _SharedScan, scans: Dict[str, _SharedScan], file_data: bytes,
+                           mime_type: str, cache_key: str):
+    """Drives a live scan for all of its subscribers"""
+    current_call_counter.set(shared.calls)  # Task-local: counts this scan's OpenAI requests
+    try:
+        async with aclosing(_iter_tracked_scan(file_data, mime_type, cache_key, shared.trace)) as events:
+            async for event in events:
+                shared.publish(event)
+    except BaseException as e:
+        shared.error = e
+        if not isinstance(e, Exception):
+            raise
+    finally:
+        shared.done = True
+        if scans.get(cache_key) is shared:
+            del scans[cache_key]
+        shared.publish()
+        # The stages ran once however many requests were answered, so they are observed once
+        observe_stages(shared.trace)
+        _count_coalescing("upstream_calls", shared.calls.count)
+        _count_coalescing("upstream_calls_saved", shared.calls.count * shared.followers)
+
+
+async def _iter_live_scan(file_data: bytes, mime_type: str, cache_key: str, tracked,
+                          trace: Optional[ScanTrace]) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """Runs the agents for a scan that was not served from the result cache"""
+    # The trace also tallies the tokens this scan spends, for the per-request budget
+    trace = trace or ScanTrace()
+    # Fix orientation, downscale and re-encode once per detail level the agents use
+    config = get_prompt_config()
+    # Text-mode sommelier reasons over the detected wines only and needs no image
+    sommelier_detail = config.sommelier.get("detail", "low") if sommelier_mode(config.sommelier) == "vision" else None
+    details = (config.validation["detail"], config.detection["detail"]) + ((sommelier_detail,) if sommelier_detail else ())
+    # Tiered detection starts at low detail, and under a token budget detection may have to fall back to it
+    budgeted = token_ledger.remaining() is not None
+    if budgeted or detection_escalation(config):
+        details += ("low",)
+    near_duplicates = NEAR_DUPLICATE_ENABLED and RESULT_CACHE_ENABLED
+    images, tiles, image_hash = await timed(trace, "preprocess", asyncio.gather(
+        preprocess_image(file_data, mime_type, details),
+        preprocess_tiles(file_data, config.detection.get("tiling")),
+        perceptual_hash(file_data) if near_duplicates else asyncio.sleep(0)
+    ))
+    encoded_bytes = sum(payload.nbytes for payload in {id(p): p for p in images.values()}.values())
+    encoded_bytes += sum(tile.nbytes for tile in tiles)
+    tracked.add(encoded_bytes)
+    if trace:
+        trace.annotate("preprocess", bytes=encoded_bytes)
+
+    # Another photo of the same menu may have been scanned already
+    match = _find_near_duplicate(image_hash) if near_duplicates else None
+    if match is not None:
+        distance, result = match
+        log(f"RESPONSE: NEAR-DUPLICATE HIT (distance {distance}) - Returning {len(result.get('wines', []))} cached wines")
+        # Not stored under this image's key, so repeats go through _find_near_duplicate's checks again
+        for event, data in _replay_cached_result(result):
+            yield event, ({**data, "near_duplicate": {"distance": distance}} if event == "summary" else data)
+        return
+
+    # Fit the scan into the token budget: detection may drop to low detail, the sommelier may be skipped
+    plan = plan_detection(config.validation["detail"], config.detection["detail"], len(tiles) or 1, sommelier_detail)
+    budget = None
+    if plan["detection_detail"] != config.detection["detail"] or (tiles and not plan["tiles"]):
+        budget = {"detection_detail": plan["detection_detail"], "sommelier": True}
+        log(f"Pipeline: Token budget tight ({plan['remaining']} left), detecting at {plan['detection_detail']} detail")
+
+    # STEP 1 + 2: Quick validation (cheap), then wine detection (more expensive).
+    # Detection only runs after validation passes unless speculative mode is enabled.
+    wines = []
+    async with aclosing(iter_validate_and_detect(images, cache_key, trace, tiles if plan["tiles"] else None,
+                                                 plan["detection_detail"])) as stage_events:
+        async for event, data in stage_events:
+            if event == "validation":
+                yield "validation", {"valid": data}
+                if not data:
+                    log("RESPONSE: FAIL - Invalid image (not wine content)")
+                    yield "summary", {"cached": False, "result": {
+                        "valid": False,
+                        "wines": [],
+                        "message": "Image must contain wine bottles or a wine menu"
+                    }}
+                    return
+            else:
+                wines = data
+                if trace:
+                    trace.annotate("detection", wines=len(wines))
+
+    if not wines:
+        log("RESPONSE: FAIL - No wines detected")
+        yield "summary", {"cached": False, "result": {
+            "valid": True,
+            "wines": [],
+            "error": "No wines could be detected in the image"
+        }}
+        return
+
+    # Resolve each detection to a stable catalog ID and canonical fields
+    if WINE_CATALOG_ENABLED:
+        with (trace.stage("catalog") if trace else nullcontext()):
+            wines = wine_catalog.canonicalize(wines)
+
+    for index, wine in enumerate(wines):
+        yield "wine", {"index": index, "wine": wine}
+
+    # Image tokens are an estimate already included in prompt tokens
+    spent = trace.tokens()
+    spent = spent["prompt_tokens"] + spent["completion_tokens"] + spent.get("hedged_tokens", 0)
+    # Only wines missing from the recommendation cache cost sommelier calls
+    pending = uncached_wines(wines, config) if budgeted else []
+    sommelier_calls = len(shard_indices(pending, SOMMELIER_SHARD_SIZE)) if pending else 0
+    if sommelier_calls and not sommelier_fits(spent, sommelier_calls, sommelier_detail):
+        budget = {"detection_detail": plan["detection_detail"], "sommelier": False}
+        log(f"RESPONSE: PARTIAL SUCCESS - Found {len(wines)} wines, sommelier skipped (token budget)")
+        yield "summary", {"cached": False, "result": {
+            "valid": True,
+            "wines": wines,
+            "budget": budget
+        }}
+        return
+
+    # STEP 3: Sommelier recommendations, streamed shard by shard as they finish
+    ready: asyncio.Queue = asyncio.Queue()
+    sommelier = asyncio.ensure_future(timed(trace, "sommelier", get_wine_recommendations_async(
+        wines, images.get(sommelier_detail), on_recommendations=ready.put_nowait
+    )))
+    sommelier.add_done_callback(lambda _: ready.put_nowait(None))
+    try:
+        while (batch := await ready.get()) is not None:
+            for index in sorted(batch):
+                yield "recommendation", {"index": index, "wine": batch[index]}
+        recommended_wines = sommelier.result()
+        if trace:
+            trace.annotate("sommelier", wines=sum(1 for wine in recommended_wines if 'recommendation' in wine))
+    except Exception as e:
+        # If sommelier fails, still return the detected wines
+        log(f"RESPONSE: PARTIAL SUCCESS - Found {len(wines)} wines, sommelier failed: {str(e)}")
+        yield "summary", {"cached": False, "result": {
+            "valid": True,
+            "wines": wines,
+            "sommelier_error": f"Sommelier recommendations failed: {str(e)}"
+        }}
+        return
+    finally:
+        # Cancels in-flight shards when the client goes away
+        if not sommelier.done():
+            sommelier.cancel()
+        elif not sommelier.cancelled():
+            sommelier.exception()  # Mark a failure handled above (or discarded) as retrieved
+
+    log(f"RESPONSE: SUCCESS - Found {len(wines)} wines with sommelier recommendations")
+    result = {
+        "valid": True,
+        "wines": recommended_wines,
+        "raw_detection": wines  # Include original detection results for debugging
+    }
+    if budget:
+        result["budget"] = budget
+    # Only complete, full-quality results are cached; agent failures may be transient
+    if RESULT_CACHE_ENABLED and not budget and all('recommendation' in wine for wine in recommended_wines):
+        result_cache.set(cache_key, result)
+        if near_duplicates and image_hash is not None:
+            near_duplicate_index.add(image_hash, cache_key)
+    yield "summary", {"cached": False, "result": result}
+
+
+async def run_wine_scan(file_data: bytes, mime_type: str,
+                        trace: Optional[ScanTrace] = None) -> Tuple[Dict[str, Any], bool]:
+    """
+    Runs the full pipeline and returns the final response payload.
+
+    Returns:
+        Tuple[Dict[str, Any], bool]: (result payload, served from cache)
+    """
+    summary = {}
+    async for event, data in iter_wine_scan(file_data, mime_type, trace):
+        if event == "summary":
+            summary = data
+    return summary["result"], summary["cached"]
+
+
+async def _scan_batch_item(index: int, item: Dict[str, Any], semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+    """Scan one image of a batch, turning any failure into an error entry"""
+    entry = {"index": index, "filename": item.get("filename")}
+    if "error" in item:
+        return {**entry, "status": "error", "error": item["error"]}
+
+    async with semaphore:
+        trace = ScanTrace()
+        try:
+            result, cached = await run_wine_scan(item["file_data"], item["mime_type"], trace)
+            finish_trace(trace, "batch", cached)
+            return {**entry, "status": "ok", "cached": cached, "result": result}
+        except openai.OpenAIError as e:
+            finish_trace(trace, "batch", outcome="error")
+            log(f"RESPONSE: ERROR - OpenAI API (batch item {index}): {str(e)}")
+            return {**entry, "status": "error", "error": f"OpenAI API error: {str(e)}"}
+        except Exception as e:
+            finish_trace(trace, "batch", outcome="error")
+            log(f"RESPONSE: ERROR - Internal (batch item {index}): {str(e)}")
+            return {**entry, "status": "error", "error": "Internal server error"}
+        finally:
+            # Let the upload be freed as soon as its scan is done
+            item.pop("file_data", None)
+
+
+async def iter_batch_scan(items: List[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Runs many images through the pipeline, at most BATCH_MAX_CONCURRENCY at a time.
+
+    Yields one entry per image as soon as it finishes (completion order); use
+    entry["index"] to restore upload order. A failing image only produces an
+    error entry.
+
+    Args:
+        items (List[Dict[str, Any]]): Items from read_image_uploads
+    """
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+    tasks = [asyncio.create_task(_scan_batch_item(index, item, semaphore)) for index, item in enumerate(items)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Stop outstanding scans if the client went away
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def run_batch_scan(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Runs a batch and returns the entries in upload order"""
+    entries = [None] * len(items)
+    async with aclosing(iter_batch_scan(items)) as results:
+        async for entry in results:
+            entries[entry["index"]] = entry
+    return entries
+
+
+def batch_summary(entries: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Counts of a batch's outcomes"""
+    succeeded = sum(1 for entry in entries if entry["status"] == "ok")
+    return {"count": len(entries), "succeeded": succeeded, "failed": len(entries) - succeeded}
+
+
+def format_stream_event(event: str, data: Dict[str, Any], sse: bool) -> str:
+    """Serialize one scan event as an SSE frame or an NDJSON line"""
+    if sse:
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps({"event": event, **data}) + "\n"
+
+
+def pipeline_stats() -> Dict[str, Any]:
+    """Return speculation counters and the stats of the per-stage caches"""
+    with _stats_lock:
+        counters = dict(speculation_stats)
+        coalescing = dict(coalescing_stats)
+    return {
+        "speculative_detection": SPECULATIVE_DETECTION,
+        **counters,
+        "coalescing": {"enabled": SCAN_COALESCING, **coalescing},
+        "validation_cache": verdict_cache.stats(),
+        "near_duplicates": near_duplicate_index.stats() if NEAR_DUPLICATE_ENABLED else None,
+        "wine_catalog": wine_catalog.stats() if WINE_CATALOG_ENABLED else None,
+        "recommendation_cache": recommendation_cache.stats() if RECOMMENDATION_CACHE_ENABLED else None,
+        "detection_tiers": {"enabled": detection_escalation(get_prompt_config()), **detection_tier_stats()},
+        "sommelier_mode": sommelier_mode(get_prompt_config().sommelier),
+        "sommelier_usage": sommelier_usage_stats(),
+        "openai_client": openai_client_stats(),
+    }
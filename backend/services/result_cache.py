@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+def hash_bytes(data: bytes) -> str:
+    """Return the hex SHA-256 digest of raw bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache for JSON-serializable results with TTL expiry.
+
+    Entries live in an in-memory OrderedDict. When a persistence path is given,
+    entries are also written to a small SQLite table so the cache survives
+    process restarts; the most recent non-expired entries are loaded on startup.
+
+    Args:
+        max_entries (int): Maximum number of entries kept in memory
+        ttl_seconds (float): Seconds before an entry expires (0 disables expiry)
+        persist_path (str, optional): SQLite file used for on-disk persistence
+        name (str): Label used in log lines and stats
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 86400,
+                 persist_path: Optional[str] = None, name: str = "result_cache"):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = float(ttl_seconds)
+        self.persist_path = persist_path
+        self.name = name
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        if persist_path:
+            self._open_db(persist_path)
+
+    def _open_db(self, path: str):
+        """Open the persistence database and warm the in-memory LRU from it"""
+        try:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                "key TEXT PRIMARY KEY, stored_at REAL NOT NULL, value TEXT NOT NULL)"
+            )
+            if self.ttl_seconds > 0:
+                self._db.execute(
+                    "DELETE FROM cache_entries WHERE stored_at < ?",
+                    (time.time() - self.ttl_seconds,)
+                )
+            self._db.commit()
+
+            rows = self._db.execute(
+                "SELECT key, stored_at, value FROM cache_entries ORDER BY stored_at DESC LIMIT ?",
+                (self.max_entries,)
+            ).fetchall()
+            # Oldest first so the most recent entry ends up at the MRU end
+            for key, stored_at, value in reversed(rows):
+                self._entries[key] = (stored_at, json.loads(value))
+            print(f"{self.name}: Loaded {len(rows)} entries from {path}")
+        except Exception as e:
+            print(f"{self.name}: Persistence disabled, could not open {path}: {e}")
+            self._db = None
+
+    def _is_expired(self, stored_at: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - stored_at > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for key, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            stored_at, value = entry
+            if self._is_expired(stored_at, now):
+                del self._entries[key]
+                self._delete_persisted(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def contains(self, key: str) -> bool:
+        """Whether key holds a live entry (not counted as a lookup, recency unchanged)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and not self._is_expired(entry[0], time.time())
+
+    def set(self, key: str, value: Any):
+        """Store a JSON-serializable value under key, evicting the LRU entry if full"""
+        now = time.time()
+        with self._lock:
+            self._entries[key] = (now, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted_key, _ = self._entries.popitem(last=False)
+                self._delete_persisted(evicted_key)
+                self.evictions += 1
+
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO cache_entries (key, stored_at, value) VALUES (?, ?, ?)",
+                        (key, now, json.dumps(value))
+                    )
+                    self._db.commit()
+                except Exception as e:
+                    print(f"{self.name}: Failed to persist entry: {e}")
+
+    def _delete_persisted(self, key: str):
+        """Remove a key from the persistence table (caller holds the lock)"""
+        if self._db is None:
+            return
+        try:
+            self._db.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+            self._db.commit()
+        except Exception as e:
+            print(f"{self.name}: Failed to delete persisted entry: {e}")
+
+    def clear(self):
+        """Drop every entry from memory and disk"""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache_entries")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "persistent": self._db is not None,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
@@ -0,0 +1,73 @@
+import unicodedata
+from functools import lru_cache
+from typing import Optional
+
+
+@lru_cache(maxsize=16384)
+def normalize_string(s) -> str:
+    """Normalize string: remove accents, lowercase, strip whitespace (memoized)"""
+    if not s:
+        return ""
+    # Remove accents using NFD normalization
+    normalized = unicodedata.normalize('NFD', str(s))
+    # Filter out combining characters (accents)
+    without_accents = ''.join(c for c in normalized if unicodedata.category(c) != 'Mn')
+    return without_accents.lower().strip()
+
+
+def levenshtein_distance(s1: str, s2: str, max_distance: Optional[int] = None) -> int:
+    """
+    Levenshtein distance between two strings.
+
+    Uses Myers' bit-parallel algorithm: the shorter string is encoded as bit
+    vectors (Python ints have no width limit) and each character of the longer
+    string updates a whole DP column in a handful of integer operations.
+
+    With max_distance set, the result is capped at max_distance + 1 and the
+    scan stops as soon as the distance can no longer come back under the bound.
+    """
+    if s1 == s2:
+        return 0
+    if len(s1) < len(s2):
+        s1, s2 = s2, s1
+
+    m, n = len(s2), len(s1)
+    limit = None if max_distance is None else max_distance + 1
+    if limit is not None and n - m >= limit:
+        return limit
+    if m == 0:
+        return n
+
+    # Bit mask of positions for each character of the pattern (shorter string)
+    peq = {}
+    for i, c in enumerate(s2):
+        peq[c] = peq.get(c, 0) | (1 << i)
+
+    full = (1 << m) - 1
+    last = 1 << (m - 1)
+    pv, mv, score = full, 0, m
+
+    for j, c in enumerate(s1):
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        # Each remaining column lowers the score by at most one
+        if limit is not None and score - (n - j - 1) >= limit:
+            return limit
+        ph = (ph << 1) | 1
+        mh <<= 1
+        pv = (mh | ~(xv | ph)) & full
+        mv = ph & xv & full
+
+    return score if limit is None else min(score, limit)
+
+
+def normalized_distance(s1, s2, max_distance: Optional[int] = None) -> int:
+    """Levenshtein distance between the normalized forms of two strings"""
+    return levenshtein_distance(normalize_string(s1), normalize_string(s2), max_distance)
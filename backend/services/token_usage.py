@@ -0,0 +1,199 @@
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+# Optional token budgets (0 = unlimited). The daily budget is per process and resets at midnight UTC.
+TOKEN_BUDGET_PER_REQUEST = int(os.getenv('TOKEN_BUDGET_PER_REQUEST', 0))
+TOKEN_BUDGET_PER_DAY = int(os.getenv('TOKEN_BUDGET_PER_DAY', 0))
+
+# Image tokens billed per image by detail level. 'high' images are downscaled to a
+# 768px short side, which is 4 512px tiles for the usual 4:3 photo (85 + 4 * 170).
+IMAGE_TOKEN_ESTIMATES = {"low": 85, "high": 765}
+
+# Starting estimates of text tokens per call (image tokens are added), used until
+# real calls have been averaged
+DEFAULT_CALL_ESTIMATES = {"validation": 120, "detection": 900, "sommelier": 2000}
+
+# Days of per-day totals kept for the usage API
+USAGE_HISTORY_DAYS = 7
+
+
+def image_tokens(detail: Optional[str]) -> int:
+    """Estimated prompt tokens taken by one image at a detail level (0 without an image)"""
+    if detail is None:
+        return 0
+    return IMAGE_TOKEN_ESTIMATES.get(detail, IMAGE_TOKEN_ESTIMATES["high"])
+
+
+def _today() -> str:
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d')
+
+
+class TokenLedger:
+    """
+    Aggregate OpenAI token usage per agent and prompts config version.
+
+    Prompt and completion tokens come from each response's `usage`; image tokens
+    are an estimate from the detail level (the API folds them into prompt
+    tokens). Also keeps per-day totals for the daily budget and a running
+    average cost per (agent, detail) used to plan scans under a budget.
+
+    Hedged duplicates that lose and are cancelled never report usage; they are
+    charged at the running estimate as "hedged" tokens so budgets still see them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self._days: Dict[str, int] = {}
+        self._costs: Dict[Tuple[str, Optional[str]], Tuple[int, int]] = {}  # (calls, total tokens)
+        self.adaptations = {"detection_downgraded": 0, "sommelier_skipped": 0}
+        self.hedged = {"calls": 0, "estimated_tokens": 0}
+
+    def _agent_totals(self, agent: str, config_version: str) -> Dict[str, int]:
+        return self._totals.setdefault((agent, config_version), {
+            "calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "image_tokens": 0, "hedged_tokens": 0
+        })
+
+    def _add_to_day(self, tokens: int):
+        day = _today()
+        self._days[day] = self._days.get(day, 0) + tokens
+        for old_day in sorted(self._days)[:-USAGE_HISTORY_DAYS]:
+            del self._days[old_day]
+
+    def record(self, agent: str, config_version: str, prompt_tokens: int, completion_tokens: int,
+               image_tokens: int = 0, detail: Optional[str] = None):
+        """Add one call's usage"""
+        with self._lock:
+            totals = self._agent_totals(agent, config_version)
+            totals["calls"] += 1
+            totals["prompt_tokens"] += prompt_tokens
+            totals["completion_tokens"] += completion_tokens
+            totals["image_tokens"] += image_tokens
+            self._add_to_day(prompt_tokens + completion_tokens)
+
+            calls, tokens = self._costs.get((agent, detail), (0, 0))
+            self._costs[(agent, detail)] = (calls + 1, tokens + prompt_tokens + completion_tokens)
+
+    def record_hedged(self, agent: str, config_version: str, detail: Optional[str] = None) -> int:
+        """Charge a cancelled hedge duplicate at the estimated cost of one call; returns the tokens charged"""
+        tokens = self.estimate(agent, detail)
+        with self._lock:
+            totals = self._agent_totals(agent, config_version)
+            totals["calls"] += 1
+            totals["hedged_tokens"] += tokens
+            self._add_to_day(tokens)
+            self.hedged["calls"] += 1
+            self.hedged["estimated_tokens"] += tokens
+        return tokens
+
+    def count_adaptation(self, name: str):
+        with self._lock:
+            self.adaptations[name] += 1
+
+    def spent_today(self) -> int:
+        """Tokens used so far today (UTC)"""
+        with self._lock:
+            return self._days.get(_today(), 0)
+
+    def estimate(self, agent: str, detail: Optional[str] = None) -> int:
+        """Expected total tokens of one call: the running average, or a default before any calls"""
+        with self._lock:
+            calls, tokens = self._costs.get((agent, detail), (0, 0))
+        if calls:
+            return round(tokens / calls)
+        return DEFAULT_CALL_ESTIMATES.get(agent, 1000) + image_tokens(detail)
+
+    def remaining(self, spent: int = 0) -> Optional[int]:
+        """
+        Tokens a scan may still spend under the configured budgets, or None when unlimited.
+
+        Args:
+            spent (int): Tokens the scan has used already (counts against the per-request budget)
+        """
+        limits = []
+        if TOKEN_BUDGET_PER_REQUEST > 0:
+            limits.append(TOKEN_BUDGET_PER_REQUEST - spent)
+        if TOKEN_BUDGET_PER_DAY > 0:
+            limits.append(TOKEN_BUDGET_PER_DAY - self.spent_today())
+        return max(0, min(limits)) if limits else None
+
+    def stats(self) -> Dict[str, Any]:
+        """Return usage per agent and config version, daily totals and budget state"""
+        with self._lock:
+            by_agent = [
+                {"agent": agent, "config_version": version, **totals,
+                 "total_tokens": totals["prompt_tokens"] + totals["completion_tokens"] + totals["hedged_tokens"]}
+                for (agent, version), totals in sorted(self._totals.items())
+            ]
+            days = dict(sorted(self._days.items()))
+            adaptations = dict(self.adaptations)
+            hedged = dict(self.hedged)
+            averages = {
+                f"{agent}:{detail}" if detail else agent: round(tokens / calls)
+                for (agent, detail), (calls, tokens) in self._costs.items()
+            }
+        return {
+            "by_agent": by_agent,
+            "days": days,
+            "average_call_tokens": averages,
+            "hedged": hedged,
+            "budget": {
+                "per_request": TOKEN_BUDGET_PER_REQUEST or None,
+                "per_day": TOKEN_BUDGET_PER_DAY or None,
+                "remaining_today": max(0, TOKEN_BUDGET_PER_DAY - days.get(_today(), 0)) if TOKEN_BUDGET_PER_DAY > 0 else None,
+                **adaptations,
+            },
+        }
+
+
+token_ledger = TokenLedger()
+
+
+def plan_detection(validation_detail: str, detection_detail: str, detection_calls: int,
+                   sommelier_detail: Optional[str]) -> Dict[str, Any]:
+    """
+    Pick the detection setup for a new scan under the token budget.
+
+    Keeps the configured detection when validation, detection and one sommelier
+    call are expected to fit; otherwise drops to a single 'low' detail call on
+    the whole image (no tiles). Detection always runs, so a tight budget
+    degrades the result instead of failing the scan.
+
+    Args:
+        validation_detail (str): Validation image detail level
+        detection_detail (str): Configured detection detail level
+        detection_calls (int): Detection calls the configured scan makes (tiles)
+        sommelier_detail (str, optional): Sommelier image detail (None in text mode)
+
+    Returns:
+        Dict[str, Any]: {"detection_detail", "tiles" (bool), "remaining" (None when unlimited)}
+    """
+    plan = {"detection_detail": detection_detail, "tiles": True, "remaining": token_ledger.remaining()}
+    if plan["remaining"] is None:
+        return plan
+
+    needed = (token_ledger.estimate("validation", validation_detail)
+              + detection_calls * token_ledger.estimate("detection", detection_detail)
+              + token_ledger.estimate("sommelier", sommelier_detail))
+    if needed > plan["remaining"] and (detection_detail != "low" or detection_calls > 1):
+        plan.update(detection_detail="low", tiles=False)
+        token_ledger.count_adaptation("detection_downgraded")
+    return plan
+
+
+def sommelier_fits(spent: int, sommelier_calls: int, sommelier_detail: Optional[str]) -> bool:
+    """
+    Whether the sommelier stage fits in what is left of the budget.
+
+    Args:
+        spent (int): Tokens the scan has used so far
+        sommelier_calls (int): Sommelier calls needed (one per shard of wines)
+        sommelier_detail (str, optional): Sommelier image detail (None in text mode)
+    """
+    remaining = token_ledger.remaining(spent)
+    if remaining is None or remaining >= sommelier_calls * token_ledger.estimate("sommelier", sommelier_detail):
+        return True
+    token_ledger.count_adaptation("sommelier_skipped")
+    return False
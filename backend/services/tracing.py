@@ -0,0 +1,178 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Dict, Iterator, Optional, Tuple, TypeVar
+
+from services.token_usage import image_tokens, token_ledger
+
+T = TypeVar("T")
+
+
+class ScanTrace:
+    """
+    Per-request stage timings for a wine scan.
+
+    Stage durations are reported back to clients in a Server-Timing header so
+    load tests can break end-to-end latency down by stage. Each stage can also
+    carry counts (bytes, wines, OpenAI tokens) that end up in the /metrics
+    histograms and the per-scan log line.
+
+    A request answered by a shared (coalesced) scan attaches that scan's trace:
+    its spans and tokens show up in the headers and log line, but the /metrics
+    stage histograms only count the request's own stages (the shared scan's
+    are observed once, when it finishes).
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.counts: Dict[str, Dict[str, int]] = {}
+        self.shared: Optional["ScanTrace"] = None
+        self.coalesced = False
+
+    def attach(self, shared: "ScanTrace", coalesced: bool = False):
+        """Report a shared scan's spans as part of this request (coalesced: joined a scan another request started)"""
+        self.shared = shared
+        self.coalesced = coalesced
+
+    def record(self, name: str, seconds: float):
+        """Add a stage duration (repeated stages accumulate)"""
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def annotate(self, name: str, **counts: int):
+        """Add counts (e.g. bytes=, wines=, prompt_tokens=) to a stage"""
+        stage_counts = self.counts.setdefault(name, {})
+        for key, value in counts.items():
+            stage_counts[key] = stage_counts.get(key, 0) + value
+
+    def elapsed(self) -> float:
+        """Seconds since the trace started"""
+        return time.perf_counter() - self.started
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time a block of code as one stage"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def _merged(self) -> Tuple[Dict[str, float], Dict[str, Dict[str, int]]]:
+        """This request's stages and counts plus those of the attached shared scan"""
+        stages, counts = dict(self.stages), {name: dict(values) for name, values in self.counts.items()}
+        if self.shared is not None:
+            for name, seconds in self.shared.stages.items():
+                stages[name] = stages.get(name, 0.0) + seconds
+            for name, values in self.shared.counts.items():
+                stage_counts = counts.setdefault(name, {})
+                for key, value in values.items():
+                    stage_counts[key] = stage_counts.get(key, 0) + value
+        return stages, counts
+
+    def server_timing(self) -> str:
+        """Format stage durations as a Server-Timing header value (milliseconds)"""
+        stages, _ = self._merged()
+        stages.setdefault("total", self.elapsed())
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in stages.items())
+
+    def tokens(self) -> Dict[str, int]:
+        """Token usage of the whole scan, summed over stages (hedged_tokens only when a hedge was cancelled)"""
+        totals = {"prompt_tokens": 0, "completion_tokens": 0, "image_tokens": 0}
+        hedged = 0
+        for counts in self._merged()[1].values():
+            for key in totals:
+                totals[key] += counts.get(key, 0)
+            hedged += counts.get("hedged_tokens", 0)
+        if hedged:
+            totals["hedged_tokens"] = hedged
+        return totals
+
+    def spans(self) -> Dict[str, Dict[str, Any]]:
+        """Per-stage duration (ms) and counts, in the order the stages first ran"""
+        stages, counts = self._merged()
+        names = list(stages) + [name for name in counts if name not in stages]
+        return {
+            name: {"ms": round(stages.get(name, 0.0) * 1000, 1), **counts.get(name, {})}
+            for name in names
+        }
+
+
+# Trace and stage an agent call belongs to (set by timed() for the duration of the call)
+current_trace: ContextVar[Optional[ScanTrace]] = ContextVar("current_trace", default=None)
+current_stage: ContextVar[Optional[str]] = ContextVar("current_stage", default=None)
+
+
+async def timed(trace: Optional[ScanTrace], name: str, awaitable: Awaitable[T]) -> T:
+    """
+    Await something, recording its duration as a stage on the trace.
+
+    The trace is also published in current_trace while the awaitable runs so
+    code further down (e.g. the agents) can attach information to it.
+    """
+    if trace is None:
+        return await awaitable
+    token = current_trace.set(trace)
+    stage_token = current_stage.set(name)
+    try:
+        with trace.stage(name):
+            return await awaitable
+    finally:
+        current_stage.reset(stage_token)
+        current_trace.reset(token)
+
+
+def record_usage(response, agent: str, config_version: str, detail: Optional[str] = None):
+    """
+    Account for an OpenAI response's token usage.
+
+    Adds it to the per-agent/per-config totals and, when the call is traced, to
+    the stage it was made in. detail is the image detail level sent with the
+    call (None for text-only calls) and determines the image token estimate.
+    """
+    usage = getattr(response, "usage", None)
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    estimated_image_tokens = image_tokens(detail)
+    token_ledger.record(agent, config_version, prompt_tokens, completion_tokens, estimated_image_tokens, detail)
+
+    trace, stage = current_trace.get(), current_stage.get()
+    if trace is not None and stage is not None:
+        trace.annotate(
+            stage,
+            calls=1,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            image_tokens=estimated_image_tokens
+        )
+
+
+def record_hedged_call(agent: str, config_version: str, detail: Optional[str] = None):
+    """
+    Account for a hedged duplicate request that was cancelled after the other one won.
+
+    It was sent (and billed) but its usage never arrives, so the ledger and
+    the traced stage are charged the agent's running per-call estimate.
+    """
+    tokens = token_ledger.record_hedged(agent, config_version, detail)
+    trace, stage = current_trace.get(), current_stage.get()
+    if trace is not None and stage is not None:
+        trace.annotate(stage, calls=1, hedged_tokens=tokens)
+
+
+class CallCounter:
+    """Counts upstream (OpenAI) HTTP requests made on behalf of one scan"""
+
+    def __init__(self):
+        self.count = 0
+
+
+# Counter of the scan an upstream request belongs to (inherited by tasks the scan starts)
+current_call_counter: ContextVar[Optional[CallCounter]] = ContextVar("current_call_counter", default=None)
+
+
+def count_upstream_call():
+    """Attribute one upstream request to the current scan, if any"""
+    counter = current_call_counter.get()
+    if counter is not None:
+        counter.count += 1
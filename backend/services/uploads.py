@@ -0,0 +1,160 @@
+import os
+from typing import Any, Dict, List, Tuple
+
+# Upload limits shared by the image endpoints
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024  # 10MB in bytes
+ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp'}
+
+# Map file extensions to MIME types for OpenAI
+MIME_TYPES = {
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'gif': 'image/gif',
+    'bmp': 'image/bmp',
+    'webp': 'image/webp'
+}
+
+# Most images accepted in one batch request
+MAX_BATCH_IMAGES = int(os.getenv('BATCH_MAX_IMAGES', 50))
+
+
+class UploadError(ValueError):
+    """Raised when an uploaded image is missing or not acceptable (maps to HTTP 400)"""
+
+
+def check_image_upload(filename: str, file_size: int) -> Tuple[str, str]:
+    """
+    Validates an upload's filename and size.
+
+    Returns:
+        Tuple[str, str]: (mime_type, file_extension)
+
+    Raises:
+        UploadError: If no file was selected, it is too large, or of an unsupported type
+    """
+    if not filename:
+        raise UploadError("No image file selected")
+
+    # Check file size (limit to 10MB)
+    if file_size > MAX_UPLOAD_BYTES:
+        raise UploadError(f"File too large. Maximum size is {MAX_UPLOAD_BYTES // (1024*1024)}MB")
+
+    # Validate file type
+    file_extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
+    if file_extension not in ALLOWED_EXTENSIONS:
+        raise UploadError(f"Invalid file type. Allowed: {', '.join(ALLOWED_EXTENSIONS)}")
+
+    return MIME_TYPES.get(file_extension, 'image/jpeg'), file_extension
+
+
+def read_image_upload(files, field: str = 'image') -> Tuple[bytes, str, str]:
+    """
+    Validates and reads an uploaded image from a multipart request.
+
+    Args:
+        files: The request's uploaded files mapping (e.g. flask.request.files)
+        field (str): Form field containing the image
+
+    Returns:
+        Tuple[bytes, str, str]: (file_data, mime_type, file_extension)
+
+    Raises:
+        UploadError: If the upload is missing, too large, empty, or of an unsupported type
+    """
+    # Check if image file is in request
+    if field not in files:
+        raise UploadError("No image file provided")
+
+    return _read_file(files[field])
+
+
+def _read_file(file) -> Tuple[bytes, str, str]:
+    """Validate and read one uploaded file (werkzeug FileStorage)"""
+    file.seek(0, os.SEEK_END)
+    file_size = file.tell()
+    file.seek(0)
+
+    mime_type, file_extension = check_image_upload(file.filename, file_size)
+
+    # Read file data
+    file_data = file.read()
+
+    if len(file_data) == 0:
+        raise UploadError("Uploaded file contains no data")
+
+    return file_data, mime_type, file_extension
+
+
+async def read_image_upload_async(form, field: str = 'image') -> Tuple[bytes, str, str]:
+    """
+    Async counterpart of read_image_upload for a parsed ASGI (Starlette) form.
+
+    Reads at most MAX_UPLOAD_BYTES + 1 bytes so oversized uploads are rejected
+    without buffering them fully.
+    """
+    upload = form.get(field)
+    if upload is None or isinstance(upload, str):
+        raise UploadError("No image file provided")
+
+    return await _read_file_async(upload)
+
+
+async def _read_file_async(upload) -> Tuple[bytes, str, str]:
+    """Validate and read one uploaded file (Starlette UploadFile)"""
+    file_data = await upload.read(MAX_UPLOAD_BYTES + 1)
+    mime_type, file_extension = check_image_upload(upload.filename, len(file_data))
+
+    if len(file_data) == 0:
+        raise UploadError("Uploaded file contains no data")
+
+    return file_data, mime_type, file_extension
+
+
+def _check_batch_size(count: int):
+    if count == 0:
+        raise UploadError("No image files provided")
+    if count > MAX_BATCH_IMAGES:
+        raise UploadError(f"Too many images. Maximum is {MAX_BATCH_IMAGES} per batch")
+
+
+def read_image_uploads(files, field: str = 'images') -> List[Dict[str, Any]]:
+    """
+    Validates and reads every image of a batch upload.
+
+    A bad file does not fail the batch: its item carries an "error" instead of data.
+
+    Returns:
+        List[Dict[str, Any]]: One item per file, in upload order:
+            {"filename", "file_data", "mime_type"} or {"filename", "error"}
+
+    Raises:
+        UploadError: If there are no files or more than MAX_BATCH_IMAGES
+    """
+    uploads = files.getlist(field)
+    _check_batch_size(len(uploads))
+
+    items = []
+    for file in uploads:
+        try:
+            file_data, mime_type, _ = _read_file(file)
+            items.append({"filename": file.filename, "file_data": file_data, "mime_type": mime_type})
+        except UploadError as e:
+            items.append({"filename": file.filename, "error": str(e)})
+    return items
+
+
+async def read_image_uploads_async(form, field: str = 'images') -> List[Dict[str, Any]]:
+    """Async counterpart of read_image_uploads for a parsed ASGI (Starlette) form"""
+    uploads = [upload for upload in form.getlist(field) if not isinstance(upload, str)]
+    _check_batch_size(len(uploads))
+
+    items = []
+    for upload in uploads:
+        try:
+            file_data, mime_type, _ = await _read_file_async(upload)
+            items.append({"filename": upload.filename, "file_data": file_data, "mime_type": mime_type})
+        except UploadError as e:
+            items.append({"filename": upload.filename, "error": str(e)})
+    return items
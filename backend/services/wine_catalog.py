@@ -0,0 +1,361 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from services.string_distance import levenshtein_distance, normalize_string
+
+# Common wine-list abbreviations, expanded before matching
+WINE_ABBREVIATIONS = {
+    "vyd": "vineyard",
+    "vyds": "vineyards",
+    "vnyd": "vineyard",
+    "vnyds": "vineyards",
+    "wnry": "winery",
+    "est": "estate",
+    "res": "reserve",
+    "rsv": "reserve",
+    "mt": "mount",
+    "st": "saint",
+    "ste": "sainte",
+    "cab": "cabernet sauvignon",
+    "cs": "cabernet sauvignon",
+    "sauv": "sauvignon",
+    "sb": "sauvignon blanc",
+    "chard": "chardonnay",
+    "pn": "pinot noir",
+    "pg": "pinot grigio",
+    "zin": "zinfandel",
+    "syr": "syrah",
+    "gsm": "grenache syrah mourvedre",
+}
+
+# Catalog fields that identify a wine (the vintage is kept from the detection)
+CATALOG_FIELDS = ("wineries", "name", "varietal", "region")
+
+
+def _tokens(text: str) -> List[str]:
+    """Normalized, abbreviation-expanded word tokens"""
+    words = []
+    for token in re.findall(r"[a-z0-9]+", normalize_string(text)):
+        for word in WINE_ABBREVIATIONS.get(token, token).split():
+            # "Cab Sauv" expands to "cabernet sauvignon sauvignon"
+            if not words or words[-1] != word:
+                words.append(word)
+    return words
+
+
+def _unique(words: List[str]) -> List[str]:
+    """Words in order of first appearance, without repeats"""
+    return list(dict.fromkeys(words))
+
+
+def catalog_key_parts(wine: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    Producer and rest-of-name parts of a wine's catalog key.
+
+    Each word is kept once: the varietal usually repeats words of the name
+    ("Alexander Valley Cabernet Sauvignon" / "Cabernet Sauvignon"), and a
+    repeat would otherwise weigh twice in similarity scores.
+    """
+    producer = _unique([word for winery in wine.get("wineries") or [] for word in _tokens(winery)])
+    seen = set(producer)
+    rest = [word for word in _unique(_tokens(wine.get("name") or "") + _tokens(wine.get("varietal") or ""))
+            if word not in seen]
+    return " ".join(producer), " ".join(rest)
+
+
+def catalog_key(wine: Dict[str, Any]) -> str:
+    """Canonical matching key for a wine: producer, name and varietal"""
+    return " ".join(part for part in catalog_key_parts(wine) if part)
+
+
+def wine_id_for_key(key: str) -> str:
+    """Stable ID derived from a catalog key"""
+    return "w_" + hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+def _trigrams(key: str) -> Set[str]:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _dice(a: Set[str], b: Set[str]) -> float:
+    return 2.0 * len(a & b) / (len(a) + len(b)) if a or b else 0.0
+
+
+def _has_close_word(word: str, words: Set[str]) -> bool:
+    """Whether words contains word or a spelling within OCR noise of it"""
+    if word in words:
+        return True
+    max_distance = max(1, len(word) // 4)
+    return any(levenshtein_distance(word, other, max_distance) <= max_distance for other in words)
+
+
+def _conflicting(words_a: Set[str], words_b: Set[str]) -> bool:
+    """
+    Whether two names each have a word the other lacks ("Napa Valley" vs
+    "Alexander Valley"), i.e. different wines rather than one name with words
+    missing or misread
+    """
+    return (any(not _has_close_word(word, words_b) for word in words_a)
+            and any(not _has_close_word(word, words_a) for word in words_b))
+
+
+class WineCatalog:
+    """
+    Local catalog of known wines used to canonicalize free-text detections.
+
+    Each wine gets a stable ID (a hash of its canonical key) and canonical
+    fields from the first time it was seen or seeded. Detections are matched by
+    exact key first, then fuzzily among the wines of the same producer: the
+    rest of the name must reach match_threshold trigram similarity and must
+    not conflict (each side having words the other lacks, like "Napa Valley"
+    vs "Alexander Valley"), so abbreviations and OCR noise ("Alexander Valley
+    Vyds Cab") resolve to the same ID while a producer's other wines don't.
+    Fuzzy matches at alias_threshold or above are remembered as aliases so
+    repeat lookups take the exact path.
+
+    Wines and aliases live in SQLite (in memory unless a path is given); the
+    per-producer trigram index is held in memory and updated in place as wines
+    are added or evicted. Learned wines (unmatched detections) are capped at
+    max_learned, least recently matched first out; seeded wines are kept.
+
+    Args:
+        path (str, optional): SQLite file used to persist the catalog
+        match_threshold (float): Minimum trigram Dice similarity of the rest of the name for a fuzzy match
+        alias_threshold (float): Minimum similarity for a fuzzy match to be remembered as an alias
+        learn (bool): Add unmatched detections to the catalog as new wines
+        max_learned (int): Learned wines kept (0 = unlimited)
+        name (str): Label used in log lines and stats
+    """
+
+    def __init__(self, path: Optional[str] = None, match_threshold: float = 0.85, alias_threshold: float = 0.95,
+                 learn: bool = True, max_learned: int = 5000, name: str = "Wine catalog"):
+        self.path = path
+        self.match_threshold = float(match_threshold)
+        self.alias_threshold = max(float(alias_threshold), self.match_threshold)
+        self.learn = learn
+        self.max_learned = max_learned
+        self.name = name
+        self._lock = threading.Lock()
+        self._wines: Dict[str, Dict[str, Any]] = {}
+        self._keys: Dict[str, str] = {}
+        # producer -> wine_id -> (trigrams, words) of the rest of the name
+        self._producers: Dict[str, Dict[str, Tuple[Set[str], Set[str]]]] = {}
+        # Learned wine IDs, least recently matched first
+        self._learned: "OrderedDict[str, None]" = OrderedDict()
+        self.exact_hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._db = self._open_db(path)
+
+    def _open_db(self, path: Optional[str]) -> sqlite3.Connection:
+        """Open (or create) the catalog database and load it into the index"""
+        target = path or ":memory:"
+        try:
+            if path:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            db = sqlite3.connect(target, check_same_thread=False)
+        except Exception as e:
+            print(f"{self.name}: Persistence disabled, could not open {path}: {e}")
+            db = sqlite3.connect(":memory:", check_same_thread=False)
+
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS wines ("
+            "id TEXT PRIMARY KEY, key TEXT NOT NULL, fields TEXT NOT NULL, created_at REAL NOT NULL, "
+            "learned INTEGER NOT NULL DEFAULT 0)"
+        )
+        if "learned" not in {row[1] for row in db.execute("PRAGMA table_info(wines)")}:
+            db.execute("ALTER TABLE wines ADD COLUMN learned INTEGER NOT NULL DEFAULT 0")
+        db.execute("CREATE TABLE IF NOT EXISTS aliases (key TEXT PRIMARY KEY, wine_id TEXT NOT NULL)")
+        db.commit()
+
+        for wine_id, key, fields, learned in db.execute(
+                "SELECT id, key, fields, learned FROM wines ORDER BY created_at"):
+            self._index(wine_id, key, json.loads(fields))
+            if learned:
+                self._learned[wine_id] = None
+        for key, wine_id in db.execute("SELECT key, wine_id FROM aliases"):
+            if wine_id in self._wines:
+                self._keys[key] = wine_id
+        if path:
+            print(f"{self.name}: Loaded {len(self._wines)} wines from {path}")
+        return db
+
+    def _index(self, wine_id: str, key: str, fields: Dict[str, Any]):
+        """Add a wine to the in-memory indexes (caller holds the lock or is initializing)"""
+        self._wines[wine_id] = fields
+        self._keys[key] = wine_id
+        producer, rest = catalog_key_parts(fields)
+        if producer:
+            self._producers.setdefault(producer, {})[wine_id] = (_trigrams(rest), set(rest.split()))
+
+    def _unindex(self, wine_id: str):
+        """Drop a wine and its aliases from the in-memory indexes (caller holds the lock)"""
+        fields = self._wines.pop(wine_id)
+        producer, _ = catalog_key_parts(fields)
+        wines = self._producers.get(producer)
+        if wines is not None:
+            wines.pop(wine_id, None)
+            if not wines:
+                del self._producers[producer]
+        for key in [key for key, target in self._keys.items() if target == wine_id]:
+            del self._keys[key]
+
+    def add(self, wine: Dict[str, Any]) -> Optional[str]:
+        """Add a wine (detection-shaped dict) to the catalog and return its ID"""
+        key = catalog_key(wine)
+        if not key:
+            return None
+        with self._lock:
+            return self._add(key, wine)
+
+    def _add(self, key: str, wine: Dict[str, Any], learned: bool = False) -> str:
+        wine_id = self._keys.get(key) or wine_id_for_key(key)
+        if wine_id in self._wines:
+            return wine_id
+
+        fields = {field: wine.get(field) for field in CATALOG_FIELDS}
+        fields["wineries"] = list(fields["wineries"] or [])
+        self._index(wine_id, key, fields)
+        try:
+            self._db.execute(
+                "INSERT OR IGNORE INTO wines (id, key, fields, created_at, learned) VALUES (?, ?, ?, ?, ?)",
+                (wine_id, key, json.dumps(fields), time.time(), int(learned))
+            )
+            self._db.commit()
+        except Exception as e:
+            print(f"{self.name}: Failed to persist wine: {e}")
+        if learned:
+            self._learned[wine_id] = None
+            self._evict_learned()
+        return wine_id
+
+    def _evict_learned(self):
+        """Drop the least recently matched learned wines beyond max_learned (caller holds the lock)"""
+        if self.max_learned <= 0:
+            return
+        evicted = []
+        while len(self._learned) > self.max_learned:
+            wine_id, _ = self._learned.popitem(last=False)
+            self._unindex(wine_id)
+            evicted.append((wine_id,))
+        if not evicted:
+            return
+        self.evictions += len(evicted)
+        try:
+            self._db.executemany("DELETE FROM wines WHERE id = ?", evicted)
+            self._db.executemany("DELETE FROM aliases WHERE wine_id = ?", evicted)
+            self._db.commit()
+        except Exception as e:
+            print(f"{self.name}: Failed to delete evicted wines: {e}")
+
+    def _remember_alias(self, key: str, wine_id: str):
+        self._keys[key] = wine_id
+        try:
+            self._db.execute("INSERT OR REPLACE INTO aliases (key, wine_id) VALUES (?, ?)", (key, wine_id))
+            self._db.commit()
+        except Exception as e:
+            print(f"{self.name}: Failed to persist alias: {e}")
+
+    def _best_fuzzy_match(self, wine: Dict[str, Any]) -> Tuple[Optional[str], float]:
+        """Most similar non-conflicting wine of the same producer, by trigram Dice over the rest of the name"""
+        producer, rest = catalog_key_parts(wine)
+        candidates = self._producers.get(producer) if producer else None
+        if not candidates or not rest:
+            return None, 0.0
+
+        grams, words = _trigrams(rest), set(rest.split())
+        best_id, best_score = None, 0.0
+        # Dict order is insertion order, so the oldest wine wins ties
+        for wine_id, (candidate_grams, candidate_words) in candidates.items():
+            score = _dice(grams, candidate_grams)
+            if score > best_score and not _conflicting(words, candidate_words):
+                best_id, best_score = wine_id, score
+        return best_id, best_score
+
+    def match(self, wine: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Look a detected wine up in the catalog.
+
+        Returns:
+            Optional[Dict[str, Any]]: {"wine_id", "score", "canonical"} or None
+            when nothing matched (and learning is disabled)
+        """
+        key = catalog_key(wine)
+        if not key:
+            return None
+
+        with self._lock:
+            wine_id = self._keys.get(key)
+            score = 1.0
+            if wine_id is not None:
+                self.exact_hits += 1
+            else:
+                wine_id, score = self._best_fuzzy_match(wine)
+                if wine_id is not None and score >= self.match_threshold:
+                    self.fuzzy_hits += 1
+                    if score >= self.alias_threshold:
+                        self._remember_alias(key, wine_id)
+                else:
+                    self.misses += 1
+                    if not self.learn:
+                        return None
+                    wine_id, score = self._add(key, wine, learned=True), 1.0
+            if wine_id in self._learned:
+                self._learned.move_to_end(wine_id)
+
+            canonical = dict(self._wines[wine_id])
+            canonical["wineries"] = list(canonical["wineries"])
+            return {"wine_id": wine_id, "score": round(score, 3), "canonical": canonical}
+
+    def canonicalize(self, wines: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Return copies of detected wines with "wine_id" and "canonical" fields added"""
+        results = []
+        for wine in wines:
+            match = self.match(wine)
+            results.append({
+                **wine,
+                "wine_id": match["wine_id"] if match else None,
+                "canonical": match["canonical"] if match else None,
+            })
+        return results
+
+    def load_json(self, path: str) -> int:
+        """Seed the catalog from a JSON list of wines (or {"wines": [...]}); returns the count added"""
+        with open(path, 'r') as f:
+            data = json.load(f)
+        wines = data.get("wines", []) if isinstance(data, dict) else data
+        before = len(self._wines)
+        for wine in wines:
+            self.add(wine)
+        added = len(self._wines) - before
+        print(f"{self.name}: Seeded {added} wines from {path}")
+        return added
+
+    def stats(self) -> Dict[str, Any]:
+        """Return catalog size and lookup counters"""
+        with self._lock:
+            lookups = self.exact_hits + self.fuzzy_hits + self.misses
+            return {
+                "name": self.name,
+                "wines": len(self._wines),
+                "aliases": len(self._keys) - len(self._wines),
+                "persistent": bool(self.path),
+                "learn": self.learn,
+                "learned": len(self._learned),
+                "max_learned": self.max_learned or None,
+                "evictions": self.evictions,
+                "exact_hits": self.exact_hits,
+                "fuzzy_hits": self.fuzzy_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.exact_hits + self.fuzzy_hits) / lookups, 4) if lookups else 0.0,
+            }
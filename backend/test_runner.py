@@ -5,16 +5,30 @@ Wine Analysis Test Runner
 Reads test images from test_data/images/, calls the /api/analyze-wine-image endpoint,
 and compares results with expected outcomes from test_data/expected_results.json.
 
-Usage: python3 test_runner.py
+Tests run concurrently with --workers N over one shared HTTP session. Per-image
+latency statistics are printed in the summary and can be written as JSON and
+JUnit XML reports for CI.
+
+Usage: python3 test_runner.py [--workers 8] [--json-report report.json] [--junit-report junit.xml]
 """
 
 import os
 import json
+import argparse
 import requests
+import statistics
 import time
-import unicodedata
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
+import numpy as np
+from requests.adapters import HTTPAdapter
+
+from services.assignment import linear_sum_assignment
+from services.metrics import percentile
+from services.string_distance import normalize_string, levenshtein_distance
+
 # Configuration
 API_BASE_URL = "http://localhost:5001"
 TEST_DATA_DIR = Path("test_data")
@@ -32,60 +46,38 @@ def load_expected_results():
         print(f"❌ Error loading expected results: {e}")
         return {}
 
-def call_api(image_path):
+def create_session(workers=1):
+    """Create an HTTP session whose connection pool fits the worker count"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, workers))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def call_api(image_path, session=None, api_url=API_BASE_URL, timeout=30, log=print):
     """Call the wine analysis API with an image file"""
     try:
         with open(image_path, 'rb') as f:
             files = {'image': f}
-            response = requests.post(
-                f"{API_BASE_URL}/api/analyze-wine-image",
+            response = (session or requests).post(
+                f"{api_url}/api/analyze-wine-image",
                 files=files,
-                timeout=30
+                timeout=timeout
             )
         
         if response.status_code == 200:
             return response.json()
         else:
-            print(f"API Error {response.status_code}: {response.text}")
+            log(f"API Error {response.status_code}: {response.text}")
             return None
             
     except requests.exceptions.ConnectionError:
-        print(f"❌ Connection Error: Is the backend server running at {API_BASE_URL}?")
+        log(f"❌ Connection Error: Is the backend server running at {api_url}?")
         return None
     except Exception as e:
-        print(f"❌ API call error: {e}")
+        log(f"❌ API call error: {e}")
         return None
 
-def normalize_string(s):
-    """Normalize string: remove accents, lowercase, strip whitespace"""
-    if not s:
-        return ""
-    # Remove accents using NFD normalization
-    normalized = unicodedata.normalize('NFD', str(s))
-    # Filter out combining characters (accents)
-    without_accents = ''.join(c for c in normalized if unicodedata.category(c) != 'Mn')
-    return without_accents.lower().strip()
-
-def levenshtein_distance(s1, s2):
-    """Calculate Levenshtein distance between two strings"""
-    if len(s1) < len(s2):
-        return levenshtein_distance(s2, s1)
-    
-    if len(s2) == 0:
-        return len(s1)
-    
-    previous_row = list(range(len(s2) + 1))
-    for i, c1 in enumerate(s1):
-        current_row = [i + 1]
-        for j, c2 in enumerate(s2):
-            insertions = previous_row[j + 1] + 1
-            deletions = current_row[j] + 1
-            substitutions = previous_row[j] + (c1 != c2)
-            current_row.append(min(insertions, deletions, substitutions))
-        previous_row = current_row
-    
-    return previous_row[-1]
-
 def similarity_ratio(s1, s2):
     """Calculate similarity ratio (0.0 to 1.0) using Levenshtein distance"""
     if not s1 and not s2:
@@ -114,11 +106,12 @@ def exact_match_field(expected, actual, field_name, max_distance=2):
     if not expected or not actual:
         return False, f"❌ {field_name}: one empty - expected '{expected}', got '{actual}'"
     
-    distance = levenshtein_distance(normalize_string(expected), normalize_string(actual))
+    # Bounded: stops as soon as the distance is known to exceed max_distance
+    distance = levenshtein_distance(normalize_string(expected), normalize_string(actual), max_distance)
     if distance <= max_distance:
         return True, f"✅ {field_name}: '{expected}' ≈ '{actual}' (distance: {distance})"
     else:
-        return False, f"❌ {field_name}: '{expected}' ≠ '{actual}' (distance: {distance})"
+        return False, f"❌ {field_name}: '{expected}' ≠ '{actual}' (distance: >{max_distance})"
 
 def exact_match_winery(expected_wineries, actual_wineries):
     """Exact match for winery field (list of wineries)"""
@@ -130,7 +123,7 @@ def exact_match_winery(expected_wineries, actual_wineries):
     # For simplicity, check if any expected winery matches any actual winery
     for expected in expected_wineries:
         for actual in actual_wineries:
-            distance = levenshtein_distance(normalize_string(expected), normalize_string(actual))
+            distance = levenshtein_distance(normalize_string(expected), normalize_string(actual), 2)
             if distance <= 2:
                 return True, f"✅ Winery: '{expected}' ≈ '{actual}' (distance: {distance})"
     
@@ -179,8 +172,104 @@ def calculate_wine_similarity(expected_wine, actual_wine):
     overall_score = sum(scores) / len(scores)
     return overall_score, matches
 
-def match_wines(expected_wines, actual_wines, threshold=0.6):
-    """Match expected wines with actual wines using similarity scores"""
+def _fields_close(expected, actual, max_distance=2):
+    """Predicate form of exact_match_field (no message)"""
+    if not expected and not actual:
+        return True
+    if not expected or not actual:
+        return False
+    return levenshtein_distance(normalize_string(expected), normalize_string(actual), max_distance) <= max_distance
+
+def _wineries_close(expected_wineries, actual_wineries):
+    """Predicate form of exact_match_winery (no message)"""
+    if not expected_wineries and not actual_wineries:
+        return True
+    if not expected_wineries or not actual_wineries:
+        return False
+    return any(_fields_close(e, a) for e in expected_wineries for a in actual_wineries)
+
+def _fields_similar(expected, actual, threshold=0.7):
+    """Predicate form of approx_match_field (no message)"""
+    if not expected and not actual:
+        return True
+    if not expected or not actual:
+        return False
+    # Same test as similarity_ratio(), but the distance scan stops once it exceeds what the threshold allows
+    max_len = max(len(expected), len(actual))
+    max_distance = int((1.0 - threshold) * max_len) + 1
+    distance = levenshtein_distance(normalize_string(expected), normalize_string(actual), max_distance)
+    return 1.0 - (distance / max_len) >= threshold
+
+def _pairwise_matrix(expected_values, actual_values, predicate):
+    """
+    E×A 0/1 matrix of predicate(expected, actual).
+
+    The predicate runs once per distinct value pair and is broadcast back to
+    every wine; menus repeat regions, varietals and producers heavily.
+    """
+    def index(values):
+        keys = {}
+        positions = np.array([keys.setdefault(v, len(keys)) for v in values], dtype=int)
+        return list(keys), positions
+    
+    expected_keys, expected_idx = index(expected_values)
+    actual_keys, actual_idx = index(actual_values)
+    unique = np.array(
+        [[predicate(e, a) for a in actual_keys] for e in expected_keys],
+        dtype=float
+    ).reshape(len(expected_keys), len(actual_keys))
+    return unique[np.ix_(expected_idx, actual_idx)]
+
+def similarity_matrix(expected_wines, actual_wines):
+    """calculate_wine_similarity scores for every expected/actual pair, as an E×A array"""
+    def column(wines, field):
+        return [wine.get(field) for wine in wines]
+    
+    def wineries(wines):
+        return [tuple(wine.get('wineries') or []) for wine in wines]
+    
+    matrices = [
+        _pairwise_matrix(column(expected_wines, 'year'), column(actual_wines, 'year'),
+                         lambda e, a: e is None or e == a),
+        _pairwise_matrix(wineries(expected_wines), wineries(actual_wines), _wineries_close),
+        _pairwise_matrix(column(expected_wines, 'varietal'), column(actual_wines, 'varietal'), _fields_close),
+        _pairwise_matrix(column(expected_wines, 'name'), column(actual_wines, 'name'), _fields_similar),
+        _pairwise_matrix(column(expected_wines, 'region'), column(actual_wines, 'region'), _fields_similar),
+    ]
+    return sum(matrices) / len(matrices)
+
+def optimal_pairs(expected_wines, actual_wines, threshold=0.6):
+    """
+    Pair expected and actual wines with an optimal assignment.
+
+    Pairs below the threshold get weight 0 and the rest 1 + score, so the
+    solver maximizes the number of matched wines first and their total
+    similarity second.
+    """
+    scores = similarity_matrix(expected_wines, actual_wines)
+    weights = np.where(scores >= threshold, 1.0 + scores, 0.0)
+    rows, cols = linear_sum_assignment(-weights)
+    
+    matched_pairs = []
+    for i, j in zip(rows, cols):
+        if scores[i, j] >= threshold:
+            _, details = calculate_wine_similarity(expected_wines[i], actual_wines[j])
+            matched_pairs.append({
+                'expected': expected_wines[i],
+                'actual': actual_wines[j],
+                'score': float(scores[i, j]),
+                'details': details
+            })
+    return matched_pairs
+
+def match_wines(expected_wines, actual_wines, threshold=0.6, mode="optimal"):
+    """
+    Match expected wines with actual wines using similarity scores.
+    
+    mode "optimal" scores all pairs in one batched pass and solves the
+    assignment exactly; "greedy" takes the best remaining match for each
+    expected wine in order.
+    """
     if not expected_wines and not actual_wines:
         return True, [], "✅ No wines expected or detected"
     
@@ -190,6 +279,10 @@ def match_wines(expected_wines, actual_wines, threshold=0.6):
     if not actual_wines:
         return False, [], f"❌ Expected {len(expected_wines)} wines, but detected none"
     
+    if mode == "optimal":
+        matched_pairs = optimal_pairs(expected_wines, actual_wines, threshold)
+        return _match_summary(expected_wines, actual_wines, matched_pairs)
+    
     matched_pairs = []
     unmatched_expected = []
     unmatched_actual = list(actual_wines)
@@ -220,13 +313,19 @@ def match_wines(expected_wines, actual_wines, threshold=0.6):
         else:
             unmatched_expected.append(expected_wine)
     
+    return _match_summary(expected_wines, actual_wines, matched_pairs)
+
+def _match_summary(expected_wines, actual_wines, matched_pairs):
+    """Pass/fail and summary message for a set of matched pairs"""
+    unmatched_actual = len(actual_wines) - len(matched_pairs)
+    
     # Calculate success
     total_expected = len(expected_wines)
     matched_count = len(matched_pairs)
     success_rate = matched_count / total_expected if total_expected > 0 else 0.0
     
     # Generate summary message
-    if success_rate == 1.0 and len(unmatched_actual) == 0:
+    if success_rate == 1.0 and unmatched_actual == 0:
         summary = f"✅ Perfect match: {matched_count}/{total_expected} wines matched"
     elif success_rate >= 0.7:
         summary = f"⚠️ Good match: {matched_count}/{total_expected} wines matched ({success_rate:.1%})"
@@ -242,38 +341,56 @@ def compare_validation(expected_should_validate, actual_valid):
     else:
         return False, f"❌ Validation wrong: expected {expected_should_validate}, got {actual_valid}"
 
-def compare_wines(expected_wines, actual_wines):
+def compare_wines(expected_wines, actual_wines, mode="optimal"):
     """Compare wine detection results using detailed matching"""
-    wines_passed, matched_pairs, summary = match_wines(expected_wines, actual_wines)
+    wines_passed, matched_pairs, summary = match_wines(expected_wines, actual_wines, mode=mode)
     return wines_passed, summary, matched_pairs
 
-def run_single_test(image_filename, expected_result):
-    """Run a single test case"""
-    print(f"\n🧪 Testing: {image_filename}")
-    print("-" * 50)
+def run_single_test(image_filename, expected_result, session=None, api_url=API_BASE_URL, timeout=30, matching="optimal"):
+    """
+    Run a single test case.
+
+    Console output is buffered in the returned result (rather than printed) so
+    tests running on parallel workers don't interleave their lines.
+    """
+    output = []
+    log = output.append
+    result = {
+        "image": image_filename,
+        "passed": False,
+        "latency": None,
+        "failure": None,
+        "output": output
+    }
+    
+    log(f"\n🧪 Testing: {image_filename}")
+    log("-" * 50)
     
     image_path = IMAGES_DIR / image_filename
     if not image_path.exists():
-        print(f"❌ Image file not found: {image_path}")
-        return False
+        log(f"❌ Image file not found: {image_path}")
+        result["failure"] = f"Image file not found: {image_path}"
+        return result
     
     # Call API
-    start_time = time.time()
-    actual_result = call_api(image_path)
-    end_time = time.time()
+    start_time = time.perf_counter()
+    actual_result = call_api(image_path, session=session, api_url=api_url, timeout=timeout, log=log)
+    end_time = time.perf_counter()
     
     if actual_result is None:
-        print("❌ API call failed")
-        return False
+        log("❌ API call failed")
+        result["failure"] = "API call failed"
+        return result
     
-    print(f"⏱️  Processing time: {end_time - start_time:.2f}s")
+    result["latency"] = end_time - start_time
+    log(f"⏱️  Processing time: {end_time - start_time:.2f}s")
     
     # Compare validation
     expected_should_validate = expected_result["should_validate"]
     actual_valid = actual_result.get("valid", False)
     
     validation_passed, validation_msg = compare_validation(expected_should_validate, actual_valid)
-    print(validation_msg)
+    log(validation_msg)
     
     # Compare wines (only if validation should pass)
     wines_passed = True
@@ -283,46 +400,112 @@ def run_single_test(image_filename, expected_result):
     if expected_should_validate:
         expected_wines = expected_result["expected_wines"]
         actual_wines = actual_result.get("wines", [])
-        wines_passed, wines_msg, matched_pairs = compare_wines(expected_wines, actual_wines)
-        print(wines_msg)
+        wines_passed, wines_msg, matched_pairs = compare_wines(expected_wines, actual_wines, matching)
+        log(wines_msg)
         
         # Show detailed wine matching results
         if matched_pairs:
-            print(f"🍷 Detailed wine matches:")
+            log(f"🍷 Detailed wine matches:")
             for i, pair in enumerate(matched_pairs[:3]):  # Show first 3 matches
-                print(f"   Match {i+1} (score: {pair['score']:.2f}):")
-                print(f"      Expected: {pair['expected'].get('name', 'Unknown')} by {pair['expected'].get('wineries', ['Unknown'])[0]}")
-                print(f"      Detected: {pair['actual'].get('name', 'Unknown')} by {pair['actual'].get('wineries', ['Unknown'])[0]}")
+                log(f"   Match {i+1} (score: {pair['score']:.2f}):")
+                log(f"      Expected: {pair['expected'].get('name', 'Unknown')} by {pair['expected'].get('wineries', ['Unknown'])[0]}")
+                log(f"      Detected: {pair['actual'].get('name', 'Unknown')} by {pair['actual'].get('wineries', ['Unknown'])[0]}")
                 # Show field-by-field details
                 for detail in pair['details']:
-                    print(f"         {detail}")
+                    log(f"         {detail}")
             if len(matched_pairs) > 3:
-                print(f"   ... and {len(matched_pairs) - 3} more matches")
+                log(f"   ... and {len(matched_pairs) - 3} more matches")
         elif actual_wines and expected_wines:
-            print(f"🍷 No successful matches found. Detected wines:")
+            log(f"🍷 No successful matches found. Detected wines:")
             for i, wine in enumerate(actual_wines[:3]):
-                print(f"   {i+1}. {wine.get('name', 'Unknown')} by {wine.get('wineries', ['Unknown'])[0]} ({wine.get('varietal', 'Unknown varietal')})")
+                log(f"   {i+1}. {wine.get('name', 'Unknown')} by {wine.get('wineries', ['Unknown'])[0]} ({wine.get('varietal', 'Unknown varietal')})")
             if len(actual_wines) > 3:
-                print(f"   ... and {len(actual_wines) - 3} more")
+                log(f"   ... and {len(actual_wines) - 3} more")
     
     # Overall result
     overall_passed = validation_passed and wines_passed
+    failures = []
     if overall_passed:
-        print("✅ PASS")
+        log("✅ PASS")
     else:
-        print("❌ FAIL")
+        log("❌ FAIL")
         if not validation_passed:
-            print(f"📝 Validation failed: expected {expected_should_validate}, got {actual_valid}")
+            failures.append(f"Validation failed: expected {expected_should_validate}, got {actual_valid}")
+            log(f"📝 {failures[-1]}")
         if expected_should_validate and not wines_passed:
             expected_count = len(expected_result['expected_wines'])
             actual_count = len(actual_result.get('wines', []))
             matched_count = len(matched_pairs) if matched_pairs else 0
-            print(f"📝 Wine matching failed: {matched_count}/{expected_count} wines matched successfully")
-    
-    return overall_passed
+            failures.append(f"Wine matching failed: {matched_count}/{expected_count} wines matched successfully")
+            log(f"📝 {failures[-1]}")
+    
+    result["passed"] = overall_passed
+    result["failure"] = "; ".join(failures) or None
+    result["matched_wines"] = len(matched_pairs)
+    result["expected_wines"] = len(expected_result.get('expected_wines', []))
+    result["detected_wines"] = len(actual_result.get('wines', []))
+    return result
+
+def latency_stats(results):
+    """Per-image latency statistics (seconds) over tests that got an API response"""
+    latencies = [r["latency"] for r in results if r["latency"] is not None]
+    if not latencies:
+        return {"count": 0, "min": 0.0, "median": 0.0, "p95": 0.0, "max": 0.0}
+    return {
+        "count": len(latencies),
+        "min": round(min(latencies), 3),
+        "median": round(statistics.median(latencies), 3),
+        "p95": round(percentile(latencies, 95), 3),
+        "max": round(max(latencies), 3)
+    }
+
+def write_json_report(path, results, stats, duration):
+    """Write test results and latency statistics as JSON"""
+    report = {
+        "total": len(results),
+        "passed": sum(1 for r in results if r["passed"]),
+        "failed": sum(1 for r in results if not r["passed"]),
+        "duration_seconds": round(duration, 3),
+        "latency": stats,
+        "tests": [{k: v for k, v in r.items() if k != "output"} for r in results]
+    }
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+def write_junit_report(path, results, duration):
+    """Write test results as JUnit XML so CI can display them"""
+    failed = sum(1 for r in results if not r["passed"])
+    suite = ET.Element("testsuite", {
+        "name": "wine-analysis",
+        "tests": str(len(results)),
+        "failures": str(failed),
+        "errors": "0",
+        "time": f"{duration:.3f}"
+    })
+    for r in results:
+        case = ET.SubElement(suite, "testcase", {
+            "classname": "wine-analysis",
+            "name": r["image"],
+            "time": f"{r['latency'] or 0.0:.3f}"
+        })
+        if not r["passed"]:
+            failure = ET.SubElement(case, "failure", {"message": r["failure"] or "Test failed"})
+            failure.text = "\n".join(r["output"]).strip()
+    ET.ElementTree(suite).write(path, encoding="utf-8", xml_declaration=True)
 
 def main():
     """Main test runner"""
+    parser = argparse.ArgumentParser(description="Run the wine analysis accuracy suite")
+    parser.add_argument("--api-url", default=API_BASE_URL)
+    parser.add_argument("--workers", type=int, default=1, help="Number of tests to run concurrently")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout in seconds")
+    parser.add_argument("--matching", choices=["optimal", "greedy"], default="optimal",
+                        help="How expected wines are paired with detected wines")
+    parser.add_argument("--json-report", metavar="PATH", help="Write results and latency stats as JSON")
+    parser.add_argument("--junit-report", metavar="PATH", help="Write results as JUnit XML")
+    args = parser.parse_args()
+    workers = max(1, args.workers)
+    
     print("🍷 Wine Analysis Test Runner")
     print("=" * 50)
     
@@ -332,23 +515,37 @@ def main():
         print("❌ No test cases found")
         return
     
-    print(f"📋 Found {len(expected_results)} test cases")
+    print(f"📋 Found {len(expected_results)} test cases ({workers} worker{'s' if workers != 1 else ''})")
     
     # Check if images directory exists
     if not IMAGES_DIR.exists():
         print(f"❌ Images directory not found: {IMAGES_DIR}")
         return
     
-    # Run tests
-    passed_tests = 0
-    total_tests = len(expected_results)
-    
-    for image_filename, expected_result in expected_results.items():
-        test_passed = run_single_test(image_filename, expected_result)
-        if test_passed:
-            passed_tests += 1
+    # Run tests, printing each test's buffered output as it finishes
+    order = {image_filename: i for i, image_filename in enumerate(expected_results)}
+    results = []
+    suite_start = time.perf_counter()
+    
+    with create_session(workers) as session, ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(run_single_test, image_filename, expected_result, session,
+                            args.api_url, args.timeout, args.matching)
+            for image_filename, expected_result in expected_results.items()
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            print("\n".join(result["output"]))
+            results.append(result)
+    
+    duration = time.perf_counter() - suite_start
+    results.sort(key=lambda r: order[r["image"]])
     
     # Summary
+    passed_tests = sum(1 for r in results if r["passed"])
+    total_tests = len(results)
+    stats = latency_stats(results)
+    
     print("\n" + "=" * 50)
     print("📊 TEST SUMMARY")
     print("=" * 50)
@@ -356,6 +553,17 @@ def main():
     print(f"Passed: {passed_tests}")
     print(f"Failed: {total_tests - passed_tests}")
     print(f"Success rate: {(passed_tests / total_tests) * 100:.1f}%")
+    print(f"Wall time: {duration:.2f}s")
+    if stats["count"]:
+        print(f"⏱️  Latency: min {stats['min']:.2f}s, median {stats['median']:.2f}s, "
+              f"p95 {stats['p95']:.2f}s, max {stats['max']:.2f}s")
+    
+    if args.json_report:
+        write_json_report(args.json_report, results, stats, duration)
+        print(f"💾 JSON report written to {args.json_report}")
+    if args.junit_report:
+        write_junit_report(args.junit_report, results, duration)
+        print(f"💾 JUnit report written to {args.junit_report}")
     
     if passed_tests == total_tests:
         print("\n🎉 All tests passed!")
@@ -364,4 +572,4 @@ def main():
         print("💡 Check the details above to debug issues")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
\ No newline at end of file
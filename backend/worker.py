@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Scan job worker for the /api/jobs queue
+
+Pulls queued uploads from the SQLite job queue (JOB_QUEUE_PATH) and runs them
+through the scan pipeline. Run as many worker processes as needed, on their own
+or next to the web server; they coordinate through the queue file, so it must
+be on storage every process can reach (e.g. a mounted volume).
+
+Usage: python3 worker.py --concurrency 8
+"""
+
+import argparse
+import asyncio
+import os
+
+from dotenv import load_dotenv
+
+from services.job_queue import JobQueue, JOB_QUEUE_PATH
+from services.job_worker import run_job_workers
+
+# Load environment variables
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process queued wine scan jobs")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv('JOB_WORKER_CONCURRENCY', 4)),
+                        help="Scans processed at the same time")
+    parser.add_argument("--queue", default=JOB_QUEUE_PATH, help="SQLite job queue file")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(run_job_workers(max(1, args.concurrency), JobQueue(args.queue)))
+    except KeyboardInterrupt:
+        print("Job workers: Stopped")
+
+
+if __name__ == "__main__":
+    main()